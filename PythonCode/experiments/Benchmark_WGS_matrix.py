@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+import argparse
+import csv
+import sys
+import os
+import numpy as np
+import numpy.random as rand
+from itertools import chain
+from time import time
+from scipy.sparse import csc_matrix
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.PackedKmers import kmer_count_matrix, unpack_kmers
+
+## Times forming the WGS sensing matrix from the k-mers of growing numbers of synthetic genomes (standing in for the
+#  k-mers and counts CMash keeps of every genome), with the packed k-mer codes and searchsorted that
+#  FormWGSSensingMatrix.py uses and with the sorted list of k-mer strings and list.index it used before
+
+
+def synthetic_genomes(num_genomes, kmers_per_genome, shared_fraction, k):
+    """ The k-mers (as str) and counts of num_genomes genomes, a shared_fraction of whose k-mers come from a pool
+    common to all of them """
+    num_shared = int(shared_fraction * kmers_per_genome)
+    shared = rand.randint(0, 4 ** k, size=4 * kmers_per_genome, dtype=np.uint64)
+    genomes = list()
+    for _ in range(num_genomes):
+        codes = np.unique(np.concatenate((rand.choice(shared, size=num_shared, replace=False),
+                                          rand.randint(0, 4 ** k, size=kmers_per_genome - num_shared,
+                                                       dtype=np.uint64))))
+        genomes.append(([kmer.decode() for kmer in unpack_kmers(codes, k)], rand.randint(1, 100, size=len(codes))))
+    return genomes
+
+
+def list_index_matrix(genomes):
+    """ The matrix as FormWGSSensingMatrix.py formed it before """
+    kmers = sorted(set(chain.from_iterable(genome_kmers for genome_kmers, _ in genomes)))
+    data = []
+    indices = []
+    indptr = [0]
+    for genome_kmers, genome_counts in genomes:
+        column_indices = [kmers.index(kmer) for kmer in genome_kmers]
+        sorter = sorted(range(len(column_indices)), key=column_indices.__getitem__)
+        indices += [column_indices[i] for i in sorter]
+        data += [genome_counts[i] for i in sorter]
+        indptr.append(len(indices))
+    return csc_matrix((data, indices, indptr), shape=(len(kmers), len(genomes)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks forming the WGS sensing matrix for growing numbers of synthetic genomes",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--num_genomes', type=str, help="Comma separated numbers of genomes",
+                        default="10,100,1000")
+    parser.add_argument('-m', '--kmers_per_genome', type=int, help="Number of k-mers kept per genome", default=1000)
+    parser.add_argument('-s', '--shared_fraction', type=float,
+                        help="Fraction of the k-mers of a genome drawn from a pool shared by all the genomes",
+                        default=0.5)
+    parser.add_argument('-k', '--k_size', type=int, help="k-mer size", default=21)
+    parser.add_argument('--max_list_genomes', type=int,
+                        help="Time the former list.index method up to this many genomes only (it is quadratic)",
+                        default=100)
+    parser.add_argument('-o', '--output_file', type=str, help="CSV file to write the results to",
+                        default="wgs_matrix_results.csv")
+
+    args = parser.parse_args()
+    rand.seed(0)
+
+    with open(args.output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['genomes', 'distinct k-mers', 'nonzeros', 'method', 'time'])
+        for num_genomes in [int(n) for n in args.num_genomes.split(',')]:
+            genomes = synthetic_genomes(num_genomes, args.kmers_per_genome, args.shared_fraction, args.k_size)
+
+            start = time()
+            kmers, A = kmer_count_matrix(genomes)
+            elapsed = time() - start
+            writer.writerow([num_genomes, len(kmers), A.nnz, 'packed', elapsed])
+            print(f"{num_genomes} genomes, {len(kmers)} k-mers: packed {elapsed:.3f} s")
+
+            if num_genomes <= args.max_list_genomes:
+                start = time()
+                A_list = list_index_matrix(genomes)
+                list_elapsed = time() - start
+                assert abs(A_list - A).max() == 0, "The two methods disagree"
+                writer.writerow([num_genomes, len(kmers), A.nnz, 'list.index', list_elapsed])
+                print(f"{num_genomes} genomes, {len(kmers)} k-mers: list.index {list_elapsed:.3f} s")
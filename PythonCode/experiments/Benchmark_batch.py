@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+import argparse
+import sys
+import os
+import numpy as np
+import numpy.random as rand
+import scipy.io as sio
+from time import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.MinDivLP import MinDivLP, MinDivLP_batch
+from PythonCode.src.ParallelMinDivLP import MinDivLP_parallel
+
+## Compares the throughput (samples per second) of calling MinDivLP once per sample with that of MinDivLP_batch and of
+#  MinDivLP_parallel on a batch of simulated samples against the same reference
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the sample throughput of MinDivLP_batch against per-sample MinDivLP calls",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_dir', type=str, help="Directory containing the sensing matrices",
+                        default="../data")
+    parser.add_argument('-r', '--reference', type=str, help="Reference name the sensing matrices were formed from",
+                        default="97_otus.fasta")
+    parser.add_argument('-s', '--small_k', type=int, help="k-mer size of A_k_small", default=4)
+    parser.add_argument('-l', '--large_k', type=int, help="k-mer size of A_k_large", default=8)
+    parser.add_argument('-n', '--num_cols', type=int, help="Number of columns of the sensing matrices to use",
+                        default=10000)
+    parser.add_argument('-b', '--batch_size', type=int, help="Number of simulated samples", default=50)
+    parser.add_argument('-w', '--workers', type=int, help="Number of worker processes for MinDivLP_parallel",
+                        default=4)
+    parser.add_argument('--support_size', type=int, help="Support size of each simulated sample", default=25)
+
+    args = parser.parse_args()
+    q = 0.1
+    const = 10000
+
+    A_k_small = sio.loadmat(os.path.join(args.data_dir, f"{args.reference}_A_{args.small_k}.mat"))['A_k']
+    A_k_large = sio.loadmat(os.path.join(args.data_dir, f"{args.reference}_A_{args.large_k}.mat"))['A_k']
+    num_cols = min(args.num_cols, A_k_small.shape[1])
+    A_k_small = A_k_small[:, 0:num_cols].tocsc()
+    A_k_large = A_k_large[:, 0:num_cols].tocsc()
+
+    ## Simulate the batch of samples
+    true_X = np.zeros((num_cols, args.batch_size))
+    for sample in range(args.batch_size):
+        true_X[rand.choice(num_cols, size=args.support_size, replace=False), sample] = rand.random(args.support_size)
+    true_X = true_X / np.sum(true_X, axis=0)
+    Y_small = A_k_small @ true_X
+    Y_large = A_k_large @ true_X
+
+    start = time()
+    for sample in range(args.batch_size):
+        MinDivLP(A_k_small, A_k_large, Y_small[:, sample], Y_large[:, sample], const, q)
+    per_sample_time = time() - start
+    print(f"MinDivLP per sample: {args.batch_size / per_sample_time:.3f} samples per second")
+
+    start = time()
+    MinDivLP_batch(A_k_small, A_k_large, Y_small, Y_large, const, q)
+    batch_time = time() - start
+    print(f"MinDivLP_batch: {args.batch_size / batch_time:.3f} samples per second")
+
+    start = time()
+    for _ in MinDivLP_parallel(A_k_small, A_k_large, ((Y_small[:, sample], Y_large[:, sample])
+                                                      for sample in range(args.batch_size)), const, q,
+                               workers=args.workers, ordered=False):
+        pass
+    parallel_time = time() - start
+    print(f"MinDivLP_parallel ({args.workers} workers): {args.batch_size / parallel_time:.3f} samples per second")
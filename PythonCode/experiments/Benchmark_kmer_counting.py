@@ -0,0 +1,73 @@
+#! /usr/bin/env python3
+import argparse
+import csv
+import shutil
+import subprocess
+import sys
+import os
+import tracemalloc
+import numpy as np
+from time import time
+from scipy.sparse import coo_matrix
+from sklearn.preprocessing import normalize
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.CountKmers import sensing_matrix
+
+## Compares the built-in numpy k-mer counter with dna-utils' kmer_counts_per_sequence (when it is installed) on forming
+#  the sensing matrix of a FASTA file, reporting the time, the peak Python memory and whether the matrices agree
+
+
+def dna_utils_matrix(input_file, k, count_complements):
+    """ The sensing matrix as Form16SSensingMatrix forms it with dna-utils """
+    res = subprocess.run(f"kmer_counts_per_sequence -i {input_file} -k {k} {count_complements * '-c'} -s", shell=True,
+                         stdout=subprocess.PIPE)
+    J, I, V = np.array(list(map(int, res.stdout.decode('utf-8').split()))).reshape((-2, 3)).transpose()
+    return normalize(coo_matrix((V, (I, J)), shape=(4 ** k, J[-1] + 1)), norm='l1', axis=0)
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time()
+    A = build()
+    elapsed = time() - start
+    peak_memory = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return A, elapsed, peak_memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the built-in k-mer counter against dna-utils on forming a sensing matrix",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input_file', type=str, help="FASTA file to form the sensing matrix of",
+                        default=os.path.join(os.path.dirname(__file__), "../data/mock_16S_metagenome.fa"))
+    parser.add_argument('-k', '--k_sizes', type=str, help="Comma separated k-mer sizes", default="4,6,8,10,12")
+    parser.add_argument('-c', '--count_complements', action="store_true",
+                        help="count compliment of sequences as well", default=False)
+    parser.add_argument('--chunk_size', type=int,
+                        help="Count the sequences this many at a time with the numpy counter", default=None)
+    parser.add_argument('-o', '--output_file', type=str, help="CSV file to write the results to",
+                        default="kmer_counting_results.csv")
+
+    args = parser.parse_args()
+    have_dna_utils = shutil.which("kmer_counts_per_sequence") is not None
+    if not have_dna_utils:
+        print("dna-utils is not installed, timing the numpy counter only")
+
+    with open(args.output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['k', 'engine', 'time', 'peak memory (MB)', 'nonzeros', 'matches dna-utils'])
+        for k in [int(k) for k in args.k_sizes.split(',')]:
+            A, elapsed, peak_memory = measure(
+                lambda: sensing_matrix(args.input_file, k, args.count_complements, args.chunk_size))
+            match = ''
+            if have_dna_utils:
+                A_dna_utils, dna_utils_elapsed, dna_utils_peak = measure(
+                    lambda: dna_utils_matrix(args.input_file, k, args.count_complements))
+                # dna-utils leaves out trailing sequences without any k-mer
+                match = abs(A[:, :A_dna_utils.shape[1]] - A_dna_utils).max() < 1e-12
+                writer.writerow([k, 'dna-utils', dna_utils_elapsed, dna_utils_peak, A_dna_utils.nnz, ''])
+                print(f"k={k}: dna-utils {dna_utils_elapsed:.3f} s, {dna_utils_peak:.1f} MB")
+            writer.writerow([k, 'numpy', elapsed, peak_memory, A.nnz, match])
+            print(f"k={k}: numpy {elapsed:.3f} s, {peak_memory:.1f} MB{'' if match == '' else f', matches: {match}'}")
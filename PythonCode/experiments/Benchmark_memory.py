@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+import argparse
+import csv
+import resource
+import sys
+import os
+import numpy as np
+import numpy.random as rand
+import scipy.io as sio
+from multiprocessing import get_context
+from time import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.MinDivLP import MinDivLP
+
+## Records the peak resident memory of a MinDivLP solve as the k-mer size of A_k_large grows. Each k size runs in a
+#  fresh, spawned process (a forked one would start from the resident memory of the parent), so the peaks of one do not
+#  hide those of the next, and the peaks are also reported over the baseline of the process before it loads anything.
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KB on Linux
+
+
+def measure(data_dir, reference, small_k, large_k, num_cols, support_size, densify):
+    baseline = peak_rss_mb()
+    A_k_small = sio.loadmat(os.path.join(data_dir, f"{reference}_A_{small_k}.mat"))['A_k']
+    A_k_large = sio.loadmat(os.path.join(data_dir, f"{reference}_A_{large_k}.mat"))['A_k']
+    num_cols = min(num_cols, A_k_small.shape[1])
+    A_k_small = A_k_small[:, 0:num_cols].tocsc()
+    A_k_large = A_k_large[:, 0:num_cols].tocsc()
+
+    true_x = np.zeros(num_cols)
+    true_x[rand.choice(num_cols, size=min(support_size, num_cols), replace=False)] = 1
+    true_x = true_x / sum(true_x)
+    y_small = A_k_small @ true_x
+    y_large = A_k_large @ true_x
+    loaded = peak_rss_mb()
+
+    start = time()
+    if densify:  # the former behaviour of the callers, for comparison
+        MinDivLP(A_k_small.toarray(), A_k_large, y_small, y_large, 10000, 0.1)
+    else:
+        MinDivLP(A_k_small, A_k_large, y_small, y_large, 10000, 0.1)
+    return A_k_large.shape[0], A_k_large.nnz, baseline, loaded, peak_rss_mb(), time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the peak resident memory of MinDivLP for growing k-mer sizes of A_k_large",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_dir', type=str, help="Directory containing the sensing matrices",
+                        default="../data")
+    parser.add_argument('-r', '--reference', type=str, help="Reference name the sensing matrices were formed from",
+                        default="97_otus.fasta")
+    parser.add_argument('-s', '--small_k', type=int, help="k-mer size of A_k_small", default=4)
+    parser.add_argument('-k', '--k_sizes', type=str, help="Comma separated k-mer sizes of A_k_large",
+                        default="4,6,8,10,12")
+    parser.add_argument('-n', '--num_cols', type=int, help="Number of columns of the sensing matrices to use",
+                        default=10000)
+    parser.add_argument('--support_size', type=int, help="Support size of the simulated ground truth", default=50)
+    parser.add_argument('--densify', action="store_true",
+                        help="Pass A_k_small to MinDivLP as a dense array (as the callers used to)", default=False)
+    parser.add_argument('-o', '--output_file', type=str, help="CSV file to write the results to",
+                        default="memory_results.csv")
+
+    args = parser.parse_args()
+    context = get_context('spawn')
+
+    with open(args.output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['large k', 'rows', 'nonzeros', 'densify', 'baseline RSS (MB)', 'RSS after loading (MB)',
+                         'peak RSS (MB)', 'peak RSS over baseline (MB)', 'solve time'])
+        for large_k in [int(k) for k in args.k_sizes.split(',')]:
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                rows, nnz, baseline, loaded, peak, elapsed = pool.apply(
+                    measure, (args.data_dir, args.reference, args.small_k, large_k, args.num_cols,
+                              args.support_size, args.densify))
+            writer.writerow([large_k, rows, nnz, args.densify, baseline, loaded, peak, peak - baseline, elapsed])
+            print(f"k={large_k}: {rows} rows, {nnz} nonzeros, {baseline:.1f} MB baseline, {loaded:.1f} MB after "
+                  f"loading, {peak:.1f} MB peak ({peak - baseline:.1f} MB over the baseline), {elapsed:.3f} s")
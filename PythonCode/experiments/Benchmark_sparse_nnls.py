@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+import argparse
+import csv
+import tracemalloc
+import sys
+import os
+import numpy as np
+import numpy.random as rand
+import scipy.io as sio
+from time import time
+from scipy.sparse import vstack
+from scipy.sparse.linalg import lsqr
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.sparse_nnls import sparse_nnls, SolverStats, ActiveColumns
+
+## Times the sparse_nnls methods on MinDivLP-shaped problems (the f row stacked on top of const * A_k_small) for
+#  growing support sizes of the simulated ground truth and reports the solve time per outer iteration. With
+#  --lsqr_operator it instead times a single lsqr subproblem on positive sets of the support sizes, through the
+#  ActiveColumns operator and through a sliced CSC copy of the positive set columns (slice included), with the same
+#  number of lsqr iterations
+
+
+def time_lsqr_operator(C, d, support_size):
+    """ The times of one lsqr solve on support_size random columns of C through ActiveColumns and through slicing,
+    and the number of lsqr iterations of both """
+    cols = rand.choice(C.shape[1], size=support_size, replace=False)
+    start = time()
+    active = ActiveColumns(C)
+    for j in cols:
+        active.add(j)
+    iterations = lsqr(active, d)[2]
+    operator_time = time() - start
+    start = time()
+    lsqr(C[:, cols], d, iter_lim=iterations)
+    slicing_time = time() - start
+    return operator_time, slicing_time, iterations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the time per iteration of the sparse_nnls methods as the support size grows",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_dir', type=str, help="Directory containing the sensing matrices",
+                        default="../data")
+    parser.add_argument('-r', '--reference', type=str, help="Reference name the sensing matrices were formed from",
+                        default="97_otus.fasta")
+    parser.add_argument('-s', '--small_k', type=int, help="k-mer size of A_k_small", default=4)
+    parser.add_argument('-l', '--large_k', type=int, help="k-mer size of A_k_large", default=6)
+    parser.add_argument('-n', '--num_cols', type=int, help="Number of columns of the sensing matrices to use",
+                        default=10000)
+    parser.add_argument('--support_sizes', type=str, help="Comma separated support sizes of the ground truth",
+                        default="10,25,50,100,200")
+    parser.add_argument('--methods', type=str,
+                        help="Comma separated sparse_nnls methods to compare (append ':warm' to warm start lsqr)",
+                        default="lsqr,lsqr:warm,qr,gram")
+    parser.add_argument('-b', '--block_size', type=int,
+                        help="Number of columns admitted per outer iteration of sparse_nnls", default=1)
+    parser.add_argument('-m', '--memory', action="store_true",
+                        help="Also record the peak memory allocated during each solve and the number and size of the "
+                             "blocks it allocated that are still held after it (from a tracemalloc snapshot diff; slows "
+                             "the solves down)",
+                        default=False)
+    parser.add_argument('--lsqr_operator', action="store_true",
+                        help="Time one lsqr subproblem through the active column operator and through slicing instead",
+                        default=False)
+    parser.add_argument('-o', '--output_file', type=str, help="CSV file to write the results to",
+                        default="sparse_nnls_results.csv")
+
+    args = parser.parse_args()
+    support_sizes = [int(s) for s in args.support_sizes.split(',')]
+    methods = args.methods.split(',')
+    q = 0.1
+    const = 10000
+
+    A_k_small = sio.loadmat(os.path.join(args.data_dir, f"{args.reference}_A_{args.small_k}.mat"))['A_k']
+    A_k_large = sio.loadmat(os.path.join(args.data_dir, f"{args.reference}_A_{args.large_k}.mat"))['A_k']
+    num_cols = min(args.num_cols, A_k_small.shape[1])
+    A_k_small = A_k_small[:, 0:num_cols].tocsc()
+    A_k_large = A_k_large[:, 0:num_cols].tocsc()
+    B = A_k_large > 0
+
+    if args.lsqr_operator:
+        with open(args.output_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(['support size', 'lsqr iterations', 'operator time', 'slicing time'])
+            C = vstack((rand.random((1, num_cols)), const * A_k_small)).tocsc()
+            d = np.append(0, const * (A_k_small @ rand.random(num_cols)))
+            for support_size in support_sizes:
+                operator_time, slicing_time, iterations = time_lsqr_operator(C, d, support_size)
+                writer.writerow([support_size, iterations, operator_time, slicing_time])
+                print(f"support {support_size}: {iterations} lsqr iterations, operator {operator_time:.3f} s, "
+                      f"slicing {slicing_time:.3f} s")
+        sys.exit()
+
+    with open(args.output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['method', 'support size', 'solution support', 'time', 'time per iteration',
+                         'outer iterations', 'inner iterations', 'solve time', 'update time', 'gradient time',
+                         'lsqr calls', 'lsqr iterations', 'peak memory (MB)', 'net allocated blocks',
+                         'net allocated memory (MB)'])
+
+        for support_size in support_sizes:
+            ## Create the simulated ground truth and the MinDivLP system
+            true_x = np.zeros(num_cols)
+            true_x[rand.choice(num_cols, size=support_size, replace=False)] = rand.random(support_size)
+            true_x = true_x / sum(true_x)
+            y_small = A_k_small @ true_x
+            y_large = A_k_large @ true_x
+            f_row = 1 / (np.power(B.T @ y_large, 1 - q) + 0.0001)
+            C = vstack((f_row.reshape(1, -1), const * A_k_small)).tocsc()
+            d = np.append(0, const * y_small)
+
+            for method in methods:
+                stats = SolverStats()
+                if args.memory:
+                    tracemalloc.start()
+                    before = tracemalloc.take_snapshot()
+                    tracemalloc.reset_peak()
+                start = time()
+                x = sparse_nnls(C, d, method=method.split(':')[0], warm_start=method.endswith(':warm'),
+                                block_size=args.block_size, stats=stats)
+                elapsed = time() - start
+                peak_memory = allocated_blocks = allocated_memory = float('nan')
+                if args.memory:
+                    peak_memory = tracemalloc.get_traced_memory()[1] / 1e6
+                    # the blocks allocated during the solve that are still held (the solution, caches, ...), less
+                    # those it freed, leaving out tracemalloc's own
+                    untraced = [tracemalloc.Filter(False, tracemalloc.__file__)]
+                    differences = tracemalloc.take_snapshot().filter_traces(untraced).compare_to(
+                        before.filter_traces(untraced), 'filename')
+                    allocated_blocks = sum(difference.count_diff for difference in differences)
+                    allocated_memory = sum(difference.size_diff for difference in differences) / 1e6
+                    del before, differences
+                    tracemalloc.stop()
+                iterations = max(stats.outer_iterations, 1)
+                writer.writerow([method, support_size, np.sum(x > 0), elapsed, elapsed / iterations,
+                                 stats.outer_iterations, stats.inner_iterations, stats.solve_time, stats.update_time,
+                                 stats.gradient_time, len(stats.lsqr_iterations), sum(stats.lsqr_iterations),
+                                 peak_memory, allocated_blocks, allocated_memory])
+                print(f"{method}: support {support_size}, {elapsed:.3f} s, {elapsed / iterations:.5f} s per iteration "
+                      f"over {stats.outer_iterations} iterations, {sum(stats.lsqr_iterations)} lsqr iterations over "
+                      f"{len(stats.lsqr_iterations)} calls")
@@ -28,6 +28,7 @@ N = 20  # iterations at each combination of k_size, num_cols, support_size
 ## Other parameters
 q = .1  # fixed, small q value s.t. 0<q<1
 lamb = 10000  # lambda
+block_size = 1  # columns admitted per sparse_nnls outer iteration (raise for the larger support sizes, e.g. 50)
 
 
 ## Define testing function to parallelize
@@ -71,8 +72,8 @@ def test(large_k, col_counts, support_sizes, N, q, lamb, csvname):
 
                 ## Noisy computations
                 start_time = time.time()
-                x_star = MinDivLP(A_k_small.toarray(), A_k_large, y_small_noise, y_large_true, lamb, q).reshape(
-                    num_cols, 1)
+                x_star = MinDivLP(A_k_small, A_k_large, y_small_noise, y_large_true, lamb, q,
+                                  block_size=block_size).reshape(num_cols, 1)
                 times.append(time.time() - start_time)
 
             ## Append csv file with results
@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+import argparse
+import csv
+import sys
+import os
+import tracemalloc
+from time import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.CountKmers import sensing_matrix, y_vector
+from PythonCode.src.SupportPattern import SupportPattern
+
+## Compares the peak Python memory of forming a sample's y vector and its MinDivLP diversity weights with a dense 4^k
+#  y vector and with a sparse one holding the observed k-mers only. The support pattern of the reference is formed
+#  before the measurement starts, so only the per sample memory is counted.
+
+
+def measure(pattern, input_file, k, count_complements, sparse):
+    tracemalloc.start()
+    start = time()
+    y = y_vector(input_file, k, count_complements, dtype=float, sparse=sparse)
+    pattern.weights(y, 0.1)
+    elapsed = time() - start
+    peak_memory = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return y.nnz if sparse else int((y > 0).sum()), elapsed, peak_memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the peak memory of dense against sparse y vectors for large k-mer sizes",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input_file', type=str, help="FASTA or FASTQ sample to form the y vector of",
+                        default=os.path.join(os.path.dirname(__file__), "../data/mock_16S_metagenome.fa"))
+    parser.add_argument('-r', '--reference', type=str, help="FASTA file to form the sensing matrix of",
+                        default=os.path.join(os.path.dirname(__file__), "../data/mock_16S_metagenome.fa"))
+    parser.add_argument('-k', '--k_sizes', type=str, help="Comma separated k-mer sizes", default="12,14")
+    parser.add_argument('-c', '--count_complements', action="store_true",
+                        help="count compliment of sequences as well", default=False)
+    parser.add_argument('-o', '--output_file', type=str, help="CSV file to write the results to",
+                        default="y_memory_results.csv")
+
+    args = parser.parse_args()
+
+    with open(args.output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['k', 'y', 'observed k-mers', 'time', 'peak memory (MB)'])
+        for k in [int(k) for k in args.k_sizes.split(',')]:
+            pattern = SupportPattern.from_matrix(sensing_matrix(args.reference, k, args.count_complements))
+            for sparse in [False, True]:
+                observed, elapsed, peak_memory = measure(pattern, args.input_file, k, args.count_complements, sparse)
+                kind = 'sparse' if sparse else 'dense'
+                writer.writerow([k, kind, observed, elapsed, peak_memory])
+                print(f"k={k}: {kind} y, {observed} observed k-mers, {elapsed:.3f} s, {peak_memory:.1f} MB")
@@ -3,14 +3,13 @@ import argparse
 import os
 import sys
 import subprocess
-import tempfile
-import scipy.io as sio
 from pandas import read_csv
 from csv import writer
+from fcntl import flock, LOCK_EX, LOCK_UN
 from time import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
-from src.MinDivLP import MinDivLP
-from src.ConvertXToTaxonomicProfile import convertToTaxonomy
+from src.ReferenceSet import ReferenceSet
+from src.ArtifactCache import ArtifactCache
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -32,6 +31,13 @@ if __name__ == '__main__':
     parser.add_argument('-t', '--taxonomy', type=str, help="File name of reference taxonomy", required=True)
     parser.add_argument('-p', '--prevent_output', action="store_true",
                         help="stop output", default=False)
+    parser.add_argument('--cache_dir', type=str,
+                        help="Directory of a cache of sensing matrices and y vectors keyed by the contents of their "
+                             "inputs and their parameters, so that reruns of a parameter sweep skip unchanged work "
+                             "(default: the MINDIVLP_CACHE_DIR environment variable, else no cache)", default=None)
+    parser.add_argument('--cache_size', type=float,
+                        help="Size limit of the cache in GB, beyond which the least recently used entries are removed",
+                        default=20)
 
     args = parser.parse_args()
     input_file = os.path.abspath(args.input_file)
@@ -59,55 +65,17 @@ if __name__ == '__main__':
     if not os.path.exists(taxonomy):
         raise Exception(f"The reference taxonomy file {taxonomy} does not appear to exist")
 
-    ## Create sensing matrices if they have not been created, and load them
+    ## Load the reference: the sensing matrices (formed in one pass over the reference if they do not exist yet), the
+    ## OTU ids and the taxonomy
 
-    # large_k
-    if not os.path.exists(f"{reference}_A_{large_k}.mat"):
-        path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../src/Form16SSensingMatrix.py'))
-        to_run = f"""python "{path}" -k {large_k} -i "{reference}" -o "{reference}_A_{large_k}.mat" {count_rev * '-c'}"""
-        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL)
-        if res.returncode != 0:
-            raise Exception("Failed to form large sensing matrix")
-
-    A_k_large = sio.loadmat(f"{reference}_A_{large_k}.mat")['A_k']
-
-    # small_k
-    if not os.path.exists(f"{reference}_A_{small_k}.mat"):
-        path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../src/Form16SSensingMatrix.py'))
-        to_run = f"""python "{path}" -k {small_k} -i "{reference}" -o "{reference}_A_{small_k}.mat" {count_rev * '-c'}"""
-        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL)
-        if res.returncode != 0:
-            raise Exception("Failed to form small sensing matrix")
-
-    A_k_small = sio.loadmat(f"{reference}_A_{small_k}.mat")['A_k']
-
-    ## Create y vectors:
-
-    with tempfile.NamedTemporaryFile() as temp_file:
-        t_file = temp_file.name
-        path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../src/Form16SyVector.py'))
-
-        # large_k
-        to_run = f"""python "{path}" -k "{large_k}" -i "{input_file}" -o "{t_file}" {count_rev * '-c'}"""
-        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL)
-        if res.returncode != 0:
-            raise Exception("Failed to form large y vector")
-
-        y_large = sio.loadmat(t_file)['y'].T
-
-        # small_k
-        to_run = f"""python "{path}" -k {small_k} -i "{input_file}" -o "{t_file}" {count_rev * '-c'}"""
-        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL)
-        if res.returncode != 0:
-            raise Exception("Failed to form small y vector")
-
-        y_small = sio.loadmat(t_file)['y'].T
+    reference_set = ReferenceSet(reference, taxonomy, small_k, large_k, const, q, count_complements=count_rev,
+                                 cache=ArtifactCache.from_args(args.cache_dir, args.cache_size))
 
-    ## Run MinDivLP
+    ## Create y vectors (both k sizes in one pass over the reads, in memory) and run MinDivLP
 
     print("Running MinDivLP and saving.")
 
-    x = MinDivLP(A_k_small, A_k_large, y_small, y_large, const, q)
+    x = reference_set.reconstruct(input_file)
 
     if not prevent_output:
         ## Convert to TSV, then to BIOM
@@ -121,7 +89,7 @@ if __name__ == '__main__':
         else:
             sample_id = "sample"
 
-        convertToTaxonomy(x, reference, taxonomy, sample_id, tsv_file)
+        reference_set.write_profile(x, sample_id, tsv_file, append=True)
 
         to_run = f"""biom convert -i "{tsv_file}" -o "{biom_file}" --to-json --process-obs-metadata taxonomy"""
         res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL)
@@ -134,6 +102,10 @@ if __name__ == '__main__':
         # Print info useful for checking progress of code
         print([output_dir.split('/')[-4], small_k, large_k, const, q, timer])
 
-        # Record times
+        # Record times, holding a lock on the file so that runs in parallel do not interleave their rows (for many
+        # samples, MinDivLPService.py --manifest loads the reference once and records per stage times)
         with open('times.csv', 'a') as fd:
+            flock(fd, LOCK_EX)
             writer(fd).writerow([output_dir.split('/')[-4], small_k, large_k, const, q, timer])
+            fd.flush()
+            flock(fd, LOCK_UN)
@@ -11,6 +11,7 @@ import traceback
 sys.path.append(os.path.abspath("../../.."))
 from PythonCode.experiments.simulated_benchmark.make_true_x import make_true_x
 from PythonCode.src.MinDivLP import MinDivLP
+from PythonCode.src.CountKmers import y_vectors
 from scipy.linalg import norm
 
 ## Data writing information
@@ -88,44 +89,22 @@ def simulate(large_k, mock_maker, csv_name, bbmap_dir):
                     # Create A_k_small and A_k_large from mock reference database
                     if reference_genome:
 
-                        with tempfile.NamedTemporaryFile() as temp_file:
-                            output_file = temp_file.name
+                        with tempfile.TemporaryDirectory() as temp_dir:
+                            output_prefix = os.path.join(temp_dir, "reference")
 
-                            to_run = f"python ../../src/Form16SSensingMatrix.py -k {small_k} -i {reference_genome} -o {output_file}"
+                            # both k sizes in one pass over the reference
+                            to_run = f"python ../../src/Form16SSensingMatrix.py --k_sizes {small_k},{large_k} -i {reference_genome} -o {output_prefix}"
                             res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL,
                                                  stderr=subprocess.DEVNULL)
                             if res.returncode != 0:
-                                raise Exception("Failed to form A_k_small")
+                                raise Exception("Failed to form A_k_small and A_k_large")
 
-                            A_k_small = sio.loadmat(output_file)['A_k']
+                            A_k_small = sio.loadmat(f"{output_prefix}_A_{small_k}.mat")['A_k']
+                            A_k_large = sio.loadmat(f"{output_prefix}_A_{large_k}.mat")['A_k']
 
-                            to_run = f"python ../../src/Form16SSensingMatrix.py -k {large_k} -i {reference_genome} -o {output_file}"
-                            res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL,
-                                                 stderr=subprocess.DEVNULL)
-                            if res.returncode != 0:
-                                raise Exception("Failed to form A_k_large")
-
-                            A_k_large = sio.loadmat(output_file)['A_k']
-
-                    # Create y_small and y_large
-                    with tempfile.NamedTemporaryFile() as temp_file:
-                        output_file = temp_file.name
-
-                        to_run = f"python ../../src/Form16SyVector.py -k {small_k} -i mock_16S_metagenome.fa -o {output_file}"
-                        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL,
-                                             stderr=subprocess.DEVNULL)
-                        if res.returncode != 0:
-                            raise Exception("Failed to form y_small")
-
-                        y_small = sio.loadmat(output_file)['y'].T
-
-                        to_run = f"python ../../src/Form16SyVector.py -k {large_k} -i mock_16S_metagenome.fa -o {output_file}"
-                        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL,
-                                             stderr=subprocess.DEVNULL)
-                        if res.returncode != 0:
-                            raise Exception("Failed to form y_large")
-
-                        y_large = sio.loadmat(output_file)['y'].T
+                    # Create y_small and y_large, in one pass over the reads
+                    y = y_vectors("mock_16S_metagenome.fa", [small_k, large_k], dtype=float)
+                    y_small, y_large = y[small_k], y[large_k]
 
                     for q in q_vals:
 
@@ -136,7 +115,7 @@ def simulate(large_k, mock_maker, csv_name, bbmap_dir):
                             if full_reference_genome:  # Do so only if location is entered
 
                                 # Reconstruct true_x_full with MinDivLP
-                                x_star = MinDivLP(A_k_small_full.toarray(), A_k_large_full, y_small, y_large, const, q)
+                                x_star = MinDivLP(A_k_small_full, A_k_large_full, y_small, y_large, const, q)
 
                                 # Calculate error and support data
                                 l1error = norm(true_x_full - x_star, 1)
@@ -158,7 +137,7 @@ def simulate(large_k, mock_maker, csv_name, bbmap_dir):
                             if reference_genome:  # Do so only if location is entered
 
                                 # Reconstruct true_x with MinDivLP
-                                x_star = MinDivLP(A_k_small.toarray(), A_k_large, y_small, y_large, const, q)
+                                x_star = MinDivLP(A_k_small, A_k_large, y_small, y_large, const, q)
 
                                 # Calculate error and support data
                                 l1error = norm(true_x - x_star, 1)
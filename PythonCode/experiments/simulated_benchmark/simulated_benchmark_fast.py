@@ -1,6 +1,5 @@
 import sys
 import os
-import tempfile
 import subprocess
 import csv
 import numpy as np
@@ -13,6 +12,7 @@ import matplotlib.pyplot as plt
 sys.path.append(os.path.abspath("../../.."))
 from PythonCode.experiments.simulated_benchmark.make_true_x import make_true_x
 from PythonCode.src.MinDivLP import MinDivLP
+from PythonCode.src.CountKmers import y_vectors
 from scipy.linalg import norm
 
 ## Data writing information
@@ -75,64 +75,50 @@ def simulate(mock_maker, csv_name, bbmap_dir):
                     error_type, error, _ = sys.exc_info()
                     raise Exception(f"error_type: {error_type}\n error: {error}")
 
+                # y vectors of the sample for all the k sizes, in one pass over its reads
+                y = y_vectors("mock_16S_metagenome.fa", small_k_vals + large_k_vals, dtype=float)
+
                 for large_k in large_k_vals:
-                    with tempfile.NamedTemporaryFile() as temp_file:
-                        output_file = temp_file.name
-                        # load large matrix
-                        A_k_large_full = sio.loadmat(f"../../data/97_otus.fasta_A_{large_k}.mat")['A_k'][:, 0:10000]
-                        # create large y vector
-                        to_run = f"python ../../src/Form16SyVector.py -k {large_k} -i mock_16S_metagenome.fa -o {output_file}"
-                        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL,
-                                             stderr=subprocess.DEVNULL)
-                        if res.returncode != 0:
-                            raise Exception("Failed to form y_large")
-
-                        y_large = sio.loadmat(output_file)['y'].T
-
-                        for small_k in small_k_vals:
-                            # load small matrix
-                            A_k_small_full = sio.loadmat(f"../../data/97_otus.fasta_A_{small_k}.mat")['A_k'][:, 0:10000]
-                            # create small y vector
-
-                            to_run = f"python ../../src/Form16SyVector.py -k {small_k} -i mock_16S_metagenome.fa -o {output_file}"
-                            res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL,
-                                                 stderr=subprocess.DEVNULL)
-                            if res.returncode != 0:
-                                raise Exception("Failed to form y_small")
-
-                            y_small = sio.loadmat(output_file)['y'].T
-
-                            for q in q_vals:
-
-                                for const in lambda_vals:
-
-                                        # Reconstruct true_x with MinDivLP
-                                        x_star = MinDivLP(A_k_small_full.toarray(), A_k_large_full, y_small, y_large, const, q)
-                                        x_star_quikr = nnls(np.vstack((np.ones((1, A_k_small_full.shape[1])), const * A_k_small_full.todense())), np.append(0, const * y_small))[0]
-                                        x_star_quikr = x_star_quikr / sum(x_star_quikr)
-
-                                        # Calculate error and support data
-                                        l1error = norm(true_x - x_star, 1)
-                                        quikr_error = norm(true_x - x_star_quikr, 1)
-                                        supp_x_star = np.where(x_star > 0)[0]
-                                        supp_true_x = np.where(true_x > 0)[0]
-                                        support_in_common = np.intersect1d(supp_true_x, supp_x_star)
-
-                                        ## Append csv file with results
-                                        with open(csv_name, "a", newline="") as f:
-                                            writer = csv.writer(f)
-                                            writer.writerow(
-                                                [small_k, large_k, support_size, coverage, q, const, 1, l1error,
-                                                 len(supp_x_star), len(support_in_common),
-                                                 calculateDiv(true_x, A_k_large_full, q),
-                                                 calculateDiv(x_star, A_k_large_full, q), quikr_error])
-                                        # If you want step by step visualizations
-                                        #plt.scatter(true_x, x_star)
-                                        #plt.xlabel('True x')
-                                        #plt.ylabel('Reconstructed x')
-                                        #plt.title(f"|A_k_small_full*true_x*true_x - y_small| = {np.sum(np.abs(A_k_small_full*true_x - y_small))}")
-                                        #plt.show()
-                                        #input("Press any key to continue")
+                    # load large matrix
+                    A_k_large_full = sio.loadmat(f"../../data/97_otus.fasta_A_{large_k}.mat")['A_k'][:, 0:10000]
+                    y_large = y[large_k]
+
+                    for small_k in small_k_vals:
+                        # load small matrix
+                        A_k_small_full = sio.loadmat(f"../../data/97_otus.fasta_A_{small_k}.mat")['A_k'][:, 0:10000]
+                        y_small = y[small_k]
+
+                        for q in q_vals:
+
+                            for const in lambda_vals:
+
+                                    # Reconstruct true_x with MinDivLP
+                                    x_star = MinDivLP(A_k_small_full, A_k_large_full, y_small, y_large, const, q)
+                                    x_star_quikr = nnls(np.vstack((np.ones((1, A_k_small_full.shape[1])), const * A_k_small_full.todense())), np.append(0, const * y_small))[0]
+                                    x_star_quikr = x_star_quikr / sum(x_star_quikr)
+
+                                    # Calculate error and support data
+                                    l1error = norm(true_x - x_star, 1)
+                                    quikr_error = norm(true_x - x_star_quikr, 1)
+                                    supp_x_star = np.where(x_star > 0)[0]
+                                    supp_true_x = np.where(true_x > 0)[0]
+                                    support_in_common = np.intersect1d(supp_true_x, supp_x_star)
+
+                                    ## Append csv file with results
+                                    with open(csv_name, "a", newline="") as f:
+                                        writer = csv.writer(f)
+                                        writer.writerow(
+                                            [small_k, large_k, support_size, coverage, q, const, 1, l1error,
+                                             len(supp_x_star), len(support_in_common),
+                                             calculateDiv(true_x, A_k_large_full, q),
+                                             calculateDiv(x_star, A_k_large_full, q), quikr_error])
+                                    # If you want step by step visualizations
+                                    #plt.scatter(true_x, x_star)
+                                    #plt.xlabel('True x')
+                                    #plt.ylabel('Reconstructed x')
+                                    #plt.title(f"|A_k_small_full*true_x*true_x - y_small| = {np.sum(np.abs(A_k_small_full*true_x - y_small))}")
+                                    #plt.show()
+                                    #input("Press any key to continue")
 
 
 if __name__ == '__main__':
@@ -1,4 +1,3 @@
-import scipy.io as sio
 import numpy as np
 import numpy.random as rand
 import time
@@ -6,6 +5,7 @@ import sys
 import os
 sys.path.append(os.path.abspath("../.."))  # make sure python knows where to find the code
 from PythonCode.src.MinDivLP import MinDivLP
+from PythonCode.src.SensingMatrixIO import load_sensing_matrix
 from numpy.linalg import norm
 from matplotlib import pyplot as plt
 
@@ -14,13 +14,9 @@ from matplotlib import pyplot as plt
 small_k = 4  # smaller k-mer size
 large_k = 6  # larger k-mer size
 
-A_k = sio.loadmat('../data/97_otus_subset.fasta_A_%d.mat' % large_k)
-A_k_large = A_k['A_k']
-
-A_k = sio.loadmat('../data/97_otus_subset.fasta_A_%d.mat' % small_k)
-A_k_small = A_k['A_k']
-
-del A_k
+# memory-mapped from the .csc artifacts if SensingMatrixIO.py has converted the .mat files
+A_k_large = load_sensing_matrix('../data/97_otus_subset.fasta_A_%d.mat' % large_k)
+A_k_small = load_sensing_matrix('../data/97_otus_subset.fasta_A_%d.mat' % small_k)
 
 ## sub-select the data so things run quickly
 cols_vs_rows = 3  # fix 3-times more columns than rows
@@ -58,7 +54,7 @@ y_small_noise = y_small_noise / sum(y_small_noise)
 
 const = 10000
 start = time.time()
-x_star = MinDivLP(A_k_small.toarray(), A_k_large.toarray(), y_small_noise, y_large_true, const, q).reshape(num_species, 1)
+x_star = MinDivLP(A_k_small, A_k_large, y_small_noise, y_large_true, const, q).reshape(num_species, 1)
 end = time.time()
 
 ## Measure the reconstruction accuracy
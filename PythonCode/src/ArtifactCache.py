@@ -0,0 +1,151 @@
+import fcntl
+import json
+import hashlib
+import os
+import shutil
+import tempfile
+from .SensingMatrixIO import sha256_file
+
+# Environment variable naming the default cache directory of the command line scripts
+CACHE_DIR_VARIABLE = "MINDIVLP_CACHE_DIR"
+
+# sha256 digests of the files hashed so far in this process, keyed by (absolute path, size, modification time)
+_digests = dict()
+
+
+class ArtifactCache:
+    """ ArtifactCache
+    A content addressed cache of built artifacts (sensing matrices, y vectors, k-mer databases). An artifact is keyed
+    by the sha256 of the contents of the files it was built from together with the parameters it was built with, so
+    a changed input or parameter never reuses a stale artifact, while a rerun with the same ones restores it instead
+    of building it again. Entries are directories under the cache directory; the least recently used ones are removed
+    once the cache grows beyond max_bytes, by one process at a time (under an exclusive lock on the cache's .lock
+    file), skipping entries that other processes remove meanwhile. A cache without a directory is disabled: nothing is
+    found or stored.
+    Call via:
+    cache = ArtifactCache("~/.cache/mindivlp", max_bytes=20e9)
+    key = cache.key(["97_otus.fasta"], kind="16S sensing matrix", k=12, count_complements=False)
+    if not cache.restore(key, {'A_k': "97_otus.fasta_A_12.mat"}):
+        ... build 97_otus.fasta_A_12.mat ...
+        cache.store(key, {'A_k': "97_otus.fasta_A_12.mat"})
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = None if directory is None else os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_args(cls, cache_dir, cache_size):
+        """ The cache of the --cache_dir (default: the MINDIVLP_CACHE_DIR environment variable, else disabled) and
+        --cache_size (in GB) options of the command line scripts """
+        return cls(cache_dir if cache_dir is not None else os.environ.get(CACHE_DIR_VARIABLE),
+                   None if cache_size is None else int(cache_size * 1e9))
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def key(self, input_files, **params):
+        """ The key of the artifact built from the contents of input_files with the (JSON serializable) params """
+        if not self.enabled:
+            return None
+        description = {'inputs': [file_digest(input_file) for input_file in input_files], 'params': params}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def entry(self, key):
+        """ The directory of the entry key, if it is cached (which counts as a use of it), else None """
+        if not self.enabled:
+            return None
+        entry = os.path.join(self.directory, key)
+        try:
+            os.utime(entry)  # the modification time of an entry is its last use
+        except FileNotFoundError:
+            return None
+        return entry if os.path.isdir(entry) else None
+
+    def restore(self, key, files):
+        """ Copies the items of the entry key to the paths of files (a dict from item name to path) and returns True,
+        or returns False if the entry is not cached """
+        entry = self.entry(key)
+        if entry is None or not all(os.path.exists(os.path.join(entry, name)) for name in files):
+            return False
+        try:
+            for name, path in files.items():
+                _copy(os.path.join(entry, name), path)
+        except FileNotFoundError:  # evicted by another process meanwhile
+            return False
+        return True
+
+    def store(self, key, files, keep=()):
+        """ Copies the files (a dict from item name to the path of a file or directory) into the entry key, then
+        evicts the least recently used entries beyond max_bytes, other than key and the keys of keep (e.g. the other
+        entries the caller is about to use). Returns the directory of the entry. """
+        if not self.enabled:
+            return None
+        entry = os.path.join(self.directory, key)
+        temporary = tempfile.mkdtemp(dir=self.directory, prefix=".tmp_")
+        try:
+            for name, path in files.items():
+                _copy(path, os.path.join(temporary, name))
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.replace(temporary, entry)
+        finally:
+            if os.path.exists(temporary):
+                shutil.rmtree(temporary)
+        self.evict(keep={key, *keep})
+        return entry
+
+    def evict(self, keep=()):
+        """ Removes the least recently used entries (other than the keys of keep) until the cache holds at most
+        max_bytes """
+        if not self.enabled or self.max_bytes is None:
+            return
+        with open(os.path.join(self.directory, ".lock"), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = list()
+                for name in os.listdir(self.directory):
+                    entry = os.path.join(self.directory, name)
+                    if name.startswith("."):  # the lock and entries being stored
+                        continue
+                    try:
+                        entries.append((os.path.getmtime(entry), entry, _size(entry)))
+                    except FileNotFoundError:  # removed by another process meanwhile
+                        continue
+                total = sum(size for _, _, size in entries)
+                for _, entry, size in sorted(entries):
+                    if total <= self.max_bytes:
+                        break
+                    if os.path.basename(entry) not in keep:
+                        shutil.rmtree(entry, ignore_errors=True)
+                        total -= size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def file_digest(file_name):
+    """ The sha256 digest of the contents of file_name, computed once per process for every version of the file """
+    status = os.stat(file_name)
+    memo_key = (os.path.abspath(file_name), status.st_size, status.st_mtime_ns)
+    if memo_key not in _digests:
+        _digests[memo_key] = sha256_file(file_name)
+    return _digests[memo_key]
+
+
+def _copy(source, destination):
+    """ Copies the file or directory source to destination, replacing what is there """
+    if os.path.isdir(destination):
+        shutil.rmtree(destination)
+    if os.path.isdir(source):
+        shutil.copytree(source, destination)
+    else:
+        shutil.copyfile(source, destination)
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
@@ -0,0 +1,24 @@
+import h5py
+import numpy as np
+
+## Reads the training database CMash's MakeStreamingDNADatabase.py writes one genome at a time with h5py, rather than
+#  importing the sketches of all the genomes at once (MinHash.import_multiple_from_single_hdf5). Every genome is a
+#  group of the "CountEstimators" group, named after its file, holding the "kmers" of its sketch and their "counts".
+
+
+def read_genomes(database_file):
+    """ read_genomes
+    Yields the k-mers (a numpy array of byte strings) and counts of the sketch of every genome of the CMash database
+    database_file in turn, in the order CMash imports them, leaving out the empty slots of sketches that were not
+    filled.
+    Call via:
+    kmers, A = kmer_count_matrix(read_genomes("TrainingDatabase.h5"), batch_size=1000)
+    """
+    with h5py.File(database_file, 'r') as fid:
+        for genome in fid["CountEstimators"].values():
+            if "kmers" not in genome:
+                raise Exception(f"The CMash database {database_file} holds no k-mers for {genome.name}")
+            kmers = np.asarray(genome["kmers"][...]).astype(np.bytes_)
+            counts = np.asarray(genome["counts"][...])
+            keep = (np.char.str_len(kmers) > 0) & (counts > 0)
+            yield kmers[keep], counts[keep]
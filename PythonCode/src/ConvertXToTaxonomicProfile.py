@@ -4,7 +4,8 @@ import os
 import csv
 
 
-def convertToTaxonomy(x, trainingfasta, trainingtaxonomy, sample_id, filename, append=True):
+def convertToTaxonomy(x, trainingfasta, trainingtaxonomy, sample_id, filename, append=True, otu_ids=None,
+                      taxonomy_map=None):
     """ convertToTaxonomy
         Creates or appends a tsv table with a taxonomic profile from population proportions, a reference database fasta
         file, and the database's taxonomic identifiers
@@ -18,6 +19,11 @@ def convertToTaxonomy(x, trainingfasta, trainingtaxonomy, sample_id, filename, a
             trainingfasta (assumed to list one OTU/sequence id tab separated with the corresponding taxonomic id on
             each line)
         filename is the string location of the tsv file to be saved
+        append: if True, x is added as a new column to the table already in filename (if any)
+        otu_ids is the optional list of the OTU ids of trainingfasta, in order (see read_otu_ids); if given,
+            trainingfasta is not read
+        taxonomy_map is the optional dict from OTU id to taxonomic id of trainingtaxonomy (see read_taxonomy); if
+            given, trainingtaxonomy is not read
 
         Outputs:
         A tsv table containing the taxonomic profiles OTU of samples already included in filename and the taxonomic
@@ -32,26 +38,14 @@ def convertToTaxonomy(x, trainingfasta, trainingtaxonomy, sample_id, filename, a
 
     ## Determine OTUs that are in the new sample
     support = np.where(x > 0)[0]
-    sample_OTUs = list()
-
-    with open(trainingfasta, "r") as fasta:
-        i = 0
-        for line in fasta:
-            if line[0] == ">":
-                if i in support:
-                    sample_OTUs.append(line[1:-1])
-                i += 1
+    if otu_ids is None:
+        otu_ids = read_otu_ids(trainingfasta)
+    sample_OTUs = [otu_ids[i] for i in support]
 
     ## Find taxa of nonzero OTUs and place them in the same order
-    sample_taxIDs = sample_OTUs.copy()
-
-    with open(trainingtaxonomy, "r") as tax:
-        tax_reader = csv.reader(tax, delimiter='\t')
-
-        for line in tax_reader:
-            if line[0] in sample_OTUs:
-                index = sample_OTUs.index(line[0])
-                sample_taxIDs[index] = line[1]  # at same index as OTU
+    if taxonomy_map is None:
+        taxonomy_map = read_taxonomy(trainingtaxonomy)
+    sample_taxIDs = [taxonomy_map.get(OTU, OTU) for OTU in sample_OTUs]
 
     ## Create new data frame
     new_data = list()
@@ -76,3 +70,19 @@ def convertToTaxonomy(x, trainingfasta, trainingtaxonomy, sample_id, filename, a
     new_df = pd.DataFrame(new_data, columns=column_names[:-1] + [sample_id] + [column_names[-1]])
 
     new_df.to_csv(filename, sep='\t', index=False)
+
+
+def read_otu_ids(trainingfasta):
+    """ The OTU ids of the sequences of trainingfasta (what follows '>' on their header lines), in order """
+    otu_ids = list()
+    with open(trainingfasta, "r") as fasta:
+        for line in fasta:
+            if line[0] == ">":
+                otu_ids.append(line[1:-1])
+    return otu_ids
+
+
+def read_taxonomy(trainingtaxonomy):
+    """ The dict from OTU id to taxonomic id of the tab separated trainingtaxonomy file """
+    with open(trainingtaxonomy, "r") as tax:
+        return {line[0]: line[1] for line in csv.reader(tax, delimiter='\t') if len(line) > 1}
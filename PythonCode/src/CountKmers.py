@@ -0,0 +1,366 @@
+import os
+import gzip
+import numpy as np
+from collections import deque
+from itertools import islice
+from multiprocessing import get_context
+from scipy.sparse import csc_matrix, hstack, save_npz, load_npz
+
+# 2-bit code of each byte: A, C, G, T (either case) are 0 to 3, anything else is 4 and invalidates the k-mers it is in
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _bases in enumerate([b'Aa', b'Cc', b'Gg', b'Tt']):
+    _CODES[list(_bases)] = _code
+
+_MAX_K = 31  # k-mer codes are held in int64
+
+
+def _open(file_name):
+    """ Open file_name for reading bytes, decompressing it if it is gzipped """
+    with open(file_name, 'rb') as fid:
+        is_gzip = fid.read(2) == b'\x1f\x8b'
+    return gzip.open(file_name, 'rb') if is_gzip else open(file_name, 'rb')
+
+
+def read_fasta(file_name):
+    """ Yields the sequence (as bytes, lines joined) of every record of the (optionally gzipped) FASTA file
+    file_name """
+    lines = None
+    with _open(file_name) as fid:
+        for line in fid:
+            if line.startswith(b'>'):
+                if lines is not None:
+                    yield b''.join(lines)
+                lines = []
+            elif lines is not None:
+                lines.append(line.strip())
+    if lines is not None:
+        yield b''.join(lines)
+
+
+def read_fastq(file_name):
+    """ Yields the sequence (as bytes) of every record of the (optionally gzipped) FASTQ file file_name """
+    with _open(file_name) as fid:
+        for line_number, line in enumerate(fid):
+            if line_number % 4 == 1:
+                yield line.strip()
+
+
+def read_sequences(file_name):
+    """ Yields the sequences of file_name, which is read as FASTQ if its first character is '@' and as FASTA
+    otherwise (optionally gzipped in either case) """
+    with _open(file_name) as fid:
+        is_fastq = fid.read(1) == b'@'
+    return read_fastq(file_name) if is_fastq else read_fasta(file_name)
+
+
+def read_fasta_chunks(file_name, chunk_size, reader=read_fasta):
+    """ Yields lists of (up to) chunk_size consecutive sequences of the FASTA file file_name (or of the file read with
+    reader) """
+    records = reader(file_name)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode(sequences):
+    """ 2-bit encode the given sequences into one uint8 array, separated by an invalid code so that no k-mer spans two
+    sequences. Returns the codes and the start of every sequence in them. """
+    lengths = np.fromiter((len(sequence) + 1 for sequence in sequences), dtype=np.int64, count=len(sequences))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    codes = _CODES[np.frombuffer(b'N'.join(sequences), dtype=np.uint8)]
+    return codes, starts
+
+
+def kmer_codes(codes, k_sizes, count_complements=False):
+    """ Yields, for every k in k_sizes (in increasing order), k and the k-mer codes of all the windows of codes that
+    hold no invalid base, with the first base of a k-mer the most significant (the order of dna-utils and of the rows
+    of the sensing matrices), and the positions of the windows. With count_complements, the codes of the reverse
+    complements of the windows follow, with their positions. The codes of each k are extended from those of the
+    previous k, so all the k sizes together cost one rolling pass up to the largest. """
+    k_sizes = sorted(set(k_sizes))
+    if not 0 < k_sizes[0] <= k_sizes[-1] <= _MAX_K:
+        raise Exception(f"k-mer sizes from 1 to {_MAX_K} are supported, got {k_sizes}")
+    invalid = np.concatenate(([0], np.cumsum(codes > 3)))
+    bases = np.where(codes > 3, 0, codes).astype(np.int64)
+    kmers = np.zeros(len(codes), dtype=np.int64)
+    complements = np.zeros(len(codes), dtype=np.int64) if count_complements else None
+    for k in range(1, k_sizes[-1] + 1):
+        windows = max(len(codes) - k + 1, 0)
+        # extend the (k-1)-mer starting at every window by the base that follows it
+        kmers = kmers[:windows]
+        kmers <<= 2
+        kmers |= bases[k - 1:k - 1 + windows]
+        if count_complements:
+            complements = complements[:windows]
+            complements |= (3 - bases[k - 1:k - 1 + windows]) << (2 * (k - 1))
+        if k in k_sizes:
+            positions = np.flatnonzero(invalid[k:k + windows] == invalid[:windows])
+            if count_complements:
+                yield k, np.concatenate((kmers[positions], complements[positions])), np.tile(positions, 2)
+            else:
+                yield k, kmers[positions], positions
+
+
+def _count_columns(kmers, positions, starts, k):
+    """ The [4^k, len(starts)] csc_matrix of the counts of the k-mers found at positions in the sequences starting at
+    starts """
+    columns = np.searchsorted(starts, positions, side='right') - 1
+    num_rows = 4 ** k
+    # sort by (column, k-mer) and count the repeats; one key holds both when it fits
+    if num_rows * max(len(starts), 1) <= np.iinfo(np.int64).max:
+        keys, counts = np.unique(columns * num_rows + kmers, return_counts=True)
+        columns, rows = np.divmod(keys, num_rows)
+    else:
+        order = np.lexsort((kmers, columns))
+        columns, kmers = columns[order], kmers[order]
+        first = np.concatenate(([True], (columns[1:] != columns[:-1]) | (kmers[1:] != kmers[:-1])))
+        rows = kmers[first]
+        counts = np.diff(np.append(np.flatnonzero(first), len(kmers)))
+        columns = columns[first]
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(columns, minlength=len(starts)))))
+    return csc_matrix((counts.astype(np.float64), rows, indptr), shape=(num_rows, len(starts)))
+
+
+def count_kmers(sequences, k_sizes, count_complements=False):
+    """ count_kmers
+    Counts the k-mers of every sequence without an external counter or a text round trip.
+    Call via:
+    counts = count_kmers(list(read_fasta("97_otus.fasta")), k)
+    counts = count_kmers(list(read_fasta("97_otus.fasta")), [4, 6, 12])  # counts[k] for each k, in one pass
+
+    Parameters are:
+    sequences is a list of sequences (bytes)
+    k_sizes is the k-mer size, or a list of them
+    count_complements: if True, the reverse complement of every k-mer is counted as well (as kmer_counts_per_sequence
+        -c does)
+
+    Returns:
+    counts: a [4^k, len(sequences)] csc_matrix whose column j holds the k-mer counts of sequence j (a dict of them,
+        keyed by k, if k_sizes is a list)
+    """
+
+    codes, starts = encode(sequences)
+    counts = {k: _count_columns(kmers, positions, starts, k) for k, kmers, positions in
+              kmer_codes(codes, np.atleast_1d(k_sizes).tolist(), count_complements)}
+    return counts if np.ndim(k_sizes) else counts[k_sizes]
+
+
+def normalize_columns(A):
+    """ Scale every nonzero column of the csc_matrix A in place to sum to one (the l1 normalization of the sensing
+    matrices) and return it """
+    sums = np.asarray(A.sum(axis=0)).ravel()
+    sums[sums == 0] = 1
+    A.data /= np.repeat(sums, np.diff(A.indptr))
+    return A
+
+
+def _chunk_blocks(chunk, k_sizes, count_complements):
+    return {k: normalize_columns(counts) for k, counts in count_kmers(chunk, k_sizes, count_complements).items()}
+
+
+def sensing_matrix_blocks(file_name, k_sizes, count_complements=False, chunk_size=10000, processes=1):
+    """ Yields the column normalized k-mer sensing matrices of the sequences of the FASTA file file_name in blocks of
+    chunk_size columns, as a dict of blocks keyed by k, reading and counting one chunk of sequences at a time. With
+    processes > 1, that many chunks are counted in parallel (at most twice as many are held at once). """
+    chunks = read_fasta_chunks(file_name, chunk_size)
+    if processes == 1:
+        for chunk in chunks:
+            yield _chunk_blocks(chunk, k_sizes, count_complements)
+        return
+    with get_context().Pool(processes) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_chunk_blocks, (chunk, k_sizes, count_complements)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def sensing_matrices(file_name, k_sizes, count_complements=False, chunk_size=None, processes=1):
+    """ sensing_matrices
+    The column normalized k-mer sensing matrices of the sequences of the FASTA file file_name for several k sizes,
+    formed in a single pass over the file.
+    Call via:
+    A = sensing_matrices("97_otus.fasta", [4, 6, 12])  # A[k] is A_k
+
+    Parameters are:
+    file_name is the FASTA file of the reference sequences
+    k_sizes is the list of k-mer sizes
+    count_complements: if True, the reverse complement of every k-mer is counted as well
+    chunk_size: if given, the sequences are read and counted chunk_size at a time and the normalized blocks are
+        concatenated at the end, so the counting needs memory for one chunk rather than for the whole reference (to
+        write the matrices to disk without ever holding them whole, use SensingMatrixIO.save_sensing_matrix_blocks)
+    processes: number of chunks to count in parallel (default chunk_size is then 10000)
+
+    Returns:
+    A: a dict holding the [4^k, N] csc_matrix A_k of every k, N being the number of sequences
+    """
+    if chunk_size is None and processes == 1:
+        return _chunk_blocks(list(read_fasta(file_name)), k_sizes, count_complements)
+    blocks = list(sensing_matrix_blocks(file_name, k_sizes, count_complements, chunk_size or 10000, processes))
+    return {k: _concatenate_columns([block.pop(k) for block in blocks]) for k in k_sizes}
+
+
+def _concatenate_columns(blocks):
+    """ hstack of the csc_matrix blocks that releases each block once it is copied. The buffers of the result are
+    allocated with np.empty, whose pages are only taken up as they are written, so the peak is about one matrix and a
+    block rather than the two matrices of hstack. Empties the list blocks. """
+    nnz = sum(block.nnz for block in blocks)
+    index_dtype = np.int32 if max(nnz, blocks[0].shape[0]) <= np.iinfo(np.int32).max else np.int64
+    data = np.empty(nnz, dtype=np.result_type(*[block.dtype for block in blocks]))
+    indices = np.empty(nnz, dtype=index_dtype)
+    column_nnz = list()
+    num_rows = blocks[0].shape[0]
+    blocks.reverse()
+    start = 0
+    while blocks:
+        block = blocks.pop()
+        data[start:start + block.nnz] = block.data
+        indices[start:start + block.nnz] = block.indices
+        column_nnz.append(np.diff(block.indptr))
+        start += block.nnz
+        del block
+    indptr = np.concatenate(([0], np.cumsum(np.concatenate(column_nnz)))).astype(index_dtype)
+    return csc_matrix((data, indices, indptr), shape=(num_rows, len(indptr) - 1), copy=False)
+
+
+def sensing_matrix(file_name, k, count_complements=False, chunk_size=None, processes=1):
+    """ The column normalized k-mer sensing matrix A_k of the sequences of the FASTA file file_name (see
+    sensing_matrices) """
+    return sensing_matrices(file_name, [k], count_complements, chunk_size, processes)[k]
+
+
+def kmer_spectrum(file_name, k, count_complements=False, chunk_size=10000, sparse=False):
+    """ kmer_spectrum
+    The total count of every k-mer over all the reads of a sample, streamed chunk_size reads at a time into one count
+    array (as dna-utils' kmer_total_count counts them).
+    Call via:
+    counts = kmer_spectrum("sample.fastq.gz", k)
+
+    Parameters are:
+    file_name is a FASTA or FASTQ file, optionally gzipped
+    k is the k-mer size
+    count_complements: if True, the reverse complement of every k-mer is counted as well
+    chunk_size is the number of reads encoded and counted at a time
+    sparse: if True, only the distinct k-mers seen are kept, so memory scales with them rather than with 4^k
+
+    Returns:
+    counts: an int64 array of size 4^k, indexed by k-mer code, or (if sparse) a [4^k, 1] csc_matrix of the counts
+    """
+    return kmer_spectra(file_name, [k], count_complements, chunk_size, sparse)[k]
+
+
+def kmer_spectra(file_name, k_sizes, count_complements=False, chunk_size=10000, sparse=False):
+    """ kmer_spectra
+    The k-mer spectra (see kmer_spectrum) of a sample for several k sizes at once: every read is read and encoded once,
+    and the k-mers of all the k sizes are extended from one another (see kmer_codes).
+    Call via:
+    spectra = kmer_spectra("sample.fastq.gz", [small_k, large_k])
+
+    Parameters are as in kmer_spectrum, with k_sizes a list of k-mer sizes
+
+    Returns:
+    spectra: a dict mapping each k of k_sizes to its counts, as kmer_spectrum returns them
+    """
+    k_sizes = sorted(set(k_sizes))
+    if sparse:
+        spectra = {k: list() for k in k_sizes}
+    else:
+        spectra = {k: np.zeros(4 ** k, dtype=np.int64) for k in k_sizes}
+    for chunk in read_fasta_chunks(file_name, chunk_size, read_sequences):
+        for k, kmers, _ in kmer_codes(encode(chunk)[0], k_sizes, count_complements):
+            if sparse:
+                _add_run(spectra[k], kmers)
+            else:
+                _accumulate(spectra[k], kmers)
+    if sparse:
+        merged = {k: _merge_runs(runs) for k, runs in spectra.items()}
+        return {k: csc_matrix((counts, distinct, [0, len(distinct)]), shape=(4 ** k, 1))
+                for k, (distinct, counts) in merged.items()}
+    return spectra
+
+
+def _accumulate(counts, kmers):
+    """ counts[kmer] += 1 for every kmer in kmers """
+    if len(kmers) >= len(counts):
+        counts += np.bincount(kmers, minlength=len(counts))
+    else:  # fewer k-mers than k-mer codes: count the distinct ones rather than building a second 4^k array
+        distinct, distinct_counts = np.unique(kmers, return_counts=True)
+        counts[distinct] += distinct_counts
+
+
+## The sparse spectra are held as runs of sorted distinct k-mers and their counts, one per chunk to begin with. A run is
+#  merged into the one before it while that one is no longer, so the runs shrink geometrically: there are O(log n) of
+#  them and every k-mer is merged O(log n) times, rather than merging each chunk into all the k-mers seen so far.
+
+
+def _add_run(runs, kmers):
+    """ Adds the run of the distinct k-mers of kmers and their counts to runs, merging the runs no longer than it """
+    distinct, counts = np.unique(kmers, return_counts=True)
+    run = (distinct, counts.astype(np.int64))
+    while runs and len(runs[-1][0]) <= len(run[0]):
+        run = _merge_pair(runs.pop(), run)
+    runs.append(run)
+
+
+def _merge_pair(run, other):
+    """ The union of two runs of sorted distinct k-mers and their counts, the counts of shared k-mers summed. Only the
+    k-mers of other are looked up in run (with searchsorted); those it lacks are inserted into it. """
+    (distinct, counts), (other_distinct, other_counts) = run, other
+    positions = np.searchsorted(distinct, other_distinct)
+    shared = positions < len(distinct)
+    shared[shared] = distinct[positions[shared]] == other_distinct[shared]
+    counts = counts.copy()
+    counts[positions[shared]] += other_counts[shared]
+    return (np.insert(distinct, positions[~shared], other_distinct[~shared]),
+            np.insert(counts, positions[~shared], other_counts[~shared]))
+
+
+def _merge_runs(runs):
+    """ The sorted distinct k-mers and their counts of all the runs """
+    if not runs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    run = runs.pop()
+    while runs:
+        run = _merge_pair(runs.pop(), run)
+    return run
+
+
+def y_vector(file_name, k, count_complements=False, dtype=np.float32, sparse=False):
+    """ The y vector of a sample: its k-mer spectrum (see kmer_spectrum) normalized to sum to one, as an array of the
+    given dtype, or (if sparse) as a [4^k, 1] csc_matrix holding the observed k-mers only """
+    return y_vectors(file_name, [k], count_complements, dtype, sparse)[k]
+
+
+def y_vectors(file_name, k_sizes, count_complements=False, dtype=np.float32, sparse=False):
+    """ The y vectors (see y_vector) of a sample for several k sizes, formed in one pass over its reads by kmer_spectra,
+    as a dict mapping each k to its y vector, e.g.
+    y = y_vectors("sample.fastq.gz", [small_k, large_k]); y_small, y_large = y[small_k], y[large_k] """
+    spectra = kmer_spectra(file_name, k_sizes, count_complements, sparse=sparse)
+    for k, counts in spectra.items():
+        if sparse:
+            counts.data = (counts.data / max(counts.data.sum(), 1)).astype(dtype, copy=False)
+        else:
+            spectra[k] = (counts / max(counts.sum(), 1)).astype(dtype, copy=False)
+    return spectra
+
+
+def save_blocks(blocks, directories):
+    """ Writes the column blocks yielded by sensing_matrix_blocks as they come, those of each k to directories[k] as
+    one .npz file each, and returns their number; load_blocks(directories[k]) concatenates them again """
+    for directory in directories.values():
+        os.makedirs(directory, exist_ok=True)
+    count = 0
+    for count, block in enumerate(blocks, start=1):
+        for k, directory in directories.items():
+            save_npz(os.path.join(directory, f"block_{count:06d}.npz"), block[k])
+    return count
+
+
+def load_blocks(directory):
+    """ The sensing matrix written to directory by save_blocks """
+    names = sorted(name for name in os.listdir(directory) if name.startswith("block_") and name.endswith(".npz"))
+    return hstack([load_npz(os.path.join(directory, name)) for name in names], format='csc')
@@ -1,11 +1,16 @@
 #! /usr/bin/env python
 import argparse
 import os
+import sys
 import subprocess
 import numpy as np
 from scipy.sparse import coo_matrix
 import scipy.io as sio
 from sklearn.preprocessing import normalize
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.CountKmers import sensing_matrices, sensing_matrix_blocks
+from PythonCode.src.SensingMatrixIO import save_sensing_matrix, save_sensing_matrix_blocks, ARTIFACT_EXTENSION
+from PythonCode.src.ArtifactCache import ArtifactCache
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(
@@ -16,6 +21,22 @@ if __name__ == '__main__':
 	parser.add_argument('-i', '--input_file', type=str, help="File name of input database")
 	parser.add_argument('-o', '--output_file', type=str,
 						help="Output file of sparse representation of sensing matrix `A` in .mat format.", required=True)
+	parser.add_argument('-e', '--engine', type=str, choices=['numpy', 'dna-utils'],
+						help="k-mer counter to use: the built-in numpy counter, or dna-utils' kmer_counts_per_sequence", default='numpy')
+	parser.add_argument('--chunk_size', type=int,
+						help="Read and count this many sequences at a time, normalizing each block of columns as it is formed, so memory is bounded by the chunk rather than the reference (numpy engine only)", default=None)
+	parser.add_argument('--write_blocks', action="store_true",
+						help="Stream the normalized column blocks straight into the .csc artifact output_file (see SensingMatrixIO.py) as they are formed, so the matrix is never held in memory as a whole (needs --chunk_size; implies --format csc)", default=False)
+	parser.add_argument('--k_sizes', type=str,
+						help="Comma separated k-mer sizes to form in a single pass over the input (in place of -k). output_file is then a prefix: A_k is written to {output_file}_A_{k}.mat, or to the artifact {output_file}_A_{k}.csc with --format csc or --write_blocks (numpy engine only)", default=None)
+	parser.add_argument('-f', '--format', type=str, choices=['mat', 'csc'],
+						help="Output format: a compressed .mat file, or a memory-mappable artifact directory of raw .npy buffers (see SensingMatrixIO.py); with --k_sizes the artifacts are named {output_file}_A_{k}.csc", default='mat')
+	parser.add_argument('-p', '--processes', type=int,
+						help="Number of chunks of sequences to count in parallel (numpy engine only)", default=1)
+	parser.add_argument('--cache_dir', type=str,
+						help="Directory of a cache of sensing matrices keyed by the contents of the input and the parameters: matrices found there are copied rather than formed again, and those formed are added to it (default: the MINDIVLP_CACHE_DIR environment variable, else no cache)", default=None)
+	parser.add_argument('--cache_size', type=float,
+						help="Size limit of the cache in GB, beyond which the least recently used entries are removed", default=20)
 
 	# read in the arguments
 	args = parser.parse_args()
@@ -23,28 +44,80 @@ if __name__ == '__main__':
 	count_rev = args.count_complements
 	input_file_name = args.input_file
 	output_file_name = args.output_file
+	engine = args.engine
+	chunk_size = args.chunk_size
+	write_blocks = args.write_blocks
+	k_sizes = args.k_sizes
+	processes = args.processes
+	output_format = 'csc' if write_blocks else args.format
 
 	# check if the input exists
 	if not os.path.exists(input_file_name):
 		raise Exception(f"The input file {input_file_name} does not appear to exist")
 
-	# check if dna-utils is installed
-	res = subprocess.run("kmer_counts_per_sequence -h", shell=True, stdout=subprocess.DEVNULL)
-	if res.returncode != 0:
-		raise Exception("It appears that dna-utils is not installed. Please consult the README, install dna-utils, and try again.")
+	if (chunk_size is not None or write_blocks or k_sizes is not None or processes != 1) and engine != 'numpy':
+		raise Exception("--chunk_size, --write_blocks, --k_sizes and --processes need the numpy engine")
+	if write_blocks and chunk_size is None:
+		raise Exception("--write_blocks needs --chunk_size")
+	if (k_size is None) == (k_sizes is None):
+		raise Exception("Give exactly one of -k and --k_sizes")
 
-	if count_rev:
-		res = subprocess.run(f"kmer_counts_per_sequence -i {input_file_name} -k {k_size} -c -s", shell=True, stdout=subprocess.PIPE)
+	# where the matrix of each k goes
+	if k_sizes is not None:
+		k_list = [int(k) for k in k_sizes.split(',')]
+		extension = ARTIFACT_EXTENSION if output_format == 'csc' else '.mat'
+		output_names = {k: f"{output_file_name}_A_{k}{extension}" for k in k_list}
 	else:
-		res = subprocess.run(f"kmer_counts_per_sequence -i {input_file_name} -k {k_size} -s", shell=True, stdout=subprocess.PIPE)
+		k_list = [k_size]
+		# (savemat adds a missing .mat extension)
+		append_mat = output_format == 'mat' and not output_file_name.endswith('.mat')
+		output_names = {k_size: output_file_name + '.mat' if append_mat else output_file_name}
 
-	if res.returncode == 0:
-		print("Sparse matrix created, now converting to .mat format")
+	# restore the matrices already in the cache, and form the others only
+	cache = ArtifactCache.from_args(args.cache_dir, args.cache_size)
+	keys = {k: cache.key([input_file_name], kind='16S sensing matrix', k=k, count_complements=count_rev, engine=engine,
+						 layout=output_format, chunk_size=None) for k in k_list}
+	restored = [k for k in k_list if cache.restore(keys[k], {'A_k': output_names[k]})]
+	if restored:
+		print(f"Restored {', '.join(output_names[k] for k in restored)} from the cache")
+	k_list = [k for k in k_list if k not in restored]
+	if not k_list:
+		sys.exit()
+
+	if engine == 'numpy' and output_format == 'csc' and chunk_size is not None:
+		# stream the blocks into the artifacts as they are formed rather than concatenating them in memory
+		num_blocks = save_sensing_matrix_blocks(sensing_matrix_blocks(input_file_name, k_list, count_rev, chunk_size, processes), {k: output_names[k] for k in k_list}, reference=input_file_name, count_complements=count_rev)
+		print(f"Wrote {num_blocks} blocks of each sensing matrix to {', '.join(output_names[k] for k in k_list)}")
+	elif engine == 'numpy':
+		for k, A_k in sensing_matrices(input_file_name, k_list, count_rev, chunk_size, processes).items():
+			if output_format == 'csc':
+				save_sensing_matrix(A_k, output_names[k], k=k, reference=input_file_name, count_complements=count_rev)
+			else:
+				sio.savemat(output_names[k], {"A_k": A_k}, do_compression=True)
 	else:
-		print("An unexpected error was encountered, please check the input FASTA file is in the correct format. If errors persist, contact the developers.")
+		# check if dna-utils is installed
+		res = subprocess.run("kmer_counts_per_sequence -h", shell=True, stdout=subprocess.DEVNULL)
+		if res.returncode != 0:
+			raise Exception("It appears that dna-utils is not installed. Please consult the README, install dna-utils, and try again.")
+
+		if count_rev:
+			res = subprocess.run(f"kmer_counts_per_sequence -i {input_file_name} -k {k_size} -c -s", shell=True, stdout=subprocess.PIPE)
+		else:
+			res = subprocess.run(f"kmer_counts_per_sequence -i {input_file_name} -k {k_size} -s", shell=True, stdout=subprocess.PIPE)
+
+		if res.returncode == 0:
+			print("Sparse matrix created, now converting to .mat format")
+		else:
+			print("An unexpected error was encountered, please check the input FASTA file is in the correct format. If errors persist, contact the developers.")
+
+		sparse_text_form = res.stdout.decode('utf-8')  # convert from bytes to string
+		J, I, V = np.array(list(map(int,sparse_text_form.split()))).reshape((-2, 3)).transpose()  # pull out the indicies
+		sparse_matrix_form = coo_matrix((V, (I, J)), shape=(4 ** k_size, J[-1] + 1))  # convert to sparse matrix format
+		sparse_matrix_form_norm = normalize(sparse_matrix_form, norm='l1', axis=0)  # normalize by rows
+		if output_format == 'csc':
+			save_sensing_matrix(sparse_matrix_form_norm, output_file_name, k=k_size, reference=input_file_name, count_complements=count_rev)
+		else:
+			sio.savemat(output_file_name, {"A_k": sparse_matrix_form_norm}, do_compression=True)
 
-	sparse_text_form = res.stdout.decode('utf-8')  # convert from bytes to string
-	J, I, V = np.array(list(map(int,sparse_text_form.split()))).reshape((-2, 3)).transpose()  # pull out the indicies
-	sparse_matrix_form = coo_matrix((V, (I, J)), shape=(4 ** k_size, J[-1] + 1))  # convert to sparse matrix format
-	sparse_matrix_form_norm = normalize(sparse_matrix_form, norm='l1', axis=0)  # normalize by rows
-	sio.savemat(output_file_name, {"A_k": sparse_matrix_form_norm}, do_compression=True)
+	for k in k_list:
+		cache.store(keys[k], {'A_k': output_names[k]}, keep=keys.values())
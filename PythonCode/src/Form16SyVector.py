@@ -1,12 +1,16 @@
 #! /usr/bin/env python
 import argparse
 import os
+import sys
 import subprocess
 import numpy as np
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csr_matrix
 import scipy.io as sio
 from sklearn.preprocessing import normalize
 import tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.CountKmers import y_vector
+from PythonCode.src.ArtifactCache import ArtifactCache
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -20,6 +24,18 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output_file', type=str,
                         help="Output file of the y-vector in .mat format.",
                         required=True)
+    parser.add_argument('-e', '--engine', type=str, choices=['numpy', 'dna-utils'],
+                        help="k-mer counter to use: the built-in numpy counter (which also reads gzipped input), or "
+                             "dna-utils' kmer_total_count", default='numpy')
+    parser.add_argument('-s', '--sparse', action="store_true",
+                        help="save y as a sparse vector holding the observed k-mers only (advisable for k >= 10, where "
+                             "the dense y has 4^k entries)", default=False)
+    parser.add_argument('--cache_dir', type=str,
+                        help="Directory of a cache of y vectors keyed by the contents of the input and the parameters "
+                             "(default: the MINDIVLP_CACHE_DIR environment variable, else no cache)", default=None)
+    parser.add_argument('--cache_size', type=float,
+                        help="Size limit of the cache in GB, beyond which the least recently used entries are removed",
+                        default=20)
 
     # read in the arguments
     args = parser.parse_args()
@@ -27,41 +43,60 @@ if __name__ == '__main__':
     count_rev = args.count_complements
     input_file_name = args.input_file
     output_file_name = args.output_file
+    engine = args.engine
+    sparse = args.sparse
 
     # check if the input exists
     if not os.path.exists(input_file_name):
         raise Exception(f"The input file {input_file_name} does not appear to exist")
 
-    # check if dna-utils is installed
-    res = subprocess.run("kmer_counts_per_sequence -h", shell=True, stdout=subprocess.DEVNULL)
-    if res.returncode != 0:
-        raise Exception(
-            "It appears that dna-utils is not installed. Please consult the README, install dna-utils, and try again.")
+    # a y vector formed before from the same input and parameters is copied from the cache
+    cache = ArtifactCache.from_args(args.cache_dir, args.cache_size)
+    key = cache.key([input_file_name], kind='16S y vector', k=k_size, count_complements=count_rev, engine=engine,
+                    sparse=sparse)
+    # (savemat adds a missing .mat extension)
+    saved_file = output_file_name if output_file_name.endswith('.mat') else output_file_name + '.mat'
+    if cache.restore(key, {'y': saved_file}):
+        print(f"Restored {saved_file} from the cache")
+        sys.exit()
 
-    # check if fastq or fasta
-    with open(input_file_name, 'r') as fid:
-        line = fid.readline()
-        first_char = line[0]
-        if first_char == '>':
-            is_fasta = True
-        else:
-            is_fasta = False
-
-    if count_rev:
-        if is_fasta:
-            to_run = f"kmer_total_count -i {input_file_name} -k {k_size} -c"
-        else:
-            to_run = f"sed -n '1~4s/^@/>/p;2~4p' {input_file_name} | kmer_total_count -k {k_size} -c"
+    if engine == 'numpy':
+        y = y_vector(input_file_name, k_size, count_rev, dtype=float, sparse=sparse)
+        # saved as a row, like a dense y, so both load the same way
+        sio.savemat(output_file_name, {"y": y.T if sparse else y}, do_compression=True)
     else:
-        if is_fasta:
-            to_run = f"kmer_total_count -i {input_file_name} -k {k_size}"
+        # check if dna-utils is installed
+        res = subprocess.run("kmer_counts_per_sequence -h", shell=True, stdout=subprocess.DEVNULL)
+        if res.returncode != 0:
+            raise Exception(
+                "It appears that dna-utils is not installed. Please consult the README, install dna-utils, and try again.")
+
+        # check if fastq or fasta
+        with open(input_file_name, 'r') as fid:
+            line = fid.readline()
+            first_char = line[0]
+            if first_char == '>':
+                is_fasta = True
+            else:
+                is_fasta = False
+
+        if count_rev:
+            if is_fasta:
+                to_run = f"kmer_total_count -i {input_file_name} -k {k_size} -c"
+            else:
+                to_run = f"sed -n '1~4s/^@/>/p;2~4p' {input_file_name} | kmer_total_count -k {k_size} -c"
         else:
-            to_run = f"sed -n '1~4s/^@/>/p;2~4p' {input_file_name} | kmer_total_count -k {k_size}"
+            if is_fasta:
+                to_run = f"kmer_total_count -i {input_file_name} -k {k_size}"
+            else:
+                to_run = f"sed -n '1~4s/^@/>/p;2~4p' {input_file_name} | kmer_total_count -k {k_size}"
+
+        res = subprocess.run(to_run, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if res.returncode != 0:
+            raise Exception("An unexpected error was encountered, please check the input FASTA file is in the correct format. If errors persist, contact the developers.")
 
-    res = subprocess.run(to_run, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    if res.returncode != 0:
-        raise Exception("An unexpected error was encountered, please check the input FASTA file is in the correct format. If errors persist, contact the developers.")
+        y = np.array(list(map(int, res.stdout.decode('utf-8').split())))
+        y_norm = y / np.sum(y)
+        sio.savemat(output_file_name, {"y": csr_matrix(y_norm) if sparse else y_norm}, do_compression=True)
 
-    y = np.array(list(map(int, res.stdout.decode('utf-8').split())))
-    y_norm = y / np.sum(y)
-    sio.savemat(output_file_name, {"y": y_norm}, do_compression=True)
+    cache.store(key, {'y': saved_file})
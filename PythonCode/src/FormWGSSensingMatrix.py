@@ -2,12 +2,13 @@
 import argparse
 import os
 import subprocess
+import sys
 import tempfile
-from itertools import chain
-from scipy.sparse import csc_matrix, save_npz
-from CMash import MinHash as MH
-
-## TODO: adjust for very large files by only loading portions of hdf5 database file at a time
+from scipy.sparse import save_npz
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.ArtifactCache import ArtifactCache
+from PythonCode.src.CMashDatabase import read_genomes
+from PythonCode.src.PackedKmers import KmerIndex, kmer_count_matrix, unpack_kmers
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -28,7 +29,16 @@ if __name__ == '__main__':
                         help="Output file of sparse representation of sensing matrix `A` in .mat format.",
                         default="TrainingDatabase",
                         required=True)
-
+    parser.add_argument('--cache_dir', type=str,
+                        help="Directory of a cache of training databases keyed by the contents of the training genomes "
+                             "and the k-mer size (default: the MINDIVLP_CACHE_DIR environment variable, else no cache)",
+                        default=None)
+    parser.add_argument('--cache_size', type=float,
+                        help="Size limit of the cache in GB, beyond which the least recently used entries are removed",
+                        default=20)
+    parser.add_argument('-b', '--batch_size', type=int,
+                        help="Number of genomes read from the CMash database at a time, which bounds the memory used "
+                             "beyond the matrix itself", default=1000)
 
     ## Read in the arguments
     args = parser.parse_args()
@@ -39,6 +49,17 @@ if __name__ == '__main__':
     output_file_name = os.path.abspath(args.output_file)
     cmash_loc = args.cmash_loc
 
+    ## Restore the outputs from the cache if the same genomes were used with the same k-mer size before
+    cache = ArtifactCache.from_args(args.cache_dir, args.cache_size)
+    with open(input_file_names, "r") as fid:
+        genome_files = [line.strip() for line in fid if line.strip()]
+    key = cache.key([input_file_names] + genome_files, kind='WGS sensing matrix', k=k_size)
+    outputs = {extension: output_file_name + extension
+               for extension in ('.npz', '.h5', '.kmc_pre', '.kmc_suf', '_kmers')}
+    if cache.restore(key, outputs):
+        print("Restored the training database from the cache.")
+        sys.exit()
+
     ## Run CMash and load database
     print("Running CMash.")
 
@@ -48,32 +69,13 @@ if __name__ == '__main__':
     if res.returncode != 0:
         raise Exception("Error running CMash (MakeStreamingDNADatabase.py)")
 
-    print("Loading in database.")
-
-    database = MH.import_multiple_from_single_hdf5(database_file_name)
-
-    ## Extract list of kmers
-    print("Gathering kmers.")
-
-    # (convert to set for removing duplicates, sort for consistent ordering)
-    kmers = sorted(set(chain.from_iterable(genome._kmers for genome in database)))
-
-    ## Gather data for, create, and save csc_matrix, each column representing the counts of a particular genome's kmers
+    ## Read the database a batch of genomes at a time, packing the kmers of every genome and forming the matrix, each
+    #  column representing the counts of a particular genome's kmers and the rows the distinct canonical kmers (a kmer
+    #  and its reverse complement, as KMC counts them in the samples) in sorted order
     print("Creating matrix.")
 
-    data = []
-    indices = []
-    indptr = [0]
-
-    for genome in database:
-        column_indices = [kmers.index(kmer) for kmer in genome._kmers]  # Find indices of a particular genome's kmers
-        sorter = sorted(range(len(column_indices)), key=column_indices.__getitem__)  # argsort the indices
-        # Concatenate sorted indices and corresponding data (counts) for canonical csc_matrix format
-        indices += [column_indices[i] for i in sorter]
-        data += [genome._counts[i] for i in sorter]
-        indptr.append(len(indices))
-
-    save_npz(output_file_name, csc_matrix((data, indices, indptr), shape=(len(kmers), len(database))), compressed=True)
+    kmers, A = kmer_count_matrix(read_genomes(database_file_name), batch_size=args.batch_size, canonical=True)
+    save_npz(output_file_name, A, compressed=True)
 
     ## Run KMC on artificial FASTA file for future intersection with y vectors
 
@@ -86,20 +88,23 @@ if __name__ == '__main__':
             "It appears that kmc is not installed. Please consult the README, install kmc, and try again.")
 
     with tempfile.TemporaryDirectory() as temp_dir:
-        with open("test.fasta", "w+") as training_out_file:
-
-            to_write = ""
-            iterator = 0
-            for kmer in kmers:
-                to_write += ">seq%d\n" % iterator
-                to_write += "%s\n" % kmer
-                iterator += 1
-            training_out_file.write(to_write)
-
-            # Run KMC on training fasta
-            to_run = f"kmc -k{k_size} -sm -fm -ci0 -cs3 {training_out_file.name} {output_file_name} {temp_dir}"
-            res = subprocess.run(to_run, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-            if res.returncode != 0:
-                raise Exception("An unexpected error was encountered while running kmc.")
+        training_fasta = os.path.join(temp_dir, "training.fasta")
+        with open(training_fasta, "wb") as training_out_file:
+            for start in range(0, len(kmers), 1000000):
+                block = unpack_kmers(kmers[start:start + 1000000], k_size)
+                training_out_file.write(b"".join(b">seq%d\n%s\n" % (start + i, kmer) for i, kmer in enumerate(block)))
+
+        # Run KMC on training fasta
+        to_run = f"kmc -k{k_size} -sm -fm -ci0 -cs3 {training_fasta} {output_file_name} {temp_dir}"
+        res = subprocess.run(to_run, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if res.returncode != 0:
+            raise Exception("An unexpected error was encountered while running kmc.")
+
+    ## Save the sorted k-mers of the rows, with their canonical lookup, for FormWGSyVector.py to memory-map; the index
+    #  records the sizes and digests of the database files, which tell FormWGSyVector.py that it belongs to them
+    KmerIndex(kmers, k_size).save(KmerIndex.directory_for(output_file_name),
+                                  [output_file_name + extension for extension in ('.h5', '.kmc_pre', '.kmc_suf')])
+
+    cache.store(key, outputs)
 
     print("Completed.")
@@ -3,10 +3,13 @@ import argparse
 import os
 import subprocess
 import tempfile
-import itertools
+import sys
 import numpy as np
-from CMash import MinHash as MH
 from scipy.sparse import csc_matrix, save_npz
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.ArtifactCache import ArtifactCache
+from PythonCode.src.CMashDatabase import read_genomes
+from PythonCode.src.PackedKmers import KmerIndex, pack_kmers, parse_kmc_dump
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -28,6 +31,13 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output_file', type=str,
                         help="Output file of the y-vector in .mat format.",
                         required=True)
+    parser.add_argument('--cache_dir', type=str,
+                        help="Directory of a cache of y vectors keyed by the contents of the input and the training "
+                             "files and the parameters (default: the MINDIVLP_CACHE_DIR environment variable, else no "
+                             "cache)", default=None)
+    parser.add_argument('--cache_size', type=float,
+                        help="Size limit of the cache in GB, beyond which the least recently used entries are removed",
+                        default=20)
 
     ## Read in the arguments
     args = parser.parse_args()
@@ -46,6 +56,22 @@ if __name__ == '__main__':
     if not os.path.exists(input_file_name):
         raise Exception(f"The input file {input_file_name} does not appear to exist")
 
+    # a y vector formed before from the same input, training files and parameters is copied from the cache; the training
+    # database is keyed by the header of its k-mer index, which records the digests of its files, rather than hashing
+    # the (multi-GB) files themselves for every sample
+    database_files = [training_prefix + extension for extension in ('.h5', '.kmc_pre', '.kmc_suf')]
+    index_directory = KmerIndex.directory_for(training_prefix)
+    index_is_current = KmerIndex.is_current(index_directory, database_files)
+    cache = ArtifactCache.from_args(args.cache_dir, args.cache_size)
+    key = cache.key([input_file_name] + ([os.path.join(index_directory, "header.json")] if index_is_current
+                                         else database_files),
+                    kind='WGS y vector', k=k_size, ci=ci, cs=cs, count_complements=count_rev)
+    # (save_npz adds a missing .npz extension)
+    saved_file = output_file_name if output_file_name.endswith('.npz') else output_file_name + '.npz'
+    if cache.restore(key, {'y': saved_file}):
+        print(f"Restored {saved_file} from the cache")
+        sys.exit()
+
     # check if kmc is installed
     res = subprocess.run("kmc", shell=True, stdout=subprocess.DEVNULL)
     if res.returncode != 0:
@@ -90,29 +116,32 @@ if __name__ == '__main__':
                 if res.returncode != 0:
                     raise Exception("An unexpected error was encountered while running kmc_tools.")
 
-                ## Load in list of k-mers
-                database = MH.import_multiple_from_single_hdf5(training_prefix + ".h5")
-                kmers = sorted(set(itertools.chain.from_iterable(genome._kmers for genome in database)))
-
-                ## Iterate through KMC's dump file to extract k-mers and their counts while determining
-                #  their corresponding index
-                indices = []
-                data = []
-                for line in intersect_file:
-                    info = line.split()
-                    try:
-                        indices.append(kmers.index(info[0].decode("utf-8")))
-                        data.append(int(info[1]))
-                    except ValueError:
-                        print("k-mer mismatch") ## TODO: Identify why there are so many mismatches
-
+                ## Memory-map the k-mer index of the rows of the sensing matrix that FormWGSSensingMatrix.py saved for
+                #  these database files, or form it from the CMash database for training databases built before it did
+                #  (told by the sizes of the database files its header records, which copying them keeps)
+                if index_is_current:
+                    index = KmerIndex.load(index_directory)
+                else:
+                    packed = [pack_kmers(genome_kmers) for genome_kmers, _ in read_genomes(training_prefix + ".h5")]
+                    index = KmerIndex(np.unique(np.concatenate(packed)), k_size)
+                    del packed
+
+                ## Parse KMC's dump file in bulk and look the rows of its k-mers up (KMC reports canonical k-mers,
+                #  the rows of older training databases hold either strand)
+                dump_kmers, data = parse_kmc_dump(intersect_file.read(), k_size)
+                found, indices = index.lookup(dump_kmers)
+                mismatches = len(dump_kmers) - len(np.unique(found))
+                if mismatches:
+                    print(f"{mismatches} k-mer mismatches")
+                data = data[found]
 
     ## Sort the indices and data
-    sorter = sorted(range(len(indices)), key=indices.__getitem__)
-    indices = np.array([indices[i] for i in sorter])
-    data = np.array([data[i] for i in sorter])
-    data = data / np.sum(data)
+    sorter = np.argsort(indices, kind='stable')
+    indices = indices[sorter]
+    data = data[sorter] / np.sum(data)
     indptr = np.array([0, len(indices)])
 
     ## Create and save a csc_matrix as .npz file
-    save_npz(output_file_name, csc_matrix((data, indices, indptr), shape=(len(indices), 1)), compressed=True)
+    save_npz(output_file_name, csc_matrix((data, indices, indptr), shape=(len(index), 1)), compressed=True)
+
+    cache.store(key, {'y': saved_file})
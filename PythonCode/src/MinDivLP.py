@@ -1,9 +1,10 @@
 import numpy as np
-from .sparse_nnls import sparse_nnls
-from scipy.sparse import vstack
+from .sparse_nnls import sparse_nnls, GramCache, SolverStats, _choose_method
+from .SupportPattern import SupportPattern
+from scipy.sparse import csc_matrix, issparse
 
 
-def MinDivLP(A_k_small, A_k_large, y_small, y_large, const, q, thresh=0.01):
+def MinDivLP(A_k_small, A_k_large, y_small, y_large, const, q, thresh=0.01, gram=None, **kwargs):
     """ MinDivLP
     A basic, regularized version of the MinDivLP algorithm.
     Call via:
@@ -11,27 +12,83 @@ def MinDivLP(A_k_small, A_k_large, y_small, y_large, const, q, thresh=0.01):
 
     Parameters are:
     A_k_small is the[m_small, N] - sized sensing matrix
-    A_k_large is the[m_large, N] - sized sensing matrix
+    A_k_large is the[m_large, N] - sized sensing matrix, or its SupportPattern (only its support is used)
     y_small is the data vector of size[m_small, 1]
-    y_large is the data vector of size[m_large, 1]
+    y_large is the data vector of size[m_large, 1], dense or sparse (a sparse y_large is never densified, so its memory
+    scales with the k-mers observed in the sample rather than with m_large)
     lambda is the regularization paramater (larger values indicated better
     fit to constraints, at the cost potentially higher execution time and
     may lead to over - fitting if set too large. Typical value is 10000 or
     1000
     q is the parameter used in the MinDivLP algorithm. Must have 0 < q < 1,
     typically, q is set to something like q = 0.1
+    thresh is the value below which entries of the (normalized) solution are set to zero
+    gram is an optional GramCache of A_k_small, to reuse Gram entries across calls against the same reference
+    Any further keyword arguments (e.g. method='qr', or stats=SolverStats() to record solver diagnostics) are passed
+    on to sparse_nnls
 
     Returns:
     x_star: an [N, 1] vector
     """
 
-    B = A_k_large > 0
+    f = _support_pattern(A_k_large).weights(y_large, q)
 
-    epsilon = 0.0001
-    denom = np.power(B.T @ y_large, 1 - q) + epsilon
-    f = 1/denom
+    return _solve_sample(csc_matrix(const * A_k_small, dtype=float), f, y_small, const, thresh, gram, kwargs)
 
-    x_star = sparse_nnls(vstack((f.T, const * A_k_small)), np.append(0, const * y_small))
+
+def MinDivLP_batch(A_k_small, A_k_large, Y_small, Y_large, const, q, thresh=0.01, gram=None, stats=None, **kwargs):
+    """ MinDivLP_batch
+    MinDivLP for many samples against the same reference. The work that does not depend on the sample (the support
+    structure of A_k_large, the scaled sparse system and the Gram cache of A_k_small) is done once, and each
+    sample's NNLS problem is then solved against the shared system.
+    Call via:
+    X_star = MinDivLP_batch(A_k_small, A_k_large, Y_small, Y_large, lambda, q)
+
+    Parameters are:
+    A_k_small is the[m_small, N] - sized sensing matrix
+    A_k_large is the[m_large, N] - sized sensing matrix, or its SupportPattern
+    Y_small is the[m_small, S] - sized matrix holding one data vector per sample in its columns
+    Y_large is the[m_large, S] - sized matrix holding one data vector per sample in its columns (dense or sparse)
+    lambda, q and thresh are as in MinDivLP
+    gram is an optional GramCache of A_k_small (one is created when sparse_nnls would use the normal equations)
+    stats is an optional list to which the SolverStats of every sample's solve is appended, in sample order
+    Any further keyword arguments are passed on to sparse_nnls
+
+    Returns:
+    X_star: an [N, S] matrix whose columns are the reconstructions of the samples
+    """
+
+    pattern = _support_pattern(A_k_large)
+    Y_large = csc_matrix(Y_large) if issparse(Y_large) else np.asarray(Y_large)
+    F = np.column_stack([pattern.weights(Y_large[:, sample], q) for sample in range(Y_large.shape[1])])
+
+    C = csc_matrix(const * A_k_small, dtype=float)
+    if gram is None and kwargs.get('method', 'auto') in ('auto', 'gram') and _choose_method(C) == 'gram':
+        gram = GramCache(A_k_small)
+
+    Y_small = np.asarray(Y_small.toarray() if issparse(Y_small) else Y_small)
+    X_star = np.zeros((C.shape[1], Y_small.shape[1]))
+    for sample in range(Y_small.shape[1]):
+        if stats is not None:
+            stats.append(SolverStats())
+            kwargs['stats'] = stats[-1]
+        X_star[:, sample] = _solve_sample(C, F[:, sample], Y_small[:, sample], const, thresh, gram, kwargs)
+    return X_star
+
+
+def _support_pattern(A_k_large):
+    """ The SupportPattern of A_k_large, which may also be given as a SupportPattern already """
+    return A_k_large if isinstance(A_k_large, SupportPattern) else SupportPattern.from_matrix(A_k_large)
+
+
+def _solve_sample(C, f, y_small, const, thresh, gram, kwargs):
+    """ Solve the MinDivLP problem of one sample on C = const * A_k_small with the diversity weights f as the leading
+    row of the system (passed to sparse_nnls rather than stacked, so C is never copied or modified) """
+    f = np.asarray(f).ravel()
+    if gram is not None:
+        kwargs = dict(kwargs, gram=gram.with_leading_row(f, const))
+    y_small = np.asarray(y_small.toarray() if issparse(y_small) else y_small).ravel()
+    x_star = sparse_nnls(C, np.append(0, const * y_small), leading_row=f, **kwargs)
     x_star = x_star / sum(x_star)
     x_star[np.where(x_star < thresh)] = 0  # Set threshold
     return x_star
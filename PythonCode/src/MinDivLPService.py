@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+import argparse
+import csv
+import fcntl
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+from multiprocessing import get_context
+from time import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))  # make sure python knows where to find the code
+from PythonCode.src.ReferenceSet import ReferenceSet
+from PythonCode.src.ArtifactCache import ArtifactCache
+
+## Classifies many samples against one reference, loading the reference (sensing matrices, OTU ids and taxonomy) once.
+#  Samples are read from a manifest file, or sent one per line to a local (unix) socket by the clients of a
+#  long running service. Either way a sample is given as the tab separated line
+#      sample path <TAB> sample id <TAB> output directory
+#  and its taxonomic profile is written to {output directory}/taxonomy.tsv (and table.biom with --biom). A manifest can
+#  be processed by a pool of worker processes sharing the reference, and samples whose outputs exist are skipped, so an
+#  interrupted batch resumes where it stopped.
+
+TIMES_HEADER = ['sample id', 'input file', 'output dir', 'count', 'solve', 'write', 'total', 'error']
+
+
+def read_manifest(manifest):
+    """ The (sample path, sample id, output directory) of every line of manifest, skipping blank and # lines """
+    with open(manifest, "r") as fid:
+        for line in fid:
+            if line.strip() and not line.startswith("#"):
+                yield parse_sample(line)
+
+
+def parse_sample(line):
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) != 3:
+        raise Exception(f"Expected a sample path, a sample id and an output directory separated by tabs, got {line!r}")
+    return fields[0], fields[1], fields[2]
+
+
+def output_files(output_dir, biom=False):
+    """ The files written for a sample to output_dir """
+    return [os.path.join(output_dir, name) for name in (["taxonomy.tsv", "table.biom"] if biom else ["taxonomy.tsv"])]
+
+
+def process_sample(reference_set, input_file, sample_id, output_dir, biom=False):
+    """ Reconstructs the sample input_file against reference_set and writes its taxonomic profile to output_dir.
+    Outputs are written under temporary names and renamed when complete, so a sample whose outputs all exist has been
+    processed in full. Returns the time spent on each stage, as a dict. """
+    if not os.path.exists(input_file):
+        raise Exception(f"The input file {input_file} does not appear to exist")
+    timings = dict()
+    start = time()
+    y_small, y_large = reference_set.y_vectors(input_file)
+    timings['count'] = time() - start
+
+    start = time()
+    x_star = reference_set.solve(y_small, y_large)
+    timings['solve'] = time() - start
+
+    start = time()
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = output_files(output_dir, biom)
+    temporary = [output + ".tmp" for output in outputs]
+    reference_set.write_profile(x_star, sample_id, temporary[0])
+    if biom:
+        to_run = f"""biom convert -i "{temporary[0]}" -o "{temporary[1]}" --to-json --process-obs-metadata taxonomy"""
+        res = subprocess.run(to_run, shell=True, stdout=subprocess.DEVNULL)
+        if res.returncode != 0:
+            raise Exception("Failed to convert TSV to BIOM format")
+    for temporary_file, output in reversed(list(zip(temporary, outputs))):  # taxonomy.tsv last
+        os.replace(temporary_file, output)
+    timings['write'] = time() - start
+    return timings
+
+
+def append_row(file_name, row, header=None):
+    """ Appends row to the CSV file file_name (writing header first if the file is new), holding an exclusive lock on
+    the file so that processes appending to it at the same time do not interleave their rows """
+    with open(file_name, 'a', newline='') as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if header is not None and fd.tell() == 0:
+                csv.writer(fd).writerow(header)
+            csv.writer(fd).writerow(row)
+        finally:
+            fd.flush()
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def run_manifest(reference_set, samples, processes=1, biom=False, times_file=None, resume=True):
+    """ run_manifest
+    Processes the samples of a manifest against reference_set, in a pool of worker processes that attach to the
+    reference set in shared memory when processes > 1. The parent alone writes the timings, one row per sample as it
+    finishes.
+    Call via:
+    failed = run_manifest(reference_set, read_manifest("manifest.tsv"), processes=8, times_file="times.csv")
+
+    Parameters are:
+    reference_set is the ReferenceSet to classify the samples against
+    samples is an iterable of (sample path, sample id, output directory), as read_manifest yields them
+    processes is the number of worker processes
+    biom: if True, each profile is also converted to BIOM format
+    times_file is an optional CSV file to which the time of every stage of every sample is appended
+    resume: if True, samples whose outputs all exist are skipped
+
+    Returns:
+    failed: the list of (sample id, error message) of the samples that could not be processed
+    """
+    samples = list(samples)
+    pending = [sample for sample in samples
+               if not (resume and all(os.path.exists(output) for output in output_files(sample[2], biom)))]
+    if len(pending) < len(samples):
+        print(f"Skipping {len(samples) - len(pending)} samples whose outputs exist")
+    failed = list()
+
+    def record(sample, timings, error):
+        input_file, sample_id, output_dir = sample
+        if error is not None:
+            failed.append((sample_id, error))
+            print(sample_id, "failed:", error)
+            timings = dict()
+        else:
+            print(sample_id, " ".join(f"{stage}={seconds:.3f}" for stage, seconds in timings.items()))
+        if times_file is not None:
+            stages = [timings.get(stage, '') for stage in ('count', 'solve', 'write')]
+            append_row(times_file, [sample_id, input_file, output_dir] + stages +
+                       [sum(timings.values()) if timings else '', error or ''], TIMES_HEADER)
+
+    if processes == 1:
+        for sample in pending:
+            record(*_process_safely(reference_set, sample, biom))
+    else:
+        with reference_set.shared() as handle, \
+                get_context().Pool(processes, initializer=_init_worker, initargs=(handle, biom)) as pool:
+            for result in pool.imap_unordered(_process_worker_sample, pending):
+                record(*result)
+    return failed
+
+
+def _process_safely(reference_set, sample, biom):
+    """ (sample, timings, None) if the sample was processed, else (sample, None, the error message) """
+    try:
+        return sample, process_sample(reference_set, *sample, biom=biom), None
+    except Exception as error:
+        return sample, None, str(error)
+
+
+# State of a worker process of run_manifest: the reference set it attached to
+_worker = dict()
+
+
+def _init_worker(handle, biom):
+    _worker.update(reference_set=ReferenceSet.attach(handle), biom=biom)
+
+
+def _process_worker_sample(sample):
+    return _process_safely(_worker['reference_set'], sample, _worker['biom'])
+
+
+class _SampleHandler(socketserver.StreamRequestHandler):
+    """ Processes the samples sent over one connection, one per line, answering each with a line holding 'ok' and the
+    stage timings, or 'error' and the message. The line 'shutdown' stops the service. """
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode().rstrip("\n")
+            if line == "shutdown":
+                self.server.stopped = True
+                self.wfile.write(b"ok\n")
+                return
+            try:
+                timings = process_sample(self.server.reference_set, *parse_sample(line), biom=self.server.biom)
+                reply = "ok\t" + "\t".join(f"{stage}={seconds:.3f}" for stage, seconds in timings.items())
+            except Exception as error:
+                reply = f"error\t{error}"
+            self.wfile.write(reply.encode() + b"\n")
+
+
+def serve(reference_set, socket_path, biom=False):
+    """ Serves sample requests on the unix socket socket_path until a client sends 'shutdown' """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.UnixStreamServer(socket_path, _SampleHandler) as server:
+        server.reference_set = reference_set
+        server.biom = biom
+        server.stopped = False
+        try:
+            while not server.stopped:
+                server.handle_request()
+        finally:
+            os.remove(socket_path)
+
+
+def request(socket_path, input_file, sample_id, output_dir):
+    """ Sends one sample to the service listening on socket_path and returns its reply line """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(f"{input_file}\t{sample_id}\t{output_dir}\n".encode())
+        connection.shutdown(socket.SHUT_WR)
+        return connection.makefile().readline().rstrip("\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Reconstructs the population proportions of many samples against one reference, loaded once. "
+                    "Samples are given as lines 'sample path<TAB>sample id<TAB>output directory', in a manifest file "
+                    "or sent to a unix socket.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-r', '--reference', type=str, help="File name of reference database", required=True)
+    parser.add_argument('-t', '--taxonomy', type=str, help="File name of reference taxonomy", required=True)
+    parser.add_argument('-s', '--small_k', type=int,
+                        help="small k-mer size to use (Note: values >14 will probably take too long)", default=6)
+    parser.add_argument('-l', '--large_k', type=int,
+                        help="large k-mer size to use (Note: values >14 will probably take too long)", default=12)
+    parser.add_argument('-c', '--const', type=int, help="lambda (AKA const) value", default=10000)
+    parser.add_argument('-q', '--q_value', type=float, help="q value", default=0.1)
+    parser.add_argument('--count_complements', action="store_true",
+                        help="count compliment of sequences as well", default=False)
+    parser.add_argument('-b', '--biom', action="store_true",
+                        help="also convert each profile to BIOM format (needs the biom command)", default=False)
+    parser.add_argument('-p', '--processes', type=int,
+                        help="Number of worker processes to run the samples of a manifest with", default=1)
+    parser.add_argument('--times_file', type=str,
+                        help="CSV file to append the time of every stage of every sample to", default=None)
+    parser.add_argument('--overwrite', action="store_true",
+                        help="process every sample of the manifest, even those whose outputs exist (by default they "
+                             "are skipped, so an interrupted run resumes)", default=False)
+    parser.add_argument('--cache_dir', type=str,
+                        help="Directory of a cache of sensing matrices and y vectors keyed by the contents of their "
+                             "inputs and their parameters (default: the MINDIVLP_CACHE_DIR environment variable, else "
+                             "no cache)", default=None)
+    parser.add_argument('--cache_size', type=float,
+                        help="Size limit of the cache in GB, beyond which the least recently used entries are removed",
+                        default=20)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-m', '--manifest', type=str, help="File listing the samples to process, one per line")
+    source.add_argument('-u', '--socket', type=str, help="Path of a unix socket to serve sample requests on")
+
+    args = parser.parse_args()
+    if not os.path.exists(args.reference):
+        raise Exception(f"The reference file {args.reference} does not appear to exist")
+    if not os.path.exists(args.taxonomy):
+        raise Exception(f"The reference taxonomy file {args.taxonomy} does not appear to exist")
+
+    reference_set = ReferenceSet(args.reference, args.taxonomy, args.small_k, args.large_k, args.const, args.q_value,
+                                 count_complements=args.count_complements,
+                                 cache=ArtifactCache.from_args(args.cache_dir, args.cache_size))
+    print(f"Loaded the reference in {reference_set.load_time:.3f} s")
+
+    if args.manifest:
+        failed = run_manifest(reference_set, read_manifest(args.manifest), args.processes, args.biom,
+                              args.times_file, resume=not args.overwrite)
+        if failed:
+            raise Exception(f"{len(failed)} samples failed: {', '.join(sample_id for sample_id, _ in failed)}")
+    else:
+        print(f"Serving on {args.socket}")
+        serve(reference_set, args.socket, args.biom)
@@ -0,0 +1,274 @@
+import json
+import os
+import shutil
+from itertools import islice
+import numpy as np
+from scipy.sparse import csc_matrix, hstack
+from .CountKmers import _CODES
+from .SensingMatrixIO import sha256_file
+
+## k-mers of up to 32 bases packed 2 bits per base into uint64 codes, the first base the most significant (as in
+#  CountKmers), so that sorting the codes sorts the k-mers as strings. A k-mer then takes 8 bytes rather than a Python
+#  str of 70 or more, and looking k-mers up is a vectorized np.searchsorted in a sorted array of codes. With A, C, G, T
+#  coded 0 to 3 the complement of a base is its bitwise not, so reverse complements are formed 2 bits at a time over
+#  whole arrays.
+
+MAX_PACKED_K = 32
+_BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def pack_kmers(kmers):
+    """ The uint64 codes of the k-mers (str or bytes, or a numpy array of byte strings, all of the same length k <= 32,
+    of A, C, G and T only) """
+    if len(kmers) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    k = len(kmers[0])
+    if isinstance(kmers, np.ndarray) and kmers.dtype.kind == 'S':
+        joined = np.ascontiguousarray(kmers).tobytes() if kmers.dtype.itemsize == k else b''
+    else:
+        joined = ''.join(kmers).encode() if isinstance(kmers[0], str) else b''.join(kmers)
+    if not 0 < k <= MAX_PACKED_K or len(joined) != k * len(kmers):
+        raise Exception(f"k-mers must all have the same length, from 1 to {MAX_PACKED_K}")
+    return _pack_codes(_CODES[np.frombuffer(joined, dtype=np.uint8)].reshape(-1, k))
+
+
+def _pack_codes(codes):
+    """ The uint64 codes of the k-mers of the rows of codes, an [n, k] array of base codes """
+    if np.any(codes > 3):
+        raise Exception("k-mers may hold the bases A, C, G and T only")
+    packed = np.zeros(len(codes), dtype=np.uint64)
+    for position in range(codes.shape[1]):
+        packed <<= np.uint64(2)
+        packed |= codes[:, position]
+    return packed
+
+
+def unpack_kmers(packed, k):
+    """ The k-mers of the uint64 codes packed, as a numpy array of k byte strings """
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    bases = _BASES[((np.asarray(packed, dtype=np.uint64)[:, None] >> shifts) & np.uint64(3)).astype(np.intp)]
+    return np.ascontiguousarray(bases).view(f'S{k}').ravel()
+
+
+def parse_kmc_dump(text, k):
+    """ parse_kmc_dump
+    The k-mers and counts of the text of a kmc_dump file (lines of a k-mer, a tab and its count), parsed in bulk: the
+    k-mers are packed one base at a time from the bases at that offset of all the line starts, and the counts are
+    summed up from their digits one decimal place at a time over all the lines, so that only arrays of one entry per
+    line are formed (not one per base).
+    Call via:
+    with open("sample.dump", "rb") as fid:
+        packed, counts = parse_kmc_dump(fid.read(), 21)
+
+    Returns:
+    packed: the uint64 codes of the k-mers (see pack_kmers), in the order of the lines
+    counts: their counts, as int64
+    """
+    buffer = np.frombuffer(text, dtype=np.uint8)
+    if len(buffer) and buffer[-1] != ord('\n'):
+        buffer = np.append(buffer, np.uint8(ord('\n')))
+    ends = np.flatnonzero(buffer == ord('\n'))
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    if not 0 < k <= MAX_PACKED_K or np.any(ends - starts < k + 2) or np.any(buffer[starts + k] != ord('\t')):
+        raise Exception(f"Lines of a kmc_dump of {k}-mers must hold a {k}-mer, a tab and a count")
+    packed = np.zeros(len(starts), dtype=np.uint64)
+    for position in range(k):
+        codes = _CODES[buffer[starts + position]]
+        if np.any(codes > 3):
+            raise Exception("k-mers may hold the bases A, C, G and T only")
+        packed <<= np.uint64(2)
+        packed |= codes
+
+    digits_start = starts + k + 1
+    counts = np.zeros(len(starts), dtype=np.int64)
+    for place in range(np.max(ends - digits_start)):
+        in_count = digits_start + place < ends
+        digits = buffer[np.where(in_count, digits_start + place, 0)].astype(np.int64) - ord('0')
+        if np.any(in_count & ((digits < 0) | (digits > 9))):
+            raise Exception("Counts of a kmc_dump must be decimal integers")
+        counts[in_count] = 10 * counts[in_count] + digits[in_count]
+    return packed, counts
+
+
+def reverse_complement(packed, k):
+    """ The uint64 codes of the reverse complements of the k-mers of the codes packed """
+    complement = ~np.asarray(packed, dtype=np.uint64)
+    reverse = np.zeros(len(complement), dtype=np.uint64)
+    for _ in range(k):
+        reverse <<= np.uint64(2)
+        reverse |= complement & np.uint64(3)
+        complement >>= np.uint64(2)
+    return reverse
+
+
+def canonical_kmers(packed, k):
+    """ The canonical codes of the k-mers packed: the smaller of the codes of a k-mer and of its reverse complement (the
+    k-mer KMC reports when it counts both strands) """
+    packed = np.asarray(packed, dtype=np.uint64)
+    return np.minimum(packed, reverse_complement(packed, k))
+
+
+class KmerIndex:
+    """ KmerIndex
+    Looks up the rows of k-mers in the sorted array of distinct packed k-mers of a sensing matrix (as kmer_count_matrix
+    returns it) whichever strand they are given on. CMash keeps either strand of a k-mer while KMC reports the canonical
+    one, so the rows are looked up by canonical code, through the canonical codes of the rows sorted once. The index is
+    saved as .npy files in a directory (FormWGSSensingMatrix.py writes {output}_kmers) and memory-mapped on later loads,
+    so opening it costs no sorting and no reading of the CMash database. Its header.json records k and the sizes and
+    sha256 digests of the training database files it was saved for, so that whether it is current is told from the
+    sizes of those files (which, unlike their modification times, survive being copied) without reading them.
+    Call via:
+    index = KmerIndex(kmers, 21)  # or KmerIndex.load("TrainingDatabase_kmers")
+    found, rows = index.lookup(pack_kmers(sample_kmers))  # sample_kmers[found] are in rows
+
+    Parameters are:
+    kmers: the sorted uint64 codes of the k-mers of the rows
+    k: the k-mer size
+    """
+
+    files = ('kmers.npy', 'canonical.npy', 'order.npy', 'header.json')
+
+    def __init__(self, kmers, k, canonical=None, order=None, header=None):
+        self.kmers = np.asanyarray(kmers, dtype=np.uint64)
+        self.k = int(k)
+        self.header = header if header is not None else {'k': self.k}
+        if canonical is None:
+            canonical = canonical_kmers(self.kmers, k)
+            order = np.argsort(canonical, kind='stable').astype(np.int32 if len(canonical) < 2 ** 31 else np.int64)
+            canonical = canonical[order]
+        self._canonical = canonical
+        self._order = order
+
+    def __len__(self):
+        return len(self.kmers)
+
+    @staticmethod
+    def directory_for(prefix):
+        """ Where the index of the training database prefix is saved, e.g. TrainingDatabase_kmers """
+        return prefix + "_kmers"
+
+    def save(self, directory, database_files=()):
+        """ Saves the index as .npy files in directory, replacing any index saved there before. The sizes and sha256
+        digests of database_files (the training database the index belongs to) are recorded in its header. """
+        temporary = directory + ".tmp"
+        os.makedirs(temporary, exist_ok=True)
+        np.save(os.path.join(temporary, "kmers.npy"), self.kmers)
+        np.save(os.path.join(temporary, "canonical.npy"), np.asarray(self._canonical))
+        np.save(os.path.join(temporary, "order.npy"), np.asarray(self._order))
+        self.header = {'k': self.k, 'database': {os.path.basename(file_name): {
+            'size': os.path.getsize(file_name), 'sha256': sha256_file(file_name)} for file_name in database_files}}
+        with open(os.path.join(temporary, "header.json"), "w") as fid:
+            json.dump(self.header, fid, indent=2)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(temporary, directory)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """ Loads an index saved with save(); the arrays are memory-mapped unless mmap_mode is None """
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ('kmers', 'canonical', 'order')}
+        header = cls.read_header(directory)
+        return cls(arrays['kmers'], header['k'], arrays['canonical'], arrays['order'], header)
+
+    @staticmethod
+    def read_header(directory):
+        with open(os.path.join(directory, "header.json")) as fid:
+            return json.load(fid)
+
+    @classmethod
+    def is_current(cls, directory, database_files):
+        """ Whether directory holds an index saved for database_files as they are now, told from their sizes """
+        if not all(os.path.exists(os.path.join(directory, name)) for name in cls.files):
+            return False
+        database = cls.read_header(directory).get('database', {})
+        return all(os.path.exists(file_name) and os.path.basename(file_name) in database and
+                   database[os.path.basename(file_name)]['size'] == os.path.getsize(file_name)
+                   for file_name in database_files)
+
+    def lookup(self, packed):
+        """ lookup
+        The rows of the k-mers packed, matched on either strand. A k-mer whose two strands are both rows (as in the
+        matrices of training databases built before kmer_count_matrix merged the strands) is matched to both.
+
+        Returns:
+        found: the positions within packed of the k-mers matched, once per row they match, in increasing order
+        rows: the row each of those matches
+        """
+        canonical = canonical_kmers(packed, self.k)
+        first = np.searchsorted(self._canonical, canonical, side='left')
+        matches = np.searchsorted(self._canonical, canonical, side='right') - first
+        found = np.repeat(np.arange(len(canonical)), matches)
+        # the positions within the sorted canonical codes of every match: first, first + 1, ... for every k-mer
+        positions = np.repeat(first, matches) + np.arange(len(found)) - np.repeat(np.cumsum(matches) - matches, matches)
+        return found, np.asarray(self._order[positions], dtype=np.int64)
+
+
+def kmer_count_matrix(columns, batch_size=None, canonical=False):
+    """ kmer_count_matrix
+    The k-mer count matrix of a set of genomes: one row per distinct k-mer, in sorted order, and one column per genome.
+    Every genome's k-mers are packed and mapped to their rows with np.searchsorted, so forming the matrix takes
+    O(total log K) for K distinct k-mers. With a batch_size the genomes are read batch_size at a time: each batch is
+    formed into a block of columns over its own k-mers, which are merged into the sorted k-mers of all the batches so
+    far, and the rows of the blocks are mapped to the merged k-mers at the end. Memory is then bounded by the matrix
+    itself and one batch of genomes (e.g. read from the CMash database with CMashDatabase.read_genomes).
+    Call via:
+    kmers, A = kmer_count_matrix((genome._kmers, genome._counts) for genome in database)
+    kmers, A = kmer_count_matrix(read_genomes("TrainingDatabase.h5"), batch_size=1000)
+
+    Parameters are:
+    columns is an iterable of (kmers, counts) pairs, one per genome: its k-mers (str or bytes) and their counts
+    batch_size: the number of genomes to read at a time (default: all of them)
+    canonical: if True, every k-mer is counted in the row of its canonical k-mer (see canonical_kmers), so that a k-mer
+        kept on one strand in one genome and on the other in another is a single row, as KMC counts it in samples
+
+    Returns:
+    kmers: the sorted uint64 codes of the distinct (canonical) k-mers (see pack_kmers), the k-mer of every row
+    A: the [K, number of genomes] csc_matrix of the counts, its rows sorted within every column
+    """
+    columns = iter(columns)
+    kmers = np.zeros(0, dtype=np.uint64)
+    blocks = list()
+    while True:
+        batch = list(islice(columns, batch_size))
+        if not batch:
+            break
+        block_kmers, block = _count_block(batch, canonical)
+        kmers = _merge_sorted(kmers, block_kmers)
+        blocks.append((block_kmers, block))
+    if not blocks:
+        return kmers, csc_matrix((0, 0))
+    # the map from the k-mers of a block to the merged ones is increasing, so the rows stay sorted in every column
+    blocks = [csc_matrix((block.data, np.searchsorted(kmers, block_kmers)[block.indices], block.indptr),
+                         shape=(len(kmers), block.shape[1])) for block_kmers, block in blocks]
+    return kmers, blocks[0] if len(blocks) == 1 else hstack(blocks, format='csc')
+
+
+def _count_block(columns, canonical=False):
+    """ The sorted distinct k-mers of the list of (kmers, counts) pairs columns and their count matrix, the counts of
+    k-mers that share a row summed """
+    packed = [pack_kmers(column_kmers) for column_kmers, _ in columns]
+    if canonical:
+        packed = [canonical_kmers(column_kmers, len(kmers[0])) if len(kmers) else column_kmers
+                  for column_kmers, (kmers, _) in zip(packed, columns)]
+    kmers = np.unique(np.concatenate(packed))
+    indices = list()
+    data = list()
+    indptr = np.zeros(len(packed) + 1, dtype=np.int64)
+    for column, (column_kmers, (_, column_counts)) in enumerate(zip(packed, columns)):
+        column_counts = np.asarray(column_counts)
+        rows, inverse = np.unique(np.searchsorted(kmers, column_kmers), return_inverse=True)
+        indices.append(rows)
+        data.append(np.bincount(inverse, weights=column_counts, minlength=len(rows)).astype(column_counts.dtype))
+        indptr[column + 1] = indptr[column] + len(rows)
+    return kmers, csc_matrix((np.concatenate(data), np.concatenate(indices), indptr), shape=(len(kmers), len(packed)))
+
+
+def _merge_sorted(first, second):
+    """ The sorted distinct values of the sorted arrays of distinct values first and second, in linear time (a stable
+    sort of two sorted runs is a merge) """
+    merged = np.concatenate((first, second))
+    merged.sort(kind='stable')
+    return merged[np.concatenate(([True], merged[1:] != merged[:-1]))] if len(merged) else merged
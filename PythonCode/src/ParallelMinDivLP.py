@@ -0,0 +1,155 @@
+import numpy as np
+import queue
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from scipy.sparse import csc_matrix
+from .MinDivLP import _solve_sample, _support_pattern
+from .SupportPattern import SupportPattern
+from .sparse_nnls import GramCache, _choose_method
+
+
+class SharedCSC:
+    """ SharedCSC
+    Places the buffers (data, indices, indptr) of a csc_matrix in shared memory once, so that worker processes can
+    attach to them without copying. With pattern_only=True only indices and indptr are shared. Use as a context manager
+    (or call close()) to release the shared memory.
+    Call via:
+    with SharedCSC(A) as shared:
+        ... pass shared.handle to the workers, which call SharedCSC.attach(shared.handle) ...
+    """
+
+    def __init__(self, A, pattern_only=False):
+        A = csc_matrix(A)
+        # indices and indptr must share a dtype, else scipy would copy them when the workers rebuild the matrix
+        index_dtype = np.result_type(A.indices, A.indptr)
+        self._blocks = list()
+        try:
+            buffers = [self._share(array) for array in
+                       (A.indices.astype(index_dtype, copy=False), A.indptr.astype(index_dtype, copy=False))]
+            # with pattern_only, the values are left out and every stored entry reads as one in the attached matrix
+            data = None if pattern_only else self._share(A.data)
+        except BaseException:
+            self.close()  # unlink the segments created before the failure
+            raise
+        self.handle = (A.shape, data, buffers)
+
+    def _share(self, array):
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        return block.name, array.dtype.str, array.shape
+
+    @staticmethod
+    def attach(handle):
+        """ Returns a csc_matrix over the shared buffers described by handle, and the SharedMemory objects that must
+        stay referenced (and be closed) while the matrix is in use """
+        shape, data, buffers = handle
+        blocks = list()
+        arrays = list()
+        for name, dtype, array_shape in buffers if data is None else [data] + buffers:
+            block = SharedMemory(name=name)
+            blocks.append(block)
+            arrays.append(np.ndarray(array_shape, dtype=dtype, buffer=block.buf))
+        if data is None:
+            arrays.insert(0, np.broadcast_to(np.float64(1), arrays[0].shape))  # a read-only view, nothing allocated
+        return csc_matrix(tuple(arrays), shape=shape, copy=False), blocks
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# State of a worker process: the attached shared matrices and its own Gram cache
+_worker = dict()
+
+
+def _init_worker(small_handle, large_handle, const, q, thresh, use_gram, max_gram_columns, kwargs):
+    C, small_blocks = SharedCSC.attach(small_handle)
+    B, large_blocks = SharedCSC.attach(large_handle)
+    _worker.update(C=C, pattern=SupportPattern.from_matrix(B), blocks=small_blocks + large_blocks, const=const, q=q,
+                   thresh=thresh, kwargs=kwargs, gram=GramCache(C, max_columns=max_gram_columns) if use_gram else None)
+
+
+def _solve_worker_sample(index, y_small, y_large):
+    f = _worker['pattern'].weights(y_large, _worker['q'])
+    kwargs = _worker['kwargs']
+    if _worker['gram'] is not None:
+        # the worker's cache holds the Gram entries of the shared const * A_k_small, so the row is not rescaled
+        kwargs = dict(kwargs, gram=_worker['gram'].with_leading_row(f))
+    return index, _solve_sample(_worker['C'], f, y_small, _worker['const'], _worker['thresh'], None, kwargs)
+
+
+def MinDivLP_parallel(A_k_small, A_k_large, samples, const, q, thresh=0.01, workers=None, ordered=True,
+                      max_pending=None, max_gram_columns=None, **kwargs):
+    """ MinDivLP_parallel
+    Runs MinDivLP on a stream of samples with a pool of worker processes. const * A_k_small and the support pattern of
+    A_k_large are put in shared memory once and every worker attaches to them without copying; samples are handed
+    out through the pool's task queue and results are streamed back as they are solved.
+    Call via:
+    for index, x_star in MinDivLP_parallel(A_k_small, A_k_large, samples, lambda, q, workers=8):
+        ...
+
+    Parameters are:
+    A_k_small, A_k_large, lambda, q and thresh are as in MinDivLP
+    samples is an iterable of (y_small, y_large) pairs; it is consumed lazily
+    workers is the number of worker processes (default: the number of CPUs)
+    ordered: if True, results are yielded in the order of samples, otherwise as soon as they are ready
+    max_pending is the maximum number of samples handed to the pool but not yet yielded (default: 2 * workers), which
+        bounds the memory held by in-flight samples and results however many workers run
+    max_gram_columns bounds the Gram cache of each worker (see GramCache)
+    Any further keyword arguments are passed on to sparse_nnls
+
+    Yields:
+    (index, x_star): the position of the sample in samples and its [N, ] reconstruction
+    """
+
+    context = get_context()
+    workers = workers if workers is not None else context.cpu_count()
+    max_pending = max_pending if max_pending is not None else 2 * workers
+
+    C = csc_matrix(const * A_k_small, dtype=float)
+    use_gram = kwargs.get('method', 'auto') in ('auto', 'gram') and _choose_method(C) == 'gram'
+
+    with SharedCSC(C) as shared_small, \
+            SharedCSC(_support_pattern(A_k_large).matrix(), pattern_only=True) as shared_large:
+        del C
+        with context.Pool(workers, initializer=_init_worker,
+                          initargs=(shared_small.handle, shared_large.handle, const, q, thresh, use_gram,
+                                    max_gram_columns, kwargs)) as pool:
+            if ordered:
+                pending = deque()
+                for index, (y_small, y_large) in enumerate(samples):
+                    pending.append(pool.apply_async(_solve_worker_sample, (index, y_small, y_large)))
+                    if len(pending) >= max_pending:
+                        yield pending.popleft().get()
+                while pending:
+                    yield pending.popleft().get()
+            else:
+                finished = queue.Queue()
+                in_flight = 0
+                for index, (y_small, y_large) in enumerate(samples):
+                    pool.apply_async(_solve_worker_sample, (index, y_small, y_large), callback=finished.put,
+                                     error_callback=finished.put)
+                    in_flight += 1
+                    if in_flight >= max_pending:
+                        yield _finished_result(finished)
+                        in_flight -= 1
+                while in_flight > 0:
+                    yield _finished_result(finished)
+                    in_flight -= 1
+
+
+def _finished_result(finished):
+    result = finished.get()
+    if isinstance(result, BaseException):
+        raise result
+    return result
@@ -0,0 +1,186 @@
+import os
+import tempfile
+import numpy as np
+from contextlib import contextmanager
+from time import time
+from scipy.sparse import csc_matrix
+from .ArtifactCache import ArtifactCache
+from .CountKmers import sensing_matrix_blocks, y_vectors
+from .MinDivLP import _solve_sample
+from .ParallelMinDivLP import SharedCSC
+from .SensingMatrixIO import ARTIFACT_EXTENSION, save_sensing_matrix_blocks, load_sensing_matrix, current_artifact, \
+    is_artifact, read_header
+from .SupportPattern import SupportPattern
+from .ConvertXToTaxonomicProfile import convertToTaxonomy, read_otu_ids, read_taxonomy
+from .sparse_nnls import GramCache, _choose_method
+
+
+class ReferenceSet:
+    """ ReferenceSet
+    Everything MinDivLP needs from a reference that does not depend on the sample, loaded once: C = const * A_k_small
+    (and its Gram cache), the support pattern of A_k_large, the OTU ids of the reference FASTA and the taxonomy map.
+    Each sample then costs counting its k-mers and one solve. Worker processes can attach to a reference set placed in
+    shared memory (see shared and attach) rather than loading their own.
+    Call via:
+    reference_set = ReferenceSet("97_otus.fasta", "97_otu_taxonomy.txt", small_k=6, large_k=12)
+    x_star = reference_set.reconstruct("sample.fastq.gz")
+    reference_set.write_profile(x_star, "sample", "taxonomy.tsv")
+
+    Parameters are:
+    reference is the reference FASTA file; its sensing matrices are read from {reference}_A_{k}.mat, or from the
+        artifact {reference}_A_{k}.csc, and formed (and saved as that artifact) if neither exists
+    taxonomy is the tab separated file of the taxonomic id of every OTU of reference
+    small_k and large_k are the k-mer sizes of A_k_small and A_k_large
+    const, q and thresh are as in MinDivLP
+    count_complements: if True, the reverse complements of the k-mers are counted as well
+    cache is an optional ArtifactCache: the sensing matrices are then taken from it (formed and added to it if they
+        are not there) rather than from next to the reference, and the y vectors of the samples are cached as well
+    Any further keyword arguments are passed on to sparse_nnls
+    """
+
+    settings = ('reference', 'taxonomy', 'small_k', 'large_k', 'const', 'q', 'thresh', 'count_complements', 'cache',
+                'kwargs')
+
+    def __init__(self, reference, taxonomy, small_k=6, large_k=12, const=10000, q=0.1, thresh=0.01,
+                 count_complements=False, cache=None, **kwargs):
+        start = time()
+        self.reference = reference
+        self.taxonomy = taxonomy
+        self.small_k = small_k
+        self.large_k = large_k
+        self.const = const
+        self.q = q
+        self.thresh = thresh
+        self.count_complements = count_complements
+        self.cache = cache if cache is not None else ArtifactCache()
+        self.kwargs = kwargs
+
+        files = self.matrix_files(reference, [small_k, large_k], count_complements, self.cache)
+        self.C = csc_matrix(const * load_sensing_matrix(files[small_k]), dtype=float)
+        self.pattern = SupportPattern.for_matrix_file(files[large_k])
+        self.gram = self._gram_cache(self.C, kwargs)
+        self.otu_ids = read_otu_ids(reference)
+        self.taxonomy_map = read_taxonomy(taxonomy)
+        self._blocks = list()
+        self.load_time = time() - start
+
+    @staticmethod
+    def _gram_cache(C, kwargs):
+        """ A Gram cache of C = const * A_k_small if sparse_nnls would use the normal equations, else None """
+        use_gram = kwargs.get('method', 'auto') in ('auto', 'gram') and _choose_method(C) == 'gram'
+        return GramCache(C) if use_gram else None
+
+    @contextmanager
+    def shared(self):
+        """ Places C and the support pattern in shared memory for the duration of the with block, yielding a picklable
+        handle from which ReferenceSet.attach rebuilds the reference set in another process without copying them """
+        with SharedCSC(self.C) as shared_small, SharedCSC(self.pattern.matrix(), pattern_only=True) as shared_large:
+            yield dict(small=shared_small.handle, large=shared_large.handle, otu_ids=self.otu_ids,
+                       taxonomy_map=self.taxonomy_map, **{name: getattr(self, name) for name in self.settings})
+
+    @classmethod
+    def attach(cls, handle):
+        """ The reference set whose handle was yielded by shared(), over the shared memory of the process that holds
+        it (which must stay in its with block while the attached reference set is in use) """
+        start = time()
+        reference_set = cls.__new__(cls)
+        for name in cls.settings + ('otu_ids', 'taxonomy_map'):
+            setattr(reference_set, name, handle[name])
+        reference_set.C, small_blocks = SharedCSC.attach(handle['small'])
+        B, large_blocks = SharedCSC.attach(handle['large'])
+        reference_set.pattern = SupportPattern.from_matrix(B)
+        reference_set.gram = cls._gram_cache(reference_set.C, reference_set.kwargs)
+        reference_set._blocks = small_blocks + large_blocks
+        reference_set.load_time = time() - start
+        return reference_set
+
+    @staticmethod
+    def matrix_key(cache, reference, k, count_complements=False):
+        """ The key of the sensing matrix of reference for k in cache, as Form16SSensingMatrix.py --format csc
+        --cache_dir keys it """
+        return cache.key([reference], kind='16S sensing matrix', k=k, count_complements=count_complements,
+                         engine='numpy', layout='csc', chunk_size=None)
+
+    @staticmethod
+    def matrix_files(reference, k_sizes, count_complements=False, cache=None):
+        """ The sensing matrix file of reference for every k of k_sizes. With an (enabled) ArtifactCache, this is the
+        artifact of the cache entry keyed by the contents of reference, k and count_complements (the entry
+        Form16SSensingMatrix.py --format csc --cache_dir uses). Otherwise it is {reference}_A_{k}.mat if that exists,
+        else the artifact {reference}_A_{k}.csc; an exception is raised if the header of the artifact (that of the .mat
+        file, for a .mat file with a current one) records the other count_complements. Missing matrices are formed (all
+        the k sizes in one pass) and saved there. """
+        files = dict()
+        keys = dict()
+        for k in k_sizes:
+            if cache is not None and cache.enabled:
+                keys[k] = ReferenceSet.matrix_key(cache, reference, k, count_complements)
+                entry = cache.entry(keys[k])
+                files[k] = os.path.join(entry, 'A_k') if entry is not None else None
+            else:
+                mat_file = f"{reference}_A_{k}.mat"
+                files[k] = mat_file if os.path.exists(mat_file) else f"{reference}_A_{k}{ARTIFACT_EXTENSION}"
+                if os.path.exists(files[k]):
+                    ReferenceSet._check_complements(files[k], count_complements)
+        missing = [k for k in k_sizes if files[k] is None or not os.path.exists(files[k])]
+        if missing:
+            with tempfile.TemporaryDirectory() as directory:
+                paths = {k: files[k] if k not in keys else os.path.join(directory, f"A_{k}{ARTIFACT_EXTENSION}")
+                         for k in missing}
+                # the blocks of columns are streamed into the artifacts, never holding a matrix whole
+                blocks = sensing_matrix_blocks(reference, missing, count_complements, chunk_size=10000)
+                save_sensing_matrix_blocks(blocks, paths, reference=reference, count_complements=count_complements)
+                for k in missing:
+                    if k in keys:
+                        # storing one k must not evict the entry of another that is about to be loaded
+                        files[k] = os.path.join(cache.store(keys[k], {'A_k': paths[k]}, keep=keys.values()), 'A_k')
+        return files
+
+    @staticmethod
+    def _check_complements(path, count_complements):
+        """ Raises an exception if the sensing matrix file path records that it was formed with the other
+        count_complements (matrices that record neither, such as .mat files without an artifact, are taken as they
+        are) """
+        artifact = path if is_artifact(path) else current_artifact(path)
+        stored = read_header(artifact).get('count_complements') if artifact is not None else None
+        if stored is not None and stored != count_complements:
+            raise Exception(f"The sensing matrix {path} was formed with count_complements={stored}, not "
+                            f"{count_complements}: remove it to form it again, or pass a cache, which keeps both")
+
+    def y_vectors(self, input_file):
+        """ The y_small and y_large vectors of the FASTA or FASTQ sample input_file, counted in one pass (or taken from
+        the cache if they were counted before) """
+        key = self.cache.key([input_file], kind='16S y vectors', k_sizes=[self.small_k, self.large_k],
+                             count_complements=self.count_complements)
+        entry = self.cache.entry(key)
+        if entry is not None:
+            with np.load(os.path.join(entry, 'y.npz')) as y:
+                return y['y_small'], y['y_large']
+        y = y_vectors(input_file, [self.small_k, self.large_k], self.count_complements)
+        if self.cache.enabled:
+            with tempfile.TemporaryDirectory() as directory:
+                y_file = os.path.join(directory, 'y.npz')
+                np.savez_compressed(y_file, y_small=y[self.small_k], y_large=y[self.large_k])
+                matrix_keys = [self.matrix_key(self.cache, self.reference, k, self.count_complements)
+                               for k in (self.small_k, self.large_k)]
+                self.cache.store(key, {'y.npz': y_file}, keep=matrix_keys)
+        return y[self.small_k], y[self.large_k]
+
+    def reconstruct(self, input_file, stats=None):
+        """ The MinDivLP reconstruction x_star of the sample input_file (stats is an optional SolverStats) """
+        y_small, y_large = self.y_vectors(input_file)
+        return self.solve(y_small, y_large, stats)
+
+    def solve(self, y_small, y_large, stats=None):
+        """ The MinDivLP reconstruction x_star of the sample with the data vectors y_small and y_large """
+        f = self.pattern.weights(y_large, self.q)
+        kwargs = self.kwargs if stats is None else dict(self.kwargs, stats=stats)
+        if self.gram is not None:
+            # the cache holds the Gram entries of C itself, so the leading row is not rescaled
+            kwargs = dict(kwargs, gram=self.gram.with_leading_row(f))
+        return _solve_sample(self.C, f, y_small, self.const, self.thresh, None, kwargs)
+
+    def write_profile(self, x_star, sample_id, tsv_file, append=False):
+        """ Writes the taxonomic profile of x_star to tsv_file (see convertToTaxonomy), replacing any file there unless
+        append is True, in which case the profile is added to it as a column of sample_id """
+        convertToTaxonomy(x_star, self.reference, self.taxonomy, sample_id, tsv_file, append=append,
+                          otu_ids=self.otu_ids, taxonomy_map=self.taxonomy_map)
@@ -0,0 +1,228 @@
+#! /usr/bin/env python
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import numpy as np
+import scipy.io as sio
+from scipy.sparse import csc_matrix
+
+## A sensing matrix saved as a directory of raw .npy buffers (data as float32, indices and indptr as int32 where they
+#  fit) and a header.json describing it, e.g. 97_otus.fasta_A_12.csc for 97_otus.fasta_A_12.mat. Loading memory-maps
+#  the buffers, so nothing is decompressed or copied.
+
+ARTIFACT_EXTENSION = ".csc"
+FORMAT_VERSION = 1
+
+
+def artifact_path(mat_file):
+    """ Where the artifact of a .mat sensing matrix goes, e.g. 97_otus.fasta_A_12.csc for 97_otus.fasta_A_12.mat """
+    return os.path.splitext(mat_file)[0] + ARTIFACT_EXTENSION
+
+
+def sha256_file(file_name, block_size=1 << 20):
+    """ The hex sha256 digest of the contents of file_name """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as fid:
+        for block in iter(lambda: fid.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_sensing_matrix(A, directory, k=None, reference=None, count_complements=None, normalization='l1'):
+    """ save_sensing_matrix
+    Saves the sensing matrix A to the artifact directory (replacing anything saved there before).
+    Call via:
+    save_sensing_matrix(A_k, "97_otus.fasta_A_12.csc", k=12, reference="97_otus.fasta")
+
+    Parameters are:
+    A is the sensing matrix (converted to CSC if need be)
+    directory is the artifact directory to write
+    k is the k-mer size the matrix was formed with (optional, recorded in the header)
+    reference is the FASTA file the matrix was formed from (optional); its name and sha256 are recorded in the header
+    count_complements: whether reverse complements were counted (optional, recorded in the header)
+    normalization: how the columns were normalized (recorded in the header)
+    """
+    A = csc_matrix(A)
+    index_dtype = _index_dtype(A.shape[0], A.nnz)
+    temporary = directory.rstrip(os.sep) + ".tmp"
+    os.makedirs(temporary, exist_ok=True)
+    np.save(os.path.join(temporary, "data.npy"), A.data.astype(np.float32, copy=False))
+    np.save(os.path.join(temporary, "indices.npy"), A.indices.astype(index_dtype, copy=False))
+    np.save(os.path.join(temporary, "indptr.npy"), A.indptr.astype(index_dtype, copy=False))
+    _finish(temporary, directory, _header(A.shape, A.nnz, index_dtype, k, reference, count_complements, normalization))
+
+
+def _index_dtype(num_rows, nnz):
+    # indices and indptr share a dtype, else scipy would copy them when the matrix is loaded
+    return np.int32 if max(nnz, num_rows) <= np.iinfo(np.int32).max else np.int64
+
+
+def _header(shape, nnz, index_dtype, k, reference, count_complements, normalization):
+    return {'format_version': FORMAT_VERSION, 'shape': list(shape), 'nnz': int(nnz), 'k': k,
+            'reference': None if reference is None else os.path.basename(reference),
+            'reference_sha256': None if reference is None else sha256_file(reference),
+            'normalization': normalization, 'count_complements': count_complements,
+            'data_dtype': np.dtype(np.float32).str, 'index_dtype': np.dtype(index_dtype).str}
+
+
+def _finish(temporary, directory, header):
+    """ Writes the header to the temporary artifact directory and moves it to directory """
+    with open(os.path.join(temporary, "header.json"), 'w') as fid:
+        json.dump(header, fid, indent=2)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(temporary, directory)
+
+
+class SensingMatrixWriter:
+    """ SensingMatrixWriter
+    Streams a sensing matrix into an artifact directory a block of columns at a time, so that the matrix is never held
+    in memory as a whole: the data and row indices of every block are appended to raw files as they come, and moved
+    into the .npy buffers of the artifact (in slices of copy_size entries) when the writer is closed.
+    Call via:
+    writer = SensingMatrixWriter("97_otus.fasta_A_12.csc", k=12, reference="97_otus.fasta")
+    for block in blocks: writer.append(block)
+    writer.close()
+
+    Parameters are:
+    directory, k, reference, count_complements and normalization are as for save_sensing_matrix
+    """
+
+    copy_size = 1 << 24
+
+    def __init__(self, directory, k=None, reference=None, count_complements=None, normalization='l1'):
+        self.directory = directory
+        self.header = dict(k=k, reference=reference, count_complements=count_complements, normalization=normalization)
+        self.temporary = directory.rstrip(os.sep) + ".tmp"
+        if os.path.exists(self.temporary):
+            shutil.rmtree(self.temporary)
+        os.makedirs(self.temporary)
+        self._data = open(os.path.join(self.temporary, "data.raw"), 'wb')
+        self._indices = open(os.path.join(self.temporary, "indices.raw"), 'wb')
+        self.num_rows = None
+        self.nnz = 0
+        self._column_nnz = list()
+
+    def append(self, block):
+        """ Appends the columns of the matrix block """
+        block = csc_matrix(block)
+        if self.num_rows is None:
+            self.num_rows = block.shape[0]
+        elif block.shape[0] != self.num_rows:
+            raise Exception(f"A block of {block.shape[0]} rows was appended to a sensing matrix of {self.num_rows}")
+        block.data.astype(np.float32, copy=False).tofile(self._data)
+        block.indices.astype(np.int64, copy=False).tofile(self._indices)
+        self.nnz += block.nnz
+        self._column_nnz.append(np.diff(block.indptr))
+
+    def close(self):
+        """ Writes the artifact and returns its directory """
+        self._data.close()
+        self._indices.close()
+        index_dtype = _index_dtype(self.num_rows or 0, self.nnz)
+        for name, raw_dtype, dtype in (("data", np.float32, np.float32), ("indices", np.int64, index_dtype)):
+            raw_file = os.path.join(self.temporary, f"{name}.raw")
+            buffer = np.lib.format.open_memmap(os.path.join(self.temporary, f"{name}.npy"), mode='w+', dtype=dtype,
+                                               shape=(self.nnz,))
+            if self.nnz:
+                raw = np.memmap(raw_file, dtype=raw_dtype, mode='r')
+                for start in range(0, self.nnz, self.copy_size):
+                    buffer[start:start + self.copy_size] = raw[start:start + self.copy_size]
+                del raw
+            buffer.flush()
+            del buffer
+            os.remove(raw_file)
+        column_nnz = np.concatenate(self._column_nnz) if self._column_nnz else np.zeros(0, dtype=index_dtype)
+        indptr = np.concatenate(([0], np.cumsum(column_nnz))).astype(index_dtype)
+        np.save(os.path.join(self.temporary, "indptr.npy"), indptr)
+        shape = (self.num_rows or 0, len(column_nnz))
+        _finish(self.temporary, self.directory, _header(shape, self.nnz, index_dtype, **self.header))
+        return self.directory
+
+
+def save_sensing_matrix_blocks(blocks, directories, reference=None, count_complements=None):
+    """ Streams the column blocks yielded by CountKmers.sensing_matrix_blocks (a dict of blocks keyed by k) into the
+    artifact directories[k] of each k as they come, and returns the number of blocks """
+    writers = {k: SensingMatrixWriter(directory, k=k, reference=reference, count_complements=count_complements)
+               for k, directory in directories.items()}
+    count = 0
+    for count, block in enumerate(blocks, start=1):
+        for k, writer in writers.items():
+            writer.append(block[k])
+    for writer in writers.values():
+        writer.close()
+    return count
+
+
+def read_header(directory):
+    """ The header of the artifact directory as a dict """
+    with open(os.path.join(directory, "header.json")) as fid:
+        return json.load(fid)
+
+
+def is_artifact(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "header.json"))
+
+
+def current_artifact(mat_file):
+    """ The artifact of mat_file if it exists and is at least as recent as mat_file, else None """
+    artifact = artifact_path(mat_file)
+    if is_artifact(artifact) and os.path.getmtime(os.path.join(artifact, "header.json")) >= os.path.getmtime(mat_file):
+        return artifact
+    return None
+
+
+def load_sensing_matrix(path, mmap_mode='r', key='A_k'):
+    """ load_sensing_matrix
+    Loads a sensing matrix from an artifact directory, memory-mapping its buffers, or from a .mat file. For a .mat file
+    whose artifact (see artifact_path) exists and is at least as recent, the artifact is loaded instead.
+    Call via:
+    A_k = load_sensing_matrix("97_otus.fasta_A_12.mat")
+
+    Parameters are:
+    path is an artifact directory or a .mat file
+    mmap_mode is passed to np.load for the buffers of an artifact (None reads them into memory)
+    key is the variable of a .mat file holding the matrix
+
+    Returns:
+    A_k: the sensing matrix as a csc_matrix (over read-only memory maps when loaded from an artifact)
+    """
+    if not is_artifact(path):
+        if current_artifact(path) is None:
+            return csc_matrix(sio.loadmat(path)[key])
+        path = current_artifact(path)
+    header = read_header(path)
+    if header['format_version'] > FORMAT_VERSION:
+        raise Exception(f"The sensing matrix {path} has format version {header['format_version']}, "
+                        f"but only versions up to {FORMAT_VERSION} can be read")
+    data, indices, indptr = (np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                             for name in ("data", "indices", "indptr"))
+    return csc_matrix((data, indices, indptr), shape=tuple(header['shape']), copy=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Converts sensing matrices saved in .mat format to memory-mappable artifact directories "
+                    "(written next to them, e.g. 97_otus.fasta_A_12.csc for 97_otus.fasta_A_12.mat).",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input_files', type=str, nargs='+', help=".mat files to convert", required=True)
+    parser.add_argument('-r', '--reference', type=str,
+                        help="FASTA file the matrices were formed from, to record its checksum", default=None)
+    parser.add_argument('-c', '--count_complements', action="store_const", const=True,
+                        help="record that compliments of sequences were counted (files named *_no_c.mat are recorded "
+                             "as not counting them)", default=None)
+
+    args = parser.parse_args()
+    for input_file in args.input_files:
+        if not os.path.exists(input_file):
+            raise Exception(f"The input file {input_file} does not appear to exist")
+        # the k-mer size is taken from the usual {reference}_A_{k}.mat name
+        match = re.search(r"_A_(\d+)(_no_c)?\.mat$", input_file)
+        output = artifact_path(input_file)
+        count_complements = False if match and match.group(2) else args.count_complements
+        save_sensing_matrix(sio.loadmat(input_file)['A_k'], output, k=int(match.group(1)) if match else None,
+                            reference=args.reference, count_complements=count_complements)
+        print(f"Converted {input_file} to {output}")
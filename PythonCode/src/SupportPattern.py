@@ -0,0 +1,129 @@
+import os
+import shutil
+import numpy as np
+import scipy.io as sio
+from scipy.sparse import csc_matrix, issparse
+from .SensingMatrixIO import is_artifact, current_artifact, load_sensing_matrix
+
+# Patterns already loaded in this process, keyed by the absolute path of their .mat file
+_loaded = dict()
+
+
+class SupportPattern:
+    """ SupportPattern
+    The support pattern B = A_k > 0 of a sensing matrix in compact form: the CSC indices and indptr only (int32 where
+    they fit, no data array) and the number of nonzeros of each column. B depends only on the reference and k, so it is
+    built once, saved next to the sensing matrix and memory-mapped on later loads; forming the diversity weights of a
+    new sample is then a single pass over the pattern.
+    Call via:
+    pattern = SupportPattern.for_matrix_file("97_otus.fasta_A_12.mat")
+    f = pattern.weights(y_large, q)
+    x_star = MinDivLP(A_k_small, pattern, y_small, y_large, lambda, q)  # in place of A_k_large
+    """
+
+    files = ('indices', 'indptr', 'column_nnz', 'shape')
+
+    def __init__(self, indices, indptr, shape, column_nnz=None):
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = tuple(int(s) for s in shape)
+        self.column_nnz = column_nnz if column_nnz is not None else np.diff(indptr).astype(np.int32)
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1])
+
+    @classmethod
+    def from_matrix(cls, A):
+        """ The support pattern of the sensing matrix A (dense or sparse). The stored entries of A are taken to be its
+        positive ones, as they are in the k-mer sensing matrices. If A is in CSC format, its index arrays are used as
+        they are. """
+        A = csc_matrix(A)  # no copy if A is already in CSC format
+        return cls(A.indices, A.indptr, A.shape)
+
+    @classmethod
+    def for_matrix_file(cls, mat_file, key='A_k'):
+        """ The support pattern of the sensing matrix saved (under key) in mat_file. It is read from the pattern
+        directory next to mat_file if that is at least as recent as mat_file, and otherwise built and saved there.
+        If mat_file is an artifact directory (see SensingMatrixIO), or has a current one, the pattern is its memory
+        mapped indices and indptr. Patterns are cached per process, so repeated calls return the same object. """
+        mat_file = os.path.abspath(mat_file)
+        directory = cls.directory_for(mat_file)
+        if mat_file in _loaded and _loaded[mat_file][0] == os.path.getmtime(mat_file):
+            return _loaded[mat_file][1]
+        artifact = mat_file if is_artifact(mat_file) else current_artifact(mat_file)
+        if artifact is not None:
+            A = load_sensing_matrix(artifact)
+            pattern = cls(A.indices, A.indptr, A.shape)
+        elif cls._is_current(directory, mat_file):
+            pattern = cls.load(directory)
+        else:
+            pattern = cls.from_matrix(sio.loadmat(mat_file)[key])
+            pattern.save(directory)
+            pattern = cls.load(directory)  # drop the loaded matrix for the memory-mapped copy
+        _loaded[mat_file] = (os.path.getmtime(mat_file), pattern)
+        return pattern
+
+    @staticmethod
+    def directory_for(mat_file):
+        """ Where the pattern of mat_file is saved, e.g. 97_otus.fasta_A_12_pattern for 97_otus.fasta_A_12.mat """
+        return os.path.splitext(mat_file)[0] + "_pattern"
+
+    @classmethod
+    def _is_current(cls, directory, mat_file):
+        paths = [os.path.join(directory, f"{name}.npy") for name in cls.files]
+        return all(os.path.exists(path) for path in paths) and \
+            min(os.path.getmtime(path) for path in paths) >= os.path.getmtime(mat_file)
+
+    def save(self, directory):
+        """ Saves the pattern as .npy files in directory, replacing any pattern saved there before """
+        index_dtype = np.int32 if max(self.nnz, self.shape[0]) <= np.iinfo(np.int32).max else np.int64
+        temporary = directory + ".tmp"
+        os.makedirs(temporary, exist_ok=True)
+        np.save(os.path.join(temporary, "indices.npy"), np.asarray(self.indices, dtype=index_dtype))
+        np.save(os.path.join(temporary, "indptr.npy"), np.asarray(self.indptr, dtype=index_dtype))
+        np.save(os.path.join(temporary, "column_nnz.npy"), np.asarray(self.column_nnz, dtype=np.int32))
+        np.save(os.path.join(temporary, "shape.npy"), np.array(self.shape, dtype=np.int64))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(temporary, directory)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """ Loads a pattern saved with save(); the arrays are memory-mapped unless mmap_mode is None """
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ('indices', 'indptr', 'column_nnz')}
+        shape = np.load(os.path.join(directory, "shape.npy"))
+        return cls(arrays['indices'], arrays['indptr'], shape, arrays['column_nnz'])
+
+    def matrix(self):
+        """ B as a csc_matrix over the pattern's index arrays, with every stored entry reading as one (the data is a
+        broadcast view, so nothing of size nnz is allocated) """
+        ones = np.broadcast_to(np.float64(1), (self.nnz,))
+        return csc_matrix((ones, self.indices, self.indptr), shape=self.shape, copy=False)
+
+    def column_sums(self, y):
+        """ B^T y: the sum of the entries of y over the support of each column. y may be a dense vector or a sparse
+        [m, 1] (or [1, m]) matrix, such as CountKmers.y_vector(..., sparse=True) gives, which is never densified """
+        values = self._sparse_values(y) if issparse(y) else np.asarray(y).ravel()[self.indices]
+        sums = np.zeros(self.shape[1])
+        starts = self.indptr[:-1]
+        nonempty = self.column_nnz > 0
+        if np.any(nonempty):
+            sums[nonempty] = np.add.reduceat(values, starts[nonempty])
+        return sums
+
+    def _sparse_values(self, y):
+        """ The entries of the sparse vector y at the rows of the pattern's stored entries (zero where y has none) """
+        y = csc_matrix(y.reshape(-1, 1) if y.shape[0] == 1 else y)
+        y.sum_duplicates()  # sorts the rows, for the search below
+        rows, data = y.indices, y.data.astype(float, copy=False)
+        if len(rows) == 0:
+            return np.zeros(self.nnz)
+        positions = np.minimum(np.searchsorted(rows, self.indices), len(rows) - 1)
+        return np.where(rows[positions] == self.indices, data[positions], 0)
+
+    def weights(self, y_large, q):
+        """ The MinDivLP diversity weights f = 1 / ((B^T y_large)^(1-q) + epsilon) of the sample y_large """
+        epsilon = 0.0001
+        return 1 / (np.power(self.column_sums(y_large), 1 - q) + epsilon)
@@ -1,10 +1,406 @@
 # /usr/bin/env python
-from numpy import (zeros, ones, finfo, inf, argmax)
-from scipy.sparse.linalg import (norm, lsqr)
+import json
+from time import perf_counter
+from numpy import (zeros, ones, empty, eye, cumsum, diff, repeat, isin, finfo, inf, argmax, argpartition, flatnonzero,
+                   sqrt, dot, outer, ix_, asarray, concatenate, result_type)
+from numpy.linalg import norm as vnorm, LinAlgError
+from scipy.linalg import (qr_insert, qr_delete, solve_triangular)
+from scipy.sparse import csc_matrix, issparse
+from scipy.sparse.linalg import (norm, lsqr, LinearOperator)
 from scipy.sparse._sparsetools import (csr_matvec, csc_matvec)
 
 
-def sparse_nnls(C, d, tol=-1, itmax_factor=3):
+def _dense_column(C, j, leading_row=None):
+    """ Return column j of the csc_matrix C (with leading_row, if given, stacked on top) as a dense ndarray, read
+    straight from the CSC buffers """
+    offset = 0 if leading_row is None else 1
+    col = zeros(C.shape[0] + offset)
+    col[C.indices[C.indptr[j]:C.indptr[j + 1]] + offset] = C.data[C.indptr[j]:C.indptr[j + 1]]
+    if leading_row is not None:
+        col[0] = leading_row[j]
+    return col
+
+
+def _gradient(C, Ctrans, leading_row, d, x):
+    """ Return w = C^T (d - Cx) and ||d - Cx||_2, with leading_row (if given) stacked on top of C """
+    m, n = C.shape
+    # resid = d - C*x
+    resid = -d[len(d) - m:]
+    csc_matvec(m, n, C.indptr, C.indices, C.data, x, resid)
+    resid = -resid
+    # w = Ctrans*resid
+    w = zeros(n)
+    csr_matvec(n, m, Ctrans.indptr, Ctrans.indices, Ctrans.data, resid, w)
+    resid_norm = vnorm(resid)
+    if leading_row is not None:
+        leading_resid = d[0] - dot(leading_row, x)
+        w += leading_resid * leading_row
+        resid_norm = sqrt(resid_norm ** 2 + leading_resid ** 2)
+    return w, resid_norm
+
+
+class ActiveColumns(LinearOperator):
+    """ A LinearOperator for the columns C[:, cols] of a csc_matrix C that never copies C
+
+    The active columns are kept as CSC buffers of their own (indptr, row indices and values, one column after
+    another), appended to when a column is added and compacted in place when columns are removed, so keeping the
+    operator in step with the positive set costs time proportional to the nonzeros of the changed columns rather than
+    to the size of C. Products are formed by scipy's CSC kernels over these buffers. Columns are ordered as they were
+    added. If leading_row is given, it is stacked on top of C as an extra dense row.
+    """
+
+    def __init__(self, C, leading_row=None):
+        self.C = C
+        self.leading_row = leading_row
+        self._offset = 0 if leading_row is None else 1
+        index_dtype = result_type(C.indices.dtype, C.indptr.dtype)
+        self._cols = empty(16, dtype=index_dtype)
+        self._ncols = 0
+        self._indptr = zeros(17, dtype=index_dtype)
+        self._rows = empty(16, dtype=index_dtype)
+        self._vals = empty(16, dtype=result_type(C.dtype, float))
+        super().__init__(self._vals.dtype, (C.shape[0] + self._offset, 0))
+
+    @property
+    def cols(self):
+        return self._cols[:self._ncols]
+
+    @property
+    def _nnz(self):
+        return self._indptr[self._ncols]
+
+    def add(self, j):
+        start, end = self.C.indptr[j], self.C.indptr[j + 1]
+        if self._ncols == len(self._cols):
+            self._cols = self._grow(self._cols, self._ncols + 1)
+            self._indptr = self._grow(self._indptr, self._ncols + 2)
+        nnz = self._nnz
+        if nnz + end - start > len(self._rows):
+            self._rows = self._grow(self._rows, nnz + end - start)
+            self._vals = self._grow(self._vals, nnz + end - start)
+        self._rows[nnz:nnz + end - start] = self.C.indices[start:end]
+        self._vals[nnz:nnz + end - start] = self.C.data[start:end]
+        self._cols[self._ncols] = j
+        self._ncols += 1
+        self._indptr[self._ncols] = nnz + end - start
+        self.shape = (self.C.shape[0] + self._offset, self._ncols)
+
+    def remove(self, cols):
+        keep_cols = ~isin(self.cols, cols)
+        lengths = diff(self._indptr[:self._ncols + 1])
+        keep = repeat(keep_cols, lengths)
+        nnz = int(keep.sum())
+        self._rows[:nnz] = self._rows[:self._nnz][keep]
+        self._vals[:nnz] = self._vals[:self._nnz][keep]
+        ncols = int(keep_cols.sum())
+        self._indptr[1:ncols + 1] = cumsum(lengths[keep_cols])
+        self._cols[:ncols] = self.cols[keep_cols]
+        self._ncols = ncols
+        self.shape = (self.C.shape[0] + self._offset, self._ncols)
+
+    @staticmethod
+    def _grow(array, needed):
+        grown = empty(max(needed, 2 * len(array)), dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _matvec(self, x):
+        x = asarray(x, dtype=self.dtype).ravel()
+        y = zeros(self.C.shape[0], dtype=self.dtype)
+        csc_matvec(self.C.shape[0], self._ncols, self._indptr, self._rows, self._vals, x, y)
+        if self.leading_row is not None:
+            y = concatenate(([dot(self.leading_row[self.cols], x)], y))
+        return y
+
+    def _rmatvec(self, y):
+        y = asarray(y, dtype=self.dtype).ravel()
+        x = zeros(self._ncols, dtype=self.dtype)
+        # the CSC buffers of the active columns are the CSR buffers of their transpose
+        csr_matvec(self._ncols, self.C.shape[0], self._indptr, self._rows, self._vals, y[self._offset:], x)
+        if self.leading_row is not None:
+            x += y[0] * self.leading_row[self.cols]
+        return x
+
+
+class _LsqrSubproblem:
+    """ Solves the least squares problem on the positive set with lsqr on each call, optionally seeded with the
+    previous solution of the columns that remain in the positive set """
+
+    method = 'lsqr'
+
+    def __init__(self, C, d, warm_start=False, iteration_counts=None, leading_row=None):
+        self.active = ActiveColumns(C, leading_row)
+        self.d = d
+        self.z = zeros(C.shape[1]) if warm_start else None  # last solution, used as the starting point
+        self.iteration_counts = iteration_counts
+
+    def add(self, j):
+        self.active.add(j)
+        return True
+
+    def remove(self, cols):
+        self.active.remove(cols)
+
+    def solve(self):
+        cols = self.active.cols.copy()
+        x0 = None if self.z is None else self.z[cols]
+        z_P, _, itn = lsqr(self.active, self.d, x0=x0)[:3]
+        if self.z is not None:
+            self.z[cols] = z_P
+        if self.iteration_counts is not None:
+            self.iteration_counts.append(itn)
+        return cols, z_P
+
+
+class _QRSubproblem:
+    """ Keeps a thin QR factorization of the positive set columns and updates it as columns enter or leave """
+
+    method = 'qr'
+
+    def __init__(self, C, d, leading_row=None):
+        self.C = C
+        self.d = d
+        self.leading_row = leading_row
+        self.cols = []  # positive set in the order the columns occupy in the factorization
+        self.Q = zeros((len(d), 0))
+        self.R = zeros((0, 0))
+
+    def add(self, j):
+        # A thin QR can hold at most m independent columns
+        if len(self.cols) >= self.Q.shape[0]:
+            return False
+        col = _dense_column(self.C, j, self.leading_row)
+        # Reject columns that are (numerically) in the span of the current positive set, which qr_insert refuses to
+        # insert into a thin factorization
+        try:
+            Q, R = qr_insert(self.Q, self.R, col, len(self.cols), which='col')
+        except LinAlgError:
+            return False
+        if abs(R[-1, -1]) <= sqrt(finfo(float).eps) * vnorm(col):
+            return False
+        self.Q, self.R = Q, R
+        self.cols.append(j)
+        return True
+
+    def remove(self, cols):
+        # delete from the back so the positions of the remaining columns stay valid
+        for k in sorted((self.cols.index(j) for j in cols), reverse=True):
+            p = len(self.cols)
+            Q, R = qr_delete(self.Q, self.R, k, 1, which='col')
+            # once the positive set has m columns Q is square and R is left m by p - 1: cut both back to thin shape
+            self.Q, self.R = Q[:, :p - 1], R[:p - 1, :]
+            del self.cols[k]
+
+    def solve(self):
+        return self.cols, solve_triangular(self.R, dot(self.Q.T, self.d))
+
+
+class GramCache:
+    """ Lazily computed and cached entries of the Gram matrix A^T A of a csc_matrix A
+
+    Only the Gram entries among columns that have been requested are formed: when a column is first needed its inner
+    products with the previously seen columns are computed from their nonzeros and stored. The cache can be shared
+    by many sparse_nnls calls against the same A (e.g. many samples against one reference), and max_columns bounds
+    its memory by evicting the least recently used columns.
+    """
+
+    def __init__(self, A, max_columns=None):
+        self.A = csc_matrix(A, dtype=float)  # no copy of a csc_matrix that is already in double precision
+        self.max_columns = max_columns
+        self._seen = ActiveColumns(self.A)  # columns with cached Gram entries, in slot order
+        self._slot = dict()
+        self._G = zeros((16, 16))
+        self._last_used = zeros(16)
+        self._clock = 0
+
+    def block(self, rows, cols):
+        """ Return the dense block (A^T A)[rows, cols] """
+        self._ensure(list(rows) + list(cols))
+        return self._G[ix_([self._slot[j] for j in rows], [self._slot[j] for j in cols])]
+
+    def with_leading_row(self, row, scale=1.0):
+        """ The Gram cache of vstack((row, scale * A)), as formed by MinDivLP, sharing the cached entries of A """
+        return _AugmentedGram(self, row, scale)
+
+    def _ensure(self, cols):
+        self._clock += 1
+        new_cols = [j for j in dict.fromkeys(cols) if j not in self._slot]
+        if self.max_columns is not None and len(self._slot) + len(new_cols) > self.max_columns:
+            # evict a quarter of the cache at a time so that a full cache is not compacted for every new column
+            self._evict(max(len(self._slot) + len(new_cols) - self.max_columns, self.max_columns // 4), cols)
+        for j in new_cols:
+            slots = len(self._slot)
+            if slots == len(self._G):
+                grown = zeros((2 * slots, 2 * slots))
+                grown[:slots, :slots] = self._G
+                self._G = grown
+                self._last_used = self._grow_last_used(2 * slots)
+            a_j = _dense_column(self.A, j)
+            g = self._seen.rmatvec(a_j)
+            self._G[slots, :slots] = g
+            self._G[:slots, slots] = g
+            self._G[slots, slots] = dot(a_j, a_j)
+            self._seen.add(j)
+            self._slot[j] = slots
+        for j in cols:
+            self._last_used[self._slot[j]] = self._clock
+
+    def _evict(self, count, protected):
+        slots = len(self._slot)
+        candidates = [slot for slot in self._last_used[:slots].argsort() if self._seen.cols[slot] not in protected]
+        evicted = self._seen.cols[candidates[:count]].copy()
+        keep = ~isin(self._seen.cols, evicted)
+        kept = int(keep.sum())
+        self._G[:kept, :kept] = self._G[ix_(keep, keep)]
+        self._last_used[:kept] = self._last_used[:slots][keep]
+        self._seen.remove(evicted)
+        self._slot = {j: slot for slot, j in enumerate(self._seen.cols.tolist())}
+
+    def _grow_last_used(self, size):
+        grown = zeros(size)
+        grown[:len(self._last_used)] = self._last_used
+        return grown
+
+
+class _AugmentedGram:
+    """ Gram entries of vstack((row, scale * A)) computed from the GramCache of A: row^T row + scale^2 A^T A """
+
+    def __init__(self, gram, row, scale):
+        self.gram = gram
+        self.row = row.ravel()
+        self.scale = scale
+
+    def block(self, rows, cols):
+        return outer(self.row[rows], self.row[cols]) + self.scale ** 2 * self.gram.block(rows, cols)
+
+
+class _GramSubproblem:
+    """ Solves the normal equations of the positive set columns, (C^T C)[P, P] z = (C^T d)[P], with a Cholesky
+    factorization that is extended or downdated as columns enter or leave """
+
+    method = 'gram'
+
+    def __init__(self, C, d, gram=None, leading_row=None):
+        if gram is None:
+            gram = GramCache(C) if leading_row is None else GramCache(C).with_leading_row(leading_row)
+        self.gram = gram
+        self.Ctd = C.T @ d[len(d) - C.shape[0]:]
+        if leading_row is not None:
+            self.Ctd += d[0] * leading_row
+        self.cols = []
+        self.R = zeros((0, 0))  # upper triangular, R^T R = (C^T C)[cols, cols]
+
+    def add(self, j):
+        g = self.gram.block(self.cols, [j]).ravel()
+        r = solve_triangular(self.R, g, trans='T')
+        s = self.gram.block([j], [j])[0, 0]
+        # Reject columns that are (numerically) in the span of the current positive set
+        if s - dot(r, r) <= sqrt(finfo(float).eps) * s:
+            return False
+        p = len(self.cols)
+        R = zeros((p + 1, p + 1))
+        R[:p, :p] = self.R
+        R[:p, p] = r
+        R[p, p] = sqrt(s - dot(r, r))
+        self.R = R
+        self.cols.append(j)
+        return True
+
+    def remove(self, cols):
+        # deleting a column of R leaves it upper Hessenberg, which a Givens sweep (qr_delete) restores
+        for k in sorted((self.cols.index(j) for j in cols), reverse=True):
+            p = len(self.cols)
+            self.R = qr_delete(eye(p), self.R, k, 1, which='col')[1][:p - 1]
+            del self.cols[k]
+
+    def solve(self):
+        return self.cols, solve_triangular(self.R, solve_triangular(self.R, self.Ctd[self.cols], trans='T'))
+
+
+class SolverStats:
+    """ Diagnostics of a sparse_nnls call, filled in when passed as its stats argument
+
+    Records the outer (columns admitted) and inner (columns dropped) iteration counts, the size of the positive set
+    after every outer iteration, the time spent solving the positive set least squares problems (lsqr or the
+    factorization solves), updating the positive set (slicing columns into the active operator or updating the
+    factorization) and forming full gradients (the matvecs with C and C^T), the iteration count of every lsqr call
+    and the final residual norm. to_dict() and to_json() export them, e.g. one record per sample of a batch run.
+    """
+
+    def __init__(self):
+        self.method = None
+        self.outer_iterations = 0
+        self.inner_iterations = 0
+        self.active_set_sizes = []
+        self.solves = 0
+        self.lsqr_iterations = []
+        self.solve_time = 0.0
+        self.update_time = 0.0
+        self.gradient_time = 0.0
+        self.total_time = 0.0
+        self.residual_norm = None
+        self.iteration_count_exceeded = False
+
+    def to_dict(self):
+        return {name: (list(map(int, value)) if isinstance(value, list) else value)
+                for name, value in vars(self).items()}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def _timed(self, function, field):
+        """ Wrap function to add the time spent in it to the given field """
+        def timed(*args):
+            start = perf_counter()
+            result = function(*args)
+            setattr(self, field, getattr(self, field) + perf_counter() - start)
+            return result
+        return timed
+
+
+class _TimedSubproblem:
+    """ Forwards to a positive set subproblem, recording the time spent in it in a SolverStats """
+
+    def __init__(self, subproblem, stats):
+        stats.method = subproblem.method
+        self.add = stats._timed(subproblem.add, 'update_time')
+        self.remove = stats._timed(subproblem.remove, 'update_time')
+        self._solve = stats._timed(subproblem.solve, 'solve_time')
+        self._stats = stats
+
+    def solve(self):
+        self._stats.solves += 1
+        return self._solve()
+
+
+_METHODS = ['auto', 'lsqr', 'qr', 'gram']
+_GRAM_MAX_ROWS = 4097  # up to k = 6 (plus the f row of MinDivLP) the normal equations are cheap to form
+_GRAM_MIN_DENSITY = 0.25  # columns that are mostly nonzero make lsqr's matvecs as costly as forming Gram entries
+
+
+def _choose_method(C):
+    """ Pick 'gram' for matrices with few rows or dense columns, where Gram entries are cheap, otherwise 'lsqr' """
+    m, n = C.shape
+    if m < n and (m <= _GRAM_MAX_ROWS or C.nnz >= _GRAM_MIN_DENSITY * m * n):
+        return 'gram'
+    return 'lsqr'
+
+
+def _make_subproblem(method, C, d, warm_start, iteration_counts, gram, leading_row):
+    """ Create the solver of the positive set least squares problem used by the given sparse_nnls method """
+    if method == 'auto':
+        method = 'gram' if gram is not None else _choose_method(C)
+    if method == 'lsqr':
+        return _LsqrSubproblem(C, d, warm_start, iteration_counts, leading_row)
+    elif method == 'qr':
+        return _QRSubproblem(C, d, leading_row)
+    elif method == 'gram':
+        return _GramSubproblem(C, d, gram, leading_row)
+    raise Exception(f"Unknown sparse_nnls method {method}, expected one of {_METHODS}")
+
+
+def sparse_nnls(C, d, tol=-1, itmax_factor=3, method='auto', warm_start=False, iteration_counts=None,
+                block_size=1, gram=None, leading_row=None, stats=None):
     """ Calculate argmin ||Cx - d||_2 subject to x >= 0 when C is sparse
 
     Parameters are:
@@ -12,16 +408,44 @@ def sparse_nnls(C, d, tol=-1, itmax_factor=3):
     d is an ndarray of size m or scipy.sparse matrix of size m by 1
     tol: tolerance (optional)
     itmax_factor: factor to determine maximum iterations allowed (optional)
+    method: how the least squares problem on the positive set is solved (optional). 'lsqr' re-solves it from
+        scratch with lsqr each time, 'qr' keeps a thin QR factorization of the positive set columns that is
+        updated by rank-one changes as columns enter or leave (faster for large supports when m is moderate,
+        since it holds an m by |P| dense factor), 'gram' solves the normal equations of the positive set from
+        cached Gram entries with an updated Cholesky factor (fastest when C has few rows, as A_k_small does for
+        small k), and 'auto' picks 'gram' or 'lsqr' from the shape and density of C
+    warm_start: if True (and method='lsqr'), seed each lsqr call with the previous solution on the columns still in
+        the positive set instead of starting from zero (optional)
+    iteration_counts: a list that, if given, has the number of lsqr iterations of every subproblem solve appended
+        to it (optional)
+    block_size: number of variables with the largest positive Lagrange multipliers moved into the positive set per
+        outer iteration (optional). Values > 1 need far fewer least squares solves for large supports; the solver
+        falls back to single pivots as soon as an outer iteration fails to decrease the residual
+    gram: a GramCache of C (or GramCache(A).with_leading_row(f, const) when C = vstack((f, const * A))) whose entries
+        are reused across calls; implies method='gram' when method='auto' (optional)
+    leading_row: an ndarray of size n stacked on top of C as an extra dense row, in which case d has size m + 1
+        (optional). This solves for vstack((leading_row, C)) without forming it, so C can be shared read-only
+        between problems that only differ in that row (as the MinDivLP problems of different samples do)
+    stats: a SolverStats that, if given, is filled in with the iteration counts, timings and final residual of the
+        call (optional). Leaving it out adds no work to the solver
 
     Returns:
     x: an ndarray that minimizes ||Cx - d||_2 subject to x >= 0
     """
 
-    C = C.tocsc()
+    started = perf_counter()
+    C = C.tocsc().astype(float, copy=False)  # sensing matrices may be stored in single precision
+    d = asarray(d.toarray() if issparse(d) else d, dtype=float).ravel()
+    if leading_row is not None:
+        leading_row = asarray(leading_row, dtype=float).ravel()
 
     # Set the tolerance
     m, n = C.shape
-    tol = 10 * finfo(float).eps * norm(C, 1) * (max(C.shape) + 1) if tol == -1 else tol
+    if leading_row is None:
+        C_norm, rows = norm(C, 1), m
+    else:
+        C_norm, rows = (asarray(abs(C).sum(axis=0)).ravel() + abs(leading_row)).max(), m + 1
+    tol = 10 * finfo(float).eps * C_norm * (max(rows, n) + 1) if tol == -1 else tol
     itmax = itmax_factor * n
 
     # Initialize vector of n zeros and Infs (to be used later)
@@ -34,16 +458,22 @@ def sparse_nnls(C, d, tol=-1, itmax_factor=3):
     Z = ones(n, dtype=bool)
     x = zeros(n)
 
+    # Columns found to be linearly dependent on the positive set are not admitted again until a column leaves the
+    # positive set (factorization methods only)
+    dependent = zeros(n, dtype=bool)
+
     Ctrans = C.T  # transpose c
-    dtemp = d  # copy of d
+    gradient = _gradient
+    if stats is not None:
+        iteration_counts = iteration_counts if iteration_counts is not None else []
+        first_count = len(iteration_counts)
+    subproblem = _make_subproblem(method, C, d, warm_start, iteration_counts, gram, leading_row)
+    if stats is not None:
+        subproblem = _TimedSubproblem(subproblem, stats)
+        gradient = stats._timed(_gradient, 'gradient_time')
 
-    # resid = d - C*x
-    resid = -dtemp
-    csc_matvec(m, n, C.indptr, C.indices, C.data, x, resid)
-    resid = -resid
-    # w = Ctrans*resid
-    w = zeros(n)
-    csr_matvec(n, m, Ctrans.indptr, Ctrans.indices, Ctrans.data, resid, w)
+    # w = Ctrans*(d - C*x)
+    w, resid_norm = gradient(C, Ctrans, leading_row, d, x)
 
     # Set up iteration criteria
     outeriter = 0
@@ -64,15 +494,31 @@ def sparse_nnls(C, d, tol=-1, itmax_factor=3):
         wz[P] = -inf
         wz[Z] = w[Z]
 
-        # Find variable with largest Lagrange multiplier
-        t = argmax(wz)
+        # Find variable with largest Lagrange multiplier (or the block_size largest positive ones)
+        if block_size > 1:
+            block = argpartition(-wz, min(block_size, n) - 1)[:block_size]
+            block = block[wz[block] > tol]
+        else:
+            block = [argmax(wz)]
 
-        # Move variable t from zero set to positive set
-        P[t] = True
-        Z[t] = False
+        # Move the variables from zero set to positive set (unless they add nothing to the span of the positive set)
+        admitted = False
+        for t in block:
+            if not subproblem.add(t):
+                dependent[t] = True
+                w[t] = 0
+                continue
+            P[t] = True
+            Z[t] = False
+            admitted = True
+        if not admitted:
+            if stats is not None:
+                stats.active_set_sizes.append(int(P.sum()))  # the iteration counts, with the positive set unchanged
+            continue
 
         # Compute intermediate solution using only variables in positive set
-        z[P] = lsqr(C[:, [i for i, e in enumerate(P) if e]], d)[0]
+        cols, z_P = subproblem.solve()
+        z[cols] = z_P
 
         # inner loop to remove elements from the positive set which no longer belong
         while any(z[P] <= 0):
@@ -83,6 +529,10 @@ def sparse_nnls(C, d, tol=-1, itmax_factor=3):
             if i > itmax:
                 print("sparse_nnls:IterationCountExceeded")
                 x = z
+                if stats is not None:
+                    stats.iteration_count_exceeded = True
+                    _finish_stats(stats, outeriter, i, iteration_counts[first_count:], started,
+                                  gradient(C, Ctrans, leading_row, d, x)[1])
                 return x
 
             # Find indices where intermediate solution z is approximately negative
@@ -94,18 +544,34 @@ def sparse_nnls(C, d, tol=-1, itmax_factor=3):
 
             # Reset Z and P given intermediate values of x
             Z = ((abs(x) < tol) & P) | Z
+            subproblem.remove(flatnonzero(Z & P))
+            dependent[:] = False  # a column that was in the span of the old positive set may not be in the new one's
             P = ~Z
             z = zeros(n)  # Reset z
-            z[P] = lsqr(C[:, [i for i, e in enumerate(P) if e]], d)[0]  # Re-solve for z
+            cols, z_P = subproblem.solve()  # Re-solve for z
+            z[cols] = z_P
 
         x = z
 
-        # resid = d - C*x
-        resid = -dtemp
-        csc_matvec(m, n, C.indptr, C.indices, C.data, x, resid)
-        resid = -resid
-        # w = Ctrans*resid
-        w = zeros(n)
-        csr_matvec(n, m, Ctrans.indptr, Ctrans.indices, Ctrans.data, resid, w)
+        # w = Ctrans*(d - C*x)
+        w, new_resid_norm = gradient(C, Ctrans, leading_row, d, x)
+        w[dependent] = 0
+        if stats is not None:
+            stats.active_set_sizes.append(int(P.sum()))
+
+        # Fall back to single pivots once admitting blocks stops improving the objective
+        if block_size > 1 and new_resid_norm >= resid_norm:
+            block_size = 1
+        resid_norm = new_resid_norm
 
+    if stats is not None:
+        _finish_stats(stats, outeriter, i, iteration_counts[first_count:], started, resid_norm)
     return x
+
+
+def _finish_stats(stats, outer_iterations, inner_iterations, lsqr_iterations, started, residual_norm):
+    stats.outer_iterations = outer_iterations
+    stats.inner_iterations = inner_iterations
+    stats.lsqr_iterations = list(lsqr_iterations)
+    stats.residual_norm = float(residual_norm)
+    stats.total_time = perf_counter() - started
@@ -0,0 +1,74 @@
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+import PythonCode.src.ArtifactCache as ArtifactCacheModule
+from PythonCode.src.ArtifactCache import ArtifactCache
+
+## Checks that cached artifacts are keyed by input contents and parameters, restored, and evicted least recently used
+
+
+def write(path, text):
+    with open(path, "w") as fid:
+        fid.write(text)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    reference = os.path.join(directory, "reference.fasta")
+    output = os.path.join(directory, "reference.fasta_A_6.mat")
+    write(reference, ">a\nACGT\n")
+    cache = ArtifactCache(os.path.join(directory, "cache"), max_bytes=2500)
+
+    key = cache.key([reference], k=6, count_complements=False)
+    assert key == cache.key([reference], count_complements=False, k=6), "The key depends on the parameter order"
+    assert key != cache.key([reference], k=6, count_complements=True), "The key ignores the parameters"
+    assert not cache.restore(key, {'A_k': output}), "An artifact that was never stored was restored"
+
+    write(output, "x" * 1000)
+    cache.store(key, {'A_k': output})
+    os.remove(output)
+    assert cache.restore(key, {'A_k': output}), "The stored artifact was not restored"
+    assert open(output).read() == "x" * 1000, "The restored artifact differs"
+
+    time.sleep(0.01)
+    write(reference, ">a\nACGTT\n")  # a changed reference gets a new key
+    changed_key = cache.key([reference], k=6, count_complements=False)
+    assert changed_key != key, "The key ignores the contents of the input"
+
+    # storing beyond max_bytes evicts the least recently used entry, whatever the order the entries were stored in
+    cache.store(changed_key, {'A_k': output})
+    time.sleep(0.01)
+    assert cache.entry(key) is not None, "The first entry was evicted too early"
+    time.sleep(0.01)
+    third_key = cache.key([reference], k=8, count_complements=False)
+    cache.store(third_key, {'A_k': output})
+    assert cache.entry(changed_key) is None, "The least recently used entry was not evicted"
+    assert cache.entry(key) is not None and cache.entry(third_key) is not None, "A recently used entry was evicted"
+
+    # the keys the caller is about to use are kept, however long ago they were used
+    time.sleep(0.01)
+    fourth_key = cache.key([reference], k=10, count_complements=False)
+    cache.store(fourth_key, {'A_k': output}, keep=[key])
+    assert cache.entry(key) is not None and cache.entry(fourth_key) is not None, "A kept entry was evicted"
+    assert cache.entry(third_key) is None, "The least recently used entry that was not kept was not evicted"
+
+    # an entry that another process removes while the cache is evicting is skipped
+    size = ArtifactCacheModule._size
+
+    def vanishing_size(path):
+        if os.path.basename(path) == key:
+            ArtifactCacheModule.shutil.rmtree(path)
+        return size(path)
+
+    ArtifactCacheModule._size = vanishing_size
+    cache.evict(keep=[fourth_key])
+    ArtifactCacheModule._size = size
+    assert cache.entry(key) is None and cache.entry(fourth_key) is not None, "Eviction failed on a vanished entry"
+
+    disabled = ArtifactCache()
+    assert disabled.key([reference], k=6) is None and not disabled.restore(None, {'A_k': output}), \
+        "A cache without a directory is not disabled"
+
+print("Tests passed successfully!")
@@ -0,0 +1,101 @@
+import sys
+import os
+import tempfile
+import gzip
+import shutil
+import numpy as np
+import numpy.random as rand
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.CountKmers import count_kmers, read_fasta, sensing_matrix, sensing_matrices, \
+    sensing_matrix_blocks, save_blocks, load_blocks, kmer_spectrum, y_vector, \
+    kmer_spectra, y_vectors, _add_run, _merge_runs
+
+## Checks the built-in k-mer counter against counting the k-mers of every sequence one window at a time
+
+
+def count_naively(sequences, k, count_complements):
+    index = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+    counts = np.zeros((4 ** k, len(sequences)))
+    for j, sequence in enumerate(sequences):
+        sequence = sequence.decode().upper()
+        for start in range(len(sequence) - k + 1):
+            kmer = sequence[start:start + k]
+            if any(base not in index for base in kmer):
+                continue
+            counts[sum(index[base] * 4 ** (k - 1 - i) for i, base in enumerate(kmer)), j] += 1
+            if count_complements:
+                counts[sum((3 - index[base]) * 4 ** i for i, base in enumerate(kmer)), j] += 1
+    return counts
+
+
+data_file = os.path.join(os.path.dirname(__file__), '../data/mock_16S_metagenome.fa')
+sequences = list(read_fasta(data_file))[:20] + [b'ACGTNNACGTacgtXA', b'AC', b'']
+for k in [1, 3, 5]:
+    for count_complements in [False, True]:
+        counts = count_kmers(sequences, k, count_complements)
+        assert np.array_equal(counts.toarray(), count_naively(sequences, k, count_complements)), \
+            f"k-mer counts are wrong for k={k}, count_complements={count_complements}"
+        assert counts.has_sorted_indices, "Rows of the columns are not sorted"
+
+A = sensing_matrix(data_file, 6)
+assert A.shape == (4 ** 6, len(list(read_fasta(data_file)))), "The sensing matrix has the wrong shape"
+assert np.allclose(A.sum(axis=0), 1), "The columns of the sensing matrix are not normalized"
+
+# Counting in chunks of sequences gives the same matrix, whether the blocks are concatenated or written to disk
+assert abs(sensing_matrix(data_file, 6, chunk_size=500) - A).max() == 0, "The chunked sensing matrix differs"
+with tempfile.TemporaryDirectory() as directory:
+    assert save_blocks(sensing_matrix_blocks(data_file, [6], chunk_size=1000), {6: directory}) == 3, "Blocks were lost"
+    assert abs(load_blocks(directory) - A).max() == 0, "The sensing matrix written in blocks differs"
+
+# The k-mer spectrum of a sample is the same streamed from FASTA, FASTQ or gzipped FASTQ, and sums the columns
+fastq_file = os.path.join(os.path.dirname(__file__), '../data/mock_16S_metagenome.fastq')
+expected = np.asarray(count_kmers(list(read_fasta(data_file)), 8, True).sum(axis=1)).ravel()
+with tempfile.TemporaryDirectory() as directory:
+    gzip_file = os.path.join(directory, "sample.fastq.gz")
+    with open(fastq_file, 'rb') as fid, gzip.open(gzip_file, 'wb') as gzip_fid:
+        shutil.copyfileobj(fid, gzip_fid)
+    for file_name in [data_file, fastq_file, gzip_file]:
+        assert np.array_equal(kmer_spectrum(file_name, 8, True, chunk_size=300), expected), \
+            f"The k-mer spectrum of {os.path.basename(file_name)} is wrong"
+y = y_vector(fastq_file, 8)
+assert y.dtype == np.float32 and np.isclose(y.sum(), 1), "The y vector is not normalized"
+
+# The sparse spectrum holds the same counts, for the observed k-mers only
+spectrum = kmer_spectrum(fastq_file, 8, True, chunk_size=300, sparse=True)
+assert spectrum.shape == (4 ** 8, 1) and spectrum.nnz == np.count_nonzero(expected), "The sparse spectrum is wrong"
+assert np.array_equal(spectrum.toarray().ravel(), expected), "The sparse spectrum counts are wrong"
+assert np.allclose(y_vector(fastq_file, 8, sparse=True).toarray().ravel(), y), "The sparse y vector differs"
+
+# The runs of sorted k-mers a sparse spectrum is held in merge as they grow into the counts of all the chunks
+rand.seed(0)
+runs = list()
+chunks = [rand.randint(0, 500, size=size) for size in (0, 40, 300, 5, 1000, 0, 20, 700)]
+for chunk in chunks:
+    _add_run(runs, chunk)
+assert len(runs) <= 4, "The runs of k-mers are not merged as they grow"
+distinct, counts = _merge_runs(runs)
+expected_distinct, expected_counts = np.unique(np.concatenate(chunks), return_counts=True)
+assert np.array_equal(distinct, expected_distinct) and np.array_equal(counts, expected_counts), \
+    "Merging the runs of k-mers loses counts"
+
+# The spectra of several k sizes, counted in one pass over the reads, match counting each k on its own
+spectra = kmer_spectra(fastq_file, [8, 4], True, chunk_size=300)
+assert sorted(spectra) == [4, 8] and np.array_equal(spectra[8], expected), "The multi-k spectrum of k=8 is wrong"
+assert np.array_equal(spectra[4], kmer_spectrum(fastq_file, 4, True)), "The multi-k spectrum of k=4 is wrong"
+for k, y_k in y_vectors(fastq_file, [4, 8], sparse=True).items():
+    assert abs(y_k - y_vector(fastq_file, k, sparse=True)).max() == 0, f"The y vector of k={k} differs"
+
+# Several k sizes formed in one pass (and in parallel chunks) match forming each on its own
+def check_multi_k(chunk_size, processes):
+    matrices = sensing_matrices(data_file, [3, 6], True, chunk_size=chunk_size, processes=processes)
+    for k in [3, 6]:
+        assert abs(matrices[k] - sensing_matrix(data_file, k, True)).max() < 1e-15, f"A_{k} of the multi-k pass differs"
+
+
+check_multi_k(None, 1)
+
+if __name__ == '__main__':  # worker processes may re-import this file
+    check_multi_k(700, 2)
+
+    print("Tests passed successfully!")
@@ -0,0 +1,61 @@
+## Simple test for MinDivLP_batch: every column must match a MinDivLP call on that sample
+import sys
+import os
+import numpy as np
+from numpy.linalg import norm
+from scipy.sparse import csc_matrix
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.MinDivLP import MinDivLP, MinDivLP_batch
+
+A_k_small = np.array(
+    [(.5, 0, 0),
+     (0, 1 / 3, 1 / 5),
+     (.5, 2 / 3, 4 / 5)])
+
+A_k_large = np.array(
+    [(0, 0, 1 / 6),
+     (1 / 4, 1 / 3, 0),
+     (1 / 4, 0, 2 / 6),
+     (1 / 4, 1 / 3, 2 / 6),
+     (1 / 4, 1 / 3, 1 / 6)])
+
+X_true = np.array(
+    [(1, 0, .5),
+     (0, 1, .5),
+     (0, 0, 0)])
+
+Y_small = A_k_small @ X_true
+Y_large = A_k_large @ X_true
+
+const = 10000
+q = 0.1
+
+stats = []
+X_star = MinDivLP_batch(A_k_small, A_k_large, Y_small, Y_large, const, q, stats=stats)
+assert len(stats) == X_true.shape[1], 'Solver statistics were not recorded for every sample'
+
+thresh = .00001
+for sample in range(X_true.shape[1]):
+    x_star = MinDivLP(A_k_small, A_k_large, Y_small[:, [sample]], Y_large[:, [sample]], const, q)
+    assert norm(X_star[:, sample] - x_star, 1) < thresh, 'MinDivLP_batch differs from MinDivLP'
+    assert norm(X_star[:, sample] - X_true[:, sample], 1) < thresh, 'L1 reconstruction error is above %f' % thresh
+
+# Sparse sensing matrices give the same reconstructions as dense ones
+X_sparse = MinDivLP_batch(csc_matrix(A_k_small), csc_matrix(A_k_large), Y_small, Y_large, const, q)
+assert norm(X_sparse - X_star, 1) < thresh, 'MinDivLP_batch differs on sparse sensing matrices'
+
+# A dense wide A_k_small (solved from the normal equations by default) is accepted as MinDivLP accepts it
+rng = np.random.default_rng(0)
+A_wide_small = rng.random((4, 10))
+A_wide_large = rng.random((12, 10)) * (rng.random((12, 10)) < 0.5)
+X_wide = np.zeros((10, 2))
+X_wide[[1, 6], 0] = .5
+X_wide[3, 1] = 1
+X_wide_star = MinDivLP_batch(A_wide_small, A_wide_large, A_wide_small @ X_wide, A_wide_large @ X_wide, const, q)
+for sample in range(X_wide.shape[1]):
+    x_star = MinDivLP(A_wide_small, A_wide_large, A_wide_small @ X_wide[:, [sample]], A_wide_large @ X_wide[:, [sample]],
+                      const, q)
+    assert norm(X_wide_star[:, sample] - x_star, 1) < thresh, 'MinDivLP_batch differs on a dense wide A_k_small'
+
+print("Tests passed successfully!")
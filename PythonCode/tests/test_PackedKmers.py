@@ -0,0 +1,112 @@
+import sys
+import os
+import tempfile
+import numpy as np
+import numpy.random as rand
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.PackedKmers import pack_kmers, unpack_kmers, kmer_count_matrix, reverse_complement, \
+    canonical_kmers, KmerIndex, parse_kmc_dump
+
+## Checks the packed k-mer codes and the k-mer count matrix against working with the k-mers as strings
+
+rand.seed(0)
+k = 21
+pool = [''.join(rand.choice(list('ACGT'), size=k)) for _ in range(300)] + ['A' * k, 'T' * k]
+genomes = [list(rand.choice(pool, size=rand.randint(1, 60), replace=False)) for _ in range(25)]
+counts = [list(rand.randint(1, 9, size=len(kmers))) for kmers in genomes]
+
+packed = pack_kmers(pool)
+assert packed.dtype == np.uint64 and packed[-2] == 0 and packed[-1] == 4 ** k - 1, "k-mers are packed wrong"
+assert [kmer.decode() for kmer in unpack_kmers(packed, k)] == pool, "Unpacking does not invert packing"
+assert list(np.argsort(packed, kind='stable')) == sorted(range(len(pool)), key=pool.__getitem__), \
+    "Packed codes do not sort as the k-mers do"
+assert np.array_equal(pack_kmers([kmer.encode() for kmer in pool]), packed), "bytes k-mers are packed differently"
+assert pack_kmers(['T' * 32])[0] == np.iinfo(np.uint64).max, "32-mers do not fit"
+
+# The matrix matches forming it with a sorted list of the k-mer strings
+kmers, A = kmer_count_matrix(zip(genomes, counts))
+expected_kmers = sorted(set(kmer for genome in genomes for kmer in genome))
+assert [kmer.decode() for kmer in unpack_kmers(kmers, k)] == expected_kmers, "The rows hold the wrong k-mers"
+expected = np.zeros((len(expected_kmers), len(genomes)))
+for column, (genome, genome_counts) in enumerate(zip(genomes, counts)):
+    for kmer, count in zip(genome, genome_counts):
+        expected[expected_kmers.index(kmer), column] += count
+assert np.array_equal(A.toarray(), expected), "The k-mer count matrix is wrong"
+assert A.has_sorted_indices, "Rows of the columns are not sorted"
+for batch_size in (1, 4, 25):  # reading the genomes in batches forms the same matrix
+    batch_kmers, A_batched = kmer_count_matrix(zip(genomes, counts), batch_size=batch_size)
+    assert np.array_equal(batch_kmers, kmers) and np.array_equal(A_batched.toarray(), expected), \
+        f"The matrix formed in batches of {batch_size} genomes is wrong"
+    assert A_batched.has_sorted_indices, "Rows of the columns formed in batches are not sorted"
+assert np.array_equal(pack_kmers(np.array(pool, dtype='S')), packed), "Arrays of byte strings are packed differently"
+
+# Reverse complements and canonical k-mers match those of the strings
+complements = [kmer[::-1].translate(str.maketrans('ACGT', 'TGCA')) for kmer in pool]
+assert np.array_equal(reverse_complement(packed, k), pack_kmers(complements)), "Reverse complements are wrong"
+assert np.array_equal(canonical_kmers(packed, k), pack_kmers([min(kmer, complement) for kmer, complement in
+                                                               zip(pool, complements)])), "Canonical k-mers are wrong"
+assert reverse_complement(pack_kmers(['A' * 32]), 32)[0] == np.iinfo(np.uint64).max, "32-mers are complemented wrong"
+
+# The index finds the rows of k-mers given on either strand, and none for the others
+index = KmerIndex(kmers, k)
+queries = expected_kmers[1:20] + [complements[pool.index(kmer)] for kmer in expected_kmers[20:40]] + ['C' * k]
+found, rows = index.lookup(pack_kmers(queries))
+assert list(found) == list(range(39)) and list(rows) == list(range(1, 40)), "The index finds the wrong rows"
+assert len(index) == len(expected_kmers), "The index holds the wrong k-mers"
+assert len(KmerIndex(np.zeros(0, dtype=np.uint64), k).lookup(packed)[0]) == 0, "An empty index fails"
+with tempfile.TemporaryDirectory() as directory:
+    database_files = [os.path.join(directory, "TrainingDatabase" + extension) for extension in ('.h5', '.kmc_pre')]
+    for size, file_name in enumerate(database_files):
+        with open(file_name, "wb") as fid:
+            fid.write(b"x" * (size + 10))
+    index_directory = KmerIndex.directory_for(os.path.join(directory, "TrainingDatabase"))
+    assert not KmerIndex.is_current(index_directory, database_files), "A missing index is current"
+    index.save(index_directory, database_files)
+    loaded = KmerIndex.load(os.path.join(directory, "TrainingDatabase_kmers"))
+    assert isinstance(loaded.kmers, np.memmap) and loaded.k == k, "The saved index is not memory-mapped"
+    assert loaded.header['database']['TrainingDatabase.h5']['size'] == 10, "The header misses the database files"
+    assert all(np.array_equal(a, b) for a, b in zip(loaded.lookup(pack_kmers(queries)), (found, rows))), \
+        "The saved index finds other rows"
+    del loaded
+    # copying the database files (giving them new modification times) keeps the index current, changing them does not
+    os.utime(database_files[0], (0, 0))
+    assert KmerIndex.is_current(index_directory, database_files), "An index is stale after copying its database"
+    with open(database_files[0], "ab") as fid:
+        fid.write(b"y")
+    assert not KmerIndex.is_current(index_directory, database_files), "An index is current for a changed database"
+    assert not KmerIndex.is_current(index_directory, database_files + [database_files[0] + ".suf"]), \
+        "An index is current for a database file it does not record"
+
+# Two genomes that share a k-mer only as reverse complements share its row when the strands are merged, and a k-mer
+# whose two strands are separate rows is matched to both
+shared = pool[0]
+strand_genomes = [[shared, pool[1]], [complements[0], pool[2]]]
+canonical_rows, A_canonical = kmer_count_matrix(zip(strand_genomes, [[3, 1], [5, 1]]), canonical=True)
+row = np.searchsorted(canonical_rows, canonical_kmers(pack_kmers([shared]), k))[0]
+assert list(A_canonical.toarray()[row]) == [3, 5] and A_canonical.shape[0] == 3, "The strands were not merged"
+assert list(A_canonical.toarray().sum(axis=0)) == [4, 6], "Counts were lost merging the strands"
+assert list(kmer_count_matrix([([shared, complements[0]], [2, 7])], canonical=True)[1].toarray().ravel()) == [9], \
+    "Both strands of a k-mer in one genome are not summed"
+strand_kmers, _ = kmer_count_matrix(zip(strand_genomes, [[3, 1], [5, 1]]))
+found, rows = KmerIndex(strand_kmers, k).lookup(pack_kmers([shared]))
+assert list(found) == [0, 0] and sorted(strand_kmers[rows]) == sorted(pack_kmers([shared, complements[0]])), \
+    "A k-mer is not matched to both of its strands"
+
+# A kmc_dump is parsed as reading it line by line would
+dump_counts = rand.randint(0, 200000, size=len(pool))
+dump = ''.join(f"{kmer}\t{count}\n" for kmer, count in zip(pool, dump_counts)).encode()
+dump_kmers, parsed_counts = parse_kmc_dump(dump, k)
+assert np.array_equal(dump_kmers, packed) and np.array_equal(parsed_counts, dump_counts), "The dump is parsed wrong"
+assert np.array_equal(parse_kmc_dump(dump[:-1], k)[1], dump_counts), "A dump without a final newline is parsed wrong"
+assert len(parse_kmc_dump(b'', k)[0]) == 0, "An empty dump is parsed wrong"
+for bad_dump in (b'ACGT\t1\n', pool[0].encode() + b'\tx\n', b'N' * k + b'\t1\n'):
+    try:
+        parse_kmc_dump(bad_dump, k)
+        raise AssertionError("A malformed dump was parsed")
+    except AssertionError:
+        raise
+    except Exception:
+        pass
+
+print("Tests passed successfully!")
@@ -0,0 +1,77 @@
+## Simple test for MinDivLP_parallel and SharedCSC: the process pool driver must match MinDivLP_batch, and shared
+#  memory must not be leaked
+import sys
+import os
+import numpy as np
+from numpy.linalg import norm
+from multiprocessing.shared_memory import SharedMemory
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.MinDivLP import MinDivLP_batch
+from PythonCode.src.ParallelMinDivLP import MinDivLP_parallel, SharedCSC
+
+A_k_small = np.array(
+    [(.5, 0, 0),
+     (0, 1 / 3, 1 / 5),
+     (.5, 2 / 3, 4 / 5)])
+
+A_k_large = np.array(
+    [(0, 0, 1 / 6),
+     (1 / 4, 1 / 3, 0),
+     (1 / 4, 0, 2 / 6),
+     (1 / 4, 1 / 3, 2 / 6),
+     (1 / 4, 1 / 3, 1 / 6)])
+
+X_true = np.array(
+    [(1, 0, .5),
+     (0, 1, .5),
+     (0, 0, 0)])
+
+Y_small = A_k_small @ X_true
+Y_large = A_k_large @ X_true
+
+const = 10000
+q = 0.1
+thresh = .00001
+
+# A SharedCSC that fails part way unlinks the segments it had already created
+created = []
+share = SharedCSC._share
+
+
+def failing_share(self, array):
+    if len(self._blocks) == 2:
+        raise MemoryError("no shared memory left")
+    created.append(share(self, array)[0])
+    return created[-1]
+
+
+SharedCSC._share = failing_share
+try:
+    SharedCSC(A_k_small)
+    raise AssertionError('SharedCSC did not fail')
+except MemoryError:
+    pass
+finally:
+    SharedCSC._share = share
+for name in created:
+    try:
+        SharedMemory(name=name).close()
+        raise AssertionError('A shared memory segment was leaked')
+    except FileNotFoundError:
+        pass
+
+if __name__ == '__main__':  # worker processes may re-import this file
+    # The process pool driver gives the same reconstructions, in order or as they finish
+    X_star = MinDivLP_batch(A_k_small, A_k_large, Y_small, Y_large, const, q)
+    for ordered in [True, False]:
+        samples = ((Y_small[:, sample], Y_large[:, sample]) for sample in range(X_true.shape[1]))
+        results = list(MinDivLP_parallel(A_k_small, A_k_large, samples, const, q, workers=2, ordered=ordered,
+                                         max_pending=2))
+        assert sorted(index for index, _ in results) == list(range(X_true.shape[1])), 'Samples were lost or repeated'
+        if ordered:
+            assert [index for index, _ in results] == list(range(X_true.shape[1])), 'Results are out of order'
+        for index, x_star in results:
+            assert norm(X_star[:, index] - x_star, 1) < thresh, 'MinDivLP_parallel differs from MinDivLP_batch'
+
+    print("Tests passed successfully!")
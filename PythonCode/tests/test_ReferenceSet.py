@@ -0,0 +1,71 @@
+import sys
+import os
+import tempfile
+import shutil
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.ReferenceSet import ReferenceSet
+from PythonCode.src.MinDivLP import MinDivLP
+from PythonCode.src.CountKmers import sensing_matrix, y_vector
+from PythonCode.src.ArtifactCache import ArtifactCache
+
+## Checks that a reference loaded once into a ReferenceSet reconstructs samples as MinDivLP does
+
+data_file = os.path.join(os.path.dirname(__file__), '../data/mock_16S_metagenome.fa')
+sample_file = os.path.join(os.path.dirname(__file__), '../data/mock_16S_metagenome.fastq')
+
+with tempfile.TemporaryDirectory() as directory:
+    reference = os.path.join(directory, "reference.fasta")
+    taxonomy = os.path.join(directory, "taxonomy.txt")
+    shutil.copy(data_file, reference)
+    with open(reference) as fid, open(taxonomy, "w") as tax:
+        for i, line in enumerate(line for line in fid if line[0] == ">"):
+            tax.write(f"{line[1:-1]}\tk__Bacteria; s__{i}\n")
+
+    reference_set = ReferenceSet(reference, taxonomy, small_k=4, large_k=8)
+    assert os.path.isdir(f"{reference}_A_4.csc") and os.path.isdir(f"{reference}_A_8.csc"), "Matrices were not formed"
+    assert len(reference_set.otu_ids) == reference_set.C.shape[1], "The OTU ids do not match the matrix"
+    assert reference_set.taxonomy_map[reference_set.otu_ids[5]] == "k__Bacteria; s__5", "The taxonomy map is wrong"
+
+    x_star = reference_set.reconstruct(sample_file)
+    expected = MinDivLP(sensing_matrix(reference, 4), sensing_matrix(reference, 8), y_vector(sample_file, 4),
+                        y_vector(sample_file, 8), 10000, 0.1)
+    # the matrices are formed as float32 artifacts, so the solutions agree to single precision
+    assert np.array_equal(np.flatnonzero(x_star), np.flatnonzero(expected)), "The reconstructed support differs"
+    assert np.allclose(x_star, expected, atol=1e-5), "The ReferenceSet reconstruction differs from MinDivLP"
+
+    # A reference set attached to the shared copy of another (as the worker processes of MinDivLPService do) agrees
+    with reference_set.shared() as handle:
+        attached = ReferenceSet.attach(handle)
+        assert attached.otu_ids == reference_set.otu_ids, "The attached OTU ids differ"
+        assert np.array_equal(attached.reconstruct(sample_file), x_star), "The attached reconstruction differs"
+        del attached
+
+    # Matrices formed without the complements are not taken for a reference set that counts them
+    try:
+        ReferenceSet.matrix_files(reference, [4, 8], count_complements=True)
+        raise AssertionError("A matrix formed without complements was used with count_complements=True")
+    except AssertionError:
+        raise
+    except Exception as error:
+        assert "count_complements=False" in str(error), "The complements mismatch is reported wrong"
+    assert ReferenceSet.matrix_files(reference, [4], count_complements=False)[4] == f"{reference}_A_4.csc", \
+        "A matching matrix was not used"
+
+    # With a cache, the matrices and the y vectors are kept in it and reused by the next reference set
+    cache = ArtifactCache(os.path.join(directory, "cache"))
+    cached_set = ReferenceSet(reference, taxonomy, small_k=4, large_k=6, cache=cache)
+    assert not os.path.exists(f"{reference}_A_6.csc"), "The cached matrix was saved next to the reference"
+    x_cached = cached_set.reconstruct(sample_file)
+    assert len(os.listdir(cache.directory)) == 3, "The matrices and y vectors were not cached"
+    assert np.array_equal(ReferenceSet(reference, taxonomy, small_k=4, large_k=6, cache=cache).reconstruct(sample_file),
+                          x_cached), "The reconstruction from the cache differs"
+
+    # A cache too small for both matrices still keeps the ones a reference set is loading
+    small_cache = ArtifactCache(os.path.join(directory, "small_cache"), max_bytes=1)
+    files = ReferenceSet.matrix_files(reference, [4, 6], cache=small_cache)
+    assert all(os.path.exists(path) for path in files.values()), "A matrix was evicted while it was being loaded"
+    del reference_set, cached_set  # release the memory maps before the directory is removed
+
+print("Tests passed successfully!")
@@ -0,0 +1,56 @@
+import sys
+import os
+import tempfile
+import numpy as np
+import scipy.io as sio
+from scipy.sparse import random as sparse_random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.SensingMatrixIO import save_sensing_matrix, load_sensing_matrix, read_header, artifact_path, \
+    sha256_file, save_sensing_matrix_blocks, SensingMatrixWriter
+from PythonCode.src.CountKmers import sensing_matrices, sensing_matrix_blocks
+
+## Checks that sensing matrices round trip through the memory-mapped artifact format
+
+A = sparse_random(256, 40, density=0.2, random_state=0, format='csc')
+data_file = os.path.join(os.path.dirname(__file__), '../data/mock_16S_metagenome.fa')
+
+with tempfile.TemporaryDirectory() as directory:
+    mat_file = os.path.join(directory, "reference.fasta_A_4.mat")
+    sio.savemat(mat_file, {'A_k': A}, do_compression=True)
+    assert abs(load_sensing_matrix(mat_file) - A).max() == 0, "The .mat sensing matrix was not loaded"
+
+    save_sensing_matrix(A, artifact_path(mat_file), k=4, reference=data_file, count_complements=True)
+    header = read_header(artifact_path(mat_file))
+    assert header['k'] == 4 and header['shape'] == [256, 40] and header['count_complements'], "The header is wrong"
+    assert header['reference_sha256'] == sha256_file(data_file), "The reference checksum is wrong"
+
+    for path in [artifact_path(mat_file), mat_file]:  # a .mat file with a current artifact loads the artifact
+        A_loaded = load_sensing_matrix(path)
+        assert A_loaded.data.dtype == np.float32 and A_loaded.indices.dtype == np.int32, "Buffers have the wrong type"
+        assert not A_loaded.data.flags.writeable, "The artifact was not memory-mapped"
+        assert np.allclose(A_loaded.toarray(), A.toarray(), rtol=1e-6), "The artifact differs from the matrix"
+    del A_loaded  # release the memory maps before the directory is removed
+
+# Blocks of columns streamed into artifacts form the matrices saved whole
+with tempfile.TemporaryDirectory() as directory:
+    matrices = sensing_matrices(data_file, [3, 6], True)
+    directories = {k: os.path.join(directory, f"A_{k}.csc") for k in (3, 6)}
+    SensingMatrixWriter.copy_size = 1000  # copy the buffers over several slices
+    blocks = sensing_matrix_blocks(data_file, [3, 6], True, chunk_size=1000)
+    assert save_sensing_matrix_blocks(blocks, directories, reference=data_file, count_complements=True) == 3, \
+        "Blocks were lost"
+    for k in (3, 6):
+        save_sensing_matrix(matrices[k], os.path.join(directory, "whole.csc"), k=k, reference=data_file,
+                            count_complements=True)
+        assert read_header(directories[k]) == read_header(os.path.join(directory, "whole.csc")), \
+            f"The header of the streamed A_{k} differs"
+        A_streamed = load_sensing_matrix(directories[k])
+        assert A_streamed.indices.dtype == np.int32 and not A_streamed.data.flags.writeable, \
+            "The streamed artifact has the wrong buffers"
+        assert np.allclose(A_streamed.toarray(), matrices[k].toarray(), rtol=1e-6), f"The streamed A_{k} differs"
+        del A_streamed
+    writer = SensingMatrixWriter(os.path.join(directory, "empty.csc"), k=4)
+    assert load_sensing_matrix(writer.close()).shape == (0, 0), "An empty stream is not an empty matrix"
+
+print("Tests passed successfully!")
@@ -0,0 +1,52 @@
+import sys
+import os
+import tempfile
+import numpy as np
+import scipy.io as sio
+from scipy.sparse import random as sparse_random, csc_matrix
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.SupportPattern import SupportPattern
+from PythonCode.src.MinDivLP import MinDivLP
+
+## Checks that the saved, memory-mapped support pattern gives the same diversity weights as B = A_k_large > 0
+
+A_k_small = sparse_random(64, 30, density=0.4, random_state=1, format='csc')
+A_k_large = sparse_random(400, 30, density=0.05, random_state=2, format='lil')
+A_k_large[:, 7] = 0  # a column with an empty support
+A_k_large = A_k_large.tocsc()
+x_true = np.zeros(30)
+x_true[[2, 11, 20]] = [.5, .3, .2]
+y_small = A_k_small @ x_true
+y_large = A_k_large @ x_true
+q = 0.1
+
+f = 1 / (np.power((A_k_large > 0).T @ y_large, 1 - q) + 0.0001)
+assert np.allclose(SupportPattern.from_matrix(A_k_large).weights(y_large, q), f), "Diversity weights are wrong"
+
+# A sparse y_large, as a column or a row, gives the same weights and the same MinDivLP solution
+y_large_sparse = csc_matrix(y_large.reshape(-1, 1))
+for y in [y_large_sparse, y_large_sparse.T]:
+    assert np.allclose(SupportPattern.from_matrix(A_k_large).weights(y, q), f), "Weights of a sparse y are wrong"
+assert np.allclose(MinDivLP(A_k_small, A_k_large, y_small, y_large_sparse, 10000, q),
+                   MinDivLP(A_k_small, A_k_large, y_small, y_large, 10000, q)), "MinDivLP differs on a sparse y_large"
+
+with tempfile.TemporaryDirectory() as directory:
+    mat_file = os.path.join(directory, "reference.fasta_A_12.mat")
+    sio.savemat(mat_file, {'A_k': A_k_large})
+
+    pattern = SupportPattern.for_matrix_file(mat_file)
+    assert os.path.isdir(os.path.join(directory, "reference.fasta_A_12_pattern")), "The pattern was not saved"
+    assert pattern.indices.dtype == np.int32 and isinstance(pattern.indices, np.memmap), "The pattern is not mapped"
+    assert list(pattern.column_nnz) == list(np.diff(A_k_large.indptr)), "Column nonzero counts are wrong"
+    assert pattern.shape == A_k_large.shape, "The pattern has the wrong shape"
+    assert np.allclose(pattern.weights(y_large, q), f), "Diversity weights of the saved pattern are wrong"
+    assert SupportPattern.for_matrix_file(mat_file) is pattern, "The pattern was not cached"
+
+    # MinDivLP accepts the pattern in place of A_k_large
+    x_pattern = MinDivLP(A_k_small, pattern, y_small, y_large, 10000, q)
+    x_matrix = MinDivLP(A_k_small, A_k_large, y_small, y_large, 10000, q)
+    assert np.allclose(x_pattern, x_matrix), "MinDivLP differs when given the support pattern"
+    del pattern, x_pattern  # release the memory maps before the directory is removed
+
+print("Tests passed successfully!")
@@ -0,0 +1,88 @@
+import sys
+import os
+import numpy as np
+from scipy.optimize import nnls
+from scipy.sparse import csc_matrix, random as sparse_random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from PythonCode.src.sparse_nnls import sparse_nnls, ActiveColumns, GramCache, SolverStats
+
+## Checks that every sparse_nnls method agrees with scipy's dense nnls on a small random problem
+
+rng = np.random.default_rng(0)
+m, n, support_size = 100, 40, 10
+C = sparse_random(m, n, density=0.3, random_state=2, format='csc')
+x_true = np.zeros(n)
+x_true[rng.choice(n, size=support_size, replace=False)] = rng.random(support_size)
+d = C @ x_true + 1e-3 * rng.standard_normal(m)
+
+x_nnls = nnls(C.toarray(), d)[0]
+
+thresh = 1e-6
+for method in ['lsqr', 'qr', 'gram', 'auto']:
+    x_snnls = sparse_nnls(C, d, method=method)
+    assert np.max(np.abs(x_snnls - x_nnls)) < thresh, f"sparse_nnls with method={method} differs from nnls"
+
+    # Admitting several columns per outer iteration reaches the same solution
+    x_snnls = sparse_nnls(C, d, method=method, block_size=5)
+    assert np.max(np.abs(x_snnls - x_nnls)) < thresh, f"block pivoting with method={method} differs from nnls"
+
+# The QR factorization survives a positive set of m columns losing one (a wide problem that fills the positive set)
+C_wide = sparse_random(6, 58, density=0.6, random_state=3, format='csc')
+d_wide = np.random.default_rng(3).random(6)
+stats = SolverStats()
+x_snnls = sparse_nnls(C_wide, d_wide, method='qr', stats=stats)
+assert max(stats.active_set_sizes) == 6 and stats.inner_iterations > 0, "The positive set did not fill up and shrink"
+assert np.max(np.abs(x_snnls - nnls(C_wide.toarray(), d_wide)[0])) < thresh, "qr differs from nnls on a wide problem"
+
+# Dependent and duplicate columns are kept out of the positive set by the factorization methods
+C_dup = csc_matrix(np.array([[1., 1., 0., 2.], [0., 0., 1., 1.], [1., 1., 0., 2.]]))
+d_dup = np.array([1., 2., 1.])
+for method in ['qr', 'gram']:
+    for block_size in [1, 4]:
+        x_snnls = sparse_nnls(C_dup, d_dup, method=method, block_size=block_size)
+        assert np.isclose(np.linalg.norm(C_dup @ x_snnls - d_dup), nnls(C_dup.toarray(), d_dup)[1]), \
+            f"method={method} with block_size={block_size} fails on dependent columns"
+# an iteration whose column is numerically in the span of the positive set admits nothing but is still recorded
+C_near = csc_matrix(np.array([[1., 0., 1e9], [0., 1., -1e9], [0., 0., 0.5]]))
+for method in ['qr', 'gram']:
+    stats = SolverStats()
+    sparse_nnls(C_near, np.ones(3), method=method, stats=stats)
+    assert stats.outer_iterations == len(stats.active_set_sizes) == 3 and stats.active_set_sizes[-1] == 2, \
+        f"An iteration admitting no column was not recorded by method={method}"
+
+# Warm started lsqr reaches the same solution
+iteration_counts = []
+x_snnls = sparse_nnls(C, d, warm_start=True, iteration_counts=iteration_counts)
+assert np.max(np.abs(x_snnls - x_nnls)) < thresh, "warm started sparse_nnls differs from nnls"
+assert len(iteration_counts) > 0, "lsqr iteration counts were not recorded"
+
+# Solver statistics are recorded without changing the solution
+for method in ['lsqr', 'gram']:
+    stats = SolverStats()
+    x_snnls = sparse_nnls(C, d, method=method, stats=stats)
+    assert np.max(np.abs(x_snnls - x_nnls)) < thresh, f"sparse_nnls with stats and method={method} differs from nnls"
+    assert stats.method == method and stats.outer_iterations == len(stats.active_set_sizes) > 0, "Stats are wrong"
+    assert stats.active_set_sizes[-1] == np.sum(x_snnls > 0), "The final active set size is wrong"
+    assert np.isclose(stats.residual_norm, np.linalg.norm(C @ x_snnls - d)), "The final residual is wrong"
+    assert (len(stats.lsqr_iterations) == stats.solves) == (method == 'lsqr'), "lsqr iterations were not recorded"
+    assert '"outer_iterations"' in stats.to_json(), "Stats do not export to JSON"
+
+# A Gram cache shared between calls (and bounded in size) gives the same solution
+gram = GramCache(C, max_columns=2 * support_size)
+for _ in range(2):
+    x_snnls = sparse_nnls(C, d, gram=gram)
+    assert np.max(np.abs(x_snnls - x_nnls)) < thresh, "sparse_nnls with a shared GramCache differs from nnls"
+
+# The active column operator matches slicing C as columns come and go
+active = ActiveColumns(C)
+for j in [3, 17, 5, 30, 8]:
+    active.add(j)
+active.remove(np.array([17, 8]))
+active.add(21)
+assert list(active.cols) == [3, 5, 30, 21], "Active columns are not kept in insertion order"
+x_active = rng.random(4)
+assert np.allclose(active.matvec(x_active), C[:, [3, 5, 30, 21]] @ x_active), "Active column matvec is wrong"
+assert np.allclose(active.rmatvec(d), C[:, [3, 5, 30, 21]].T @ d), "Active column rmatvec is wrong"
+
+print("Tests passed successfully!")